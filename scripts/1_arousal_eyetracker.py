@@ -1,5 +1,5 @@
 # Authors: Kruthi Gollapudi (kruthig@uchicago.edu), Jadyn Park (jadynpark@uchicago.edu)
-# Last Edited: Jan 26, 2024
+# Last Edited: October 19, 2026
 # Description: Task script adopted from Kannon Bhattacharyya and Zishan Su.
 # The script continuously records eyetracking data while showing visual 
 # stimulus and recording verbal responses.
@@ -9,6 +9,7 @@ from __future__ import absolute_import, division, print_function
 import psychopy
 import pandas as pd
 import os
+import sys
 import time
 import psychtoolbox as ptb
 from psychopy import visual, core, event, iohub, data, gui, logging, sound
@@ -17,9 +18,16 @@ from psychopy.iohub.util import hideWindow, showWindow
 from psychopy.sound import Microphone
 from psychopy.hardware.keyboard import Keyboard
 from psychopy.constants import PLAYING, PAUSED
-from pylsl import StreamInfo, StreamOutlet
+from pupil_stream import PupilStreamPublisher
+from session_log import SessionEventLog, consolidate_log
+from recall_recorder import RecallRecorder
+from frame_timing import TimingAudit
+from session_handoff import start_handoff
 
-paranoia_length = 1320 # Length of stim in seconds
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'preprocessing'))
+from session_index import DEFAULT_INDEX, session_key, story_info, load_index
+
+AUDIO_LEAD = 0.25 # Time (s) between scheduling the story audio and its onset; must cover the STORY_START message round trip
 
 # psychopy.useVersion('2022.2.2')
 
@@ -43,6 +51,12 @@ KS = 1
 # =============================
 REC = 1
 
+# ===================================================
+# Toggle live pupil stream (LSL, see online_pupil.py):
+# 0=Don't stream, 1=Stream
+# ===================================================
+LSL = 1
+
 #------------------------------- Initialize -------------------------------#
 
 # Ensure that relative paths start from the same directory as this script
@@ -52,13 +66,22 @@ os.chdir(_thisDir)
 # Store info about the experiment session
 psychopyVersion = 'v2022.2.5'
 expName = 'paranoia'
-expInfo = {'participant': ''}
+expInfo = {'participant': '', 'story': 'paranoia', 'session': 1}
 
 # Get participant ID via dialog
 dlg = gui.DlgFromDict(dictionary=expInfo, sortKeys=False, title=expName)
 if dlg.OK == False:
     core.quit() # If user pressed cancel
 expInfo['date'] = data.getDateStr() # Add a simple timestamp
+expInfo['session'] = int(expInfo['session'])
+
+# Stimulus is stimuli/<story>.wav; its length (s) is taken from the session index when the story is listed there
+story_length = 1320
+if os.path.exists(DEFAULT_INDEX):
+    try:
+        story_length = story_info(load_index(DEFAULT_INDEX), expInfo['story'])[1]
+    except ValueError:
+        pass
 expInfo['expName'] = expName
 expInfo['psychopyVersion'] = psychopyVersion
 
@@ -74,6 +97,12 @@ win = visual.Window(
 )
 win.mouseVisible = False
 
+# Timing audit (flip times, dropped frames, audio onset latency, tracker round trips), saved as filename + '_timing.npz'
+frameRate = win.getActualFrameRate()
+if frameRate is None: # refresh rate couldn't be measured
+    frameRate = 60.0
+timing = TimingAudit(1 / frameRate)
+
 # Setup central circle
 crossCentralBlack = visual.TextStim(
     win=win, 
@@ -96,18 +125,16 @@ crossCentralBlack = visual.TextStim(
 path = os.path.join(_thisDir, '..', 'data')
 
 # Data file name
-filename = os.path.join(path, '%s_%s_%s' % (expInfo['participant'], expName, expInfo['date']))
+filename = os.path.join(path, '%s_%s_%s' % (session_key(expInfo['participant'], expInfo['session']),
+                                             expInfo['story'], expInfo['date']))
 
 # Save a log file for detail verbose info
 logFile = logging.LogFile(filename + '.log', level=logging.EXP)
 logging.console.setLevel(logging.WARNING)
 
-# Store participant ID and timestamps 
-df = {'id': [expInfo['participant']]}
-dfTimeStamps = pd.DataFrame(df)  
-
-# Save df to csv
-dfTimeStamps.to_csv(filename + '_timestamps.csv', index=False)
+# Store participant ID and timestamps in an append-only event log (written by a background thread);
+# it is consolidated into filename + '_timestamps.csv' at the end of the session
+eventLog = SessionEventLog(filename + '_events.log', expInfo['participant'])
 
 #------------------------- Experiment Settings ----------------------------#
 
@@ -118,12 +145,13 @@ dfTimeStamps.to_csv(filename + '_timestamps.csv', index=False)
 if REC == 1: 
     recordingDevicesList = Microphone.getDevices()
     device=recordingDevicesList[0] # Double check that this corresponds to the external mic!
-    mic = Microphone(streamBufferSecs=3000.0,
-                        sampleRateHz=48000,
-                        device=recordingDevicesList[0],
+    # Recall audio is written to filename + '.wav' in 0.1 s chunks while recording (10 s capture buffer)
+    mic = RecallRecorder(filename + '.wav',
+                        device_index=device.deviceIndex,
+                        sample_rate=48000,
                         channels=1,
-                        maxRecordingSize=300000,
-                        audioRunMode=0
+                        chunk_secs=0.1,
+                        buffer_secs=10.0
     )
 
 
@@ -156,6 +184,13 @@ keyboard = io.getDevice('keyboard')
 kb = Keyboard(waitForStart=True) # JP: clock?
 tracker = io.getDevice('tracker')
 
+# ==========
+# LSL setup
+# ==========
+pupilStream = None
+if LSL == 1 and tracker is not None:
+    pupilStream = PupilStreamPublisher(tracker, sampling_rate=500)
+
 # =====================
 # Quit experiment setup
 # =====================
@@ -222,7 +257,7 @@ waitInstructions = visual.TextStim(
 paranoiaIntroInstructions = visual.TextStim(
     win=win,
     name='instrVideoIntro',
-    text="In this study, you will be listening to a story. \n The story is just over 20 minutes long in total. \n Following the story, you will be asked to recount what you heard. \n\n\n\n\n\nPress ENTER to continue.",
+    text="In this study, you will be listening to a story. \n The story is about %d minutes long in total. \n Following the story, you will be asked to recount what you heard. \n\n\n\n\n\nPress ENTER to continue." % round(story_length / 60),
     font='Arial',
     pos=[0, 0], height=36, color='black', units='pix', colorSpace='rgb',
     wrapWidth=win.size[0] * 0.9
@@ -299,7 +334,7 @@ finishInstructions = visual.TextStim(
 #--------------------------- Start Experiment -----------------------------#
 
 # Get stimulus
-paranoia = sound.Sound(_thisDir + os.sep + '../stimuli/paranoia.wav', stereo=True)
+paranoia = sound.Sound(_thisDir + os.sep + '../stimuli/' + expInfo['story'] + '.wav', stereo=True)
 
 # Prep for ET calibration
 startInstructions.draw()
@@ -335,13 +370,6 @@ paranoiaBeginInstructions.draw()
 win.flip()
 keys = event.waitKeys(keyList=["return"])
 
-# ==============================
-# Send story start message to ET
-# ==============================
-if ET == 1:
-    tracker.sendMessage("STORY_START")
-    dfTimeStamps.loc[0, 'startETStory'] = mainExpClock.getTime()
-
 # ==============
 # Begin stimulus
 # ==============
@@ -350,20 +378,42 @@ if ET == 1:
 crossCentralBlack.draw()
 win.flip()
 
-# Record start time
-dfTimeStamps.loc[0, 'storyStart'] = mainExpClock.getTime()
-dfTimeStamps.to_csv(filename + '_timestamps.csv', index=False)  # Save partial data
+# Offset between the psychtoolbox (audio) clock and the psychopy/iohub clock
+ptbOffset = ptb.GetSecs() - core.getTime()
+
+# Schedule audio onset at a known ptb time
+audioOnset = ptb.GetSecs() + AUDIO_LEAD
+paranoia.play(when=audioOnset)
+
+# ==============================
+# Send story start message to ET
+# ==============================
+# The message carries the delay (ms) from the message to the scheduled audio onset, so
+# 1_align_pupil can place the audio onset on the tracker clock
+if ET == 1:
+    msgSent = ptb.GetSecs()
+    tracker.sendMessage("STORY_START AUDIO_ONSET_MS=%.3f" % (1000 * (audioOnset - msgSent)))
+    msgReturned = ptb.GetSecs()
+    timing.record_message("STORY_START", msgSent, msgReturned)
+    eventLog.log('startETStory', msgSent - ptbOffset - mainExpClock.getLastResetTime())
+    eventLog.log('startETStoryRoundTrip', msgReturned - msgSent)
+if pupilStream is not None:
+    pupilStream.discard() # drop samples buffered during the instructions
+    pupilStream.push_marker("STORY_START", audioOnset - ptbOffset)
+
+# Record start time (audio onset)
+eventLog.log('storyStart', audioOnset - ptbOffset - mainExpClock.getLastResetTime())
 
-# Play audio
-paranoia.play()
 paused = False
 pause_count = 0
+keyboard.getPresses() # clear key presses from the instructions
 
-# Keep the dot until the audio finishes playing
+# Keep the dot until the audio finishes playing; the loop is locked to the screen refresh by win.flip()
 while paranoia.status == PLAYING or paused:
     
-    # Check for key presses
-    keys = event.getKeys(keyList=['k', 'p'])
+    # Check for key presses (iohub events carry the time of the key press)
+    presses = keyboard.getPresses(keys=['k', 'p'])
+    keys = [press.key for press in presses]
     
     # To end audio
     if 'k' in keys: # K for kill
@@ -371,37 +421,44 @@ while paranoia.status == PLAYING or paused:
             paranoia.stop(reset=True)
             break
     elif 'p' in keys: # P for pause
+        keyTime = presses[keys.index('p')].time - mainExpClock.getLastResetTime()
         if not paused:
             # Pause the audio
             paranoia.pause()
-            dfTimeStamps.loc[pause_count, 'storyPause'] = mainExpClock.getTime()
-            dfTimeStamps.to_csv(filename + '_timestamps.csv', index=False)  # Save partial data
+            eventLog.log('storyPause', mainExpClock.getTime(), row=pause_count)
+            eventLog.log('storyPauseKey', keyTime, row=pause_count)
             paused = True
         else:
             paranoia.play()
-            dfTimeStamps.loc[pause_count, 'storyRestart'] = mainExpClock.getTime()
-            dfTimeStamps.to_csv(filename + '_timestamps.csv', index=False)  # Save partial data
+            eventLog.log('storyRestart', mainExpClock.getTime(), row=pause_count)
+            eventLog.log('storyRestartKey', keyTime, row=pause_count)
             paused = False
             pause_count +=1
             
-    # Redraw the dot to keep on screen
+    # Forward new pupil samples to the live stream
+    if pupilStream is not None:
+        pupilStream.pump()
+
+    # Actual audio onset, read once playback has started (before any pause restarts the stream)
+    if not timing.audio and ptb.GetSecs() > audioOnset + 0.1:
+        timing.audio_onset(paranoia, audioOnset)
+
+    # Redraw the dot to keep on screen (blocks until the next screen refresh)
     crossCentralBlack.draw()
-    win.flip()
-    
-    # Keep window open until audio finishes playing 
-    core.wait(0.1)
+    timing.flip(win.flip())
             
  
 # record end time
-dfTimeStamps.loc[0,'storyEnd'] = mainExpClock.getTime()
-dfTimeStamps.to_csv(filename + '_timestamps.csv', index=False)  # save partial data
+eventLog.log('storyEnd', mainExpClock.getTime())
 
 # ============================
 # Send story end message to ET
 # ============================
 if ET == 1:
-    tracker.sendMessage("STORY_END")
-    dfTimeStamps.loc[0, 'endETStory'] = mainExpClock.getTime()
+    timing.send_message(tracker, "STORY_END")
+    eventLog.log('endETStory', mainExpClock.getTime())
+if pupilStream is not None:
+    pupilStream.push_marker("STORY_END")
 
 # show instruction: break
 breakInstructions.draw()
@@ -426,40 +483,50 @@ keys = event.waitKeys(keyList=["return"])
 # ==================================
 # Send recording start message to ET
 # ==================================
+recStartSent = ptb.GetSecs()
 if ET == 1:
-    tracker.sendMessage("REC_START")
-    dfTimeStamps.loc[0, 'startETVoiceRec'] = mainExpClock.getTime()
+    timing.send_message(tracker, "REC_START")
+    eventLog.log('startETVoiceRec', mainExpClock.getTime())
+if pupilStream is not None:
+    pupilStream.pump()
+    pupilStream.push_marker("REC_START")
 
-# start recording
-mic.start()
+# start recording; chunk times are saved relative to REC_START
+if REC == 1:
+    recordOnset = mic.start(rec_start=recStartSent)
 
-# record start time
-dfTimeStamps.loc[0,'recordStart'] = mainExpClock.getTime()
-dfTimeStamps.to_csv(filename + '_timestamps.csv', index=False)  # save partial data
+    # record start time (first recorded sample)
+    eventLog.log('recordStart', recordOnset - ptbOffset - mainExpClock.getLastResetTime())
 
 # show central white dot during recording
 crossCentralBlack.draw()
 win.flip()
-keys = event.waitKeys(keyList=["return"])
-
-# stop recording
-mic.stop()
+if pupilStream is not None:
+    # Keep streaming pupil samples while waiting for the end of the recall
+    while not event.getKeys(keyList=["return"]):
+        pupilStream.pump()
+        core.wait(0.01)
+else:
+    keys = event.waitKeys(keyList=["return"])
+
+# stop recording and close the audio file
+if REC == 1:
+    recordLength = mic.stop()
+    if mic.n_overflows > 0:
+        print("WARNING: recall audio capture buffer overflowed", mic.n_overflows, "times")
 
 # record end time
-dfTimeStamps.loc[0,'recordEnd'] = mainExpClock.getTime()
-dfTimeStamps.to_csv(filename + '_timestamps.csv', index=False)  # save data
+eventLog.log('recordEnd', mainExpClock.getTime())
 
 # ==================================
 # Send recording end message to ET
 # ==================================
 if ET == 1:
     print("test  print")
-    tracker.sendMessage("REC_END")
-    dfTimeStamps.loc[0, 'endETVoiceRec'] = mainExpClock.getTime()
-
-# save audio
-audioClip = mic.getRecording()
-audioClip.save(filename + '.wav')
+    timing.send_message(tracker, "REC_END")
+    eventLog.log('endETVoiceRec', mainExpClock.getTime())
+if pupilStream is not None:
+    pupilStream.push_marker("REC_END")
 
 # show instruction: finish
 finishInstructions.draw()
@@ -481,11 +548,19 @@ if ET == 1:
 # Quit IO Hub
 io.quit()
 
-# Export participant ET data
+# Write the remaining events and save the timestamps in the wide csv layout
+eventLog.close()
+consolidate_log(filename + '_events.log', filename + '_timestamps.csv')
+
+# Save the timing audit
+timingSummary = timing.save(filename + '_timing.npz')
+print("Timing:", timingSummary)
+
+# Export participant ET data: retrieval, checksum, conversion to _ET.mat and stage 1 alignment run in the
+# background (see session_handoff.py), so the next participant can start right away
 if ET == 1:
-    edf_root = ''
-    edf_file = edf_root + '/' + filename + '.EDF'
-    os.rename('et_data.EDF', edf_file)
+    start_handoff(os.path.join(_thisDir, 'et_data.EDF'), expInfo['participant'], filename,
+                  expInfo['story'], expInfo['session'])
 
 # Close experiment
 core.quit()
@@ -0,0 +1,209 @@
+# Authors: Kruthi Gollapudi (kruthig@uchicago.edu), Jadyn Park (jadynpark@uchicago.edu)
+# Last Edited: October 19, 2026
+# Description: Times and memory-profiles every preprocessing stage on synthetic sessions (see synthetic_sessions.py)
+# at several cohort sizes and kernel backends (NumPy / Numba, see preprocessing/pupil_kernels_numba.py). Before timing,
+# the backends are checked for identical results (check_backends.py). Results are saved as JSON in results/ so that runs can be compared
+# for regressions.
+# Usage: python bench_stages.py [--sizes 10 100 1000] [--backends numpy numba] [--compare results/<earlier run>.json]
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+_thisDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(_thisDir, '..', 'preprocessing'))
+from pupil_io import fetch_mat
+from pupil_kernels import average_downsample, get_kernels
+import pupil_kernels_numba
+from isc_utils import isc_loo, bootstrap_isc
+from synthetic_sessions import make_session, generate_cohort, FIRST_SUB_ID
+from check_backends import check_backends, story_segment, F_SAMPLE, F_DOWNSAMPLE
+
+RESULTS_PATH = os.path.join(_thisDir, 'results')
+
+
+# ------------------ Define functions ------------------ #
+def measure(func, *args, memory=False):
+    """
+    Runs func(*args) and returns (result, wall time in s, peak traced memory in MB or None).
+    """
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args)
+    wall = time.perf_counter() - start
+    peak = None
+    if memory:
+        peak = tracemalloc.get_traced_memory()[1] / 1e6
+        tracemalloc.stop()
+
+    return result, wall, peak
+
+
+def run_benchmarks(n_subjects, duration, n_boot, max_files, seed=0, backend='numpy', cohort=True):
+    """
+    Benchmarks all stages for a cohort of n_subjects with the kernels of one backend.
+
+    Per-subject stages run on every subject (sessions are simulated in memory, outside the timed region);
+    fetch_mat reads up to max_files generated files cyclically. Peak memory is traced on the first subject
+    (per-subject stages) or in a second, untimed run (cohort stages). The first call of a compiled kernel is
+    timed separately (as 'jit_compile'), so compilation doesn't count toward the per-subject times.
+    The cohort stages (ISC, bootstrap) don't use the kernels; cohort=False skips them.
+
+    Returns:
+        records: (list of dict) one record per stage
+    """
+    kernels = get_kernels(backend)
+    calculate_noise, interpolate_zero_runs, clean_by_TR = kernels['calculate_noise'], kernels['interpolate_zero_runs'], kernels['clean_by_TR']
+
+    records = []
+    if backend != 'numpy':
+        samples, events = make_session(FIRST_SUB_ID, duration=10, seed=seed)
+        pupilSize = story_segment(samples, events)
+        start = time.perf_counter()
+        calculate_noise(pupilSize, np.insert(np.diff(pupilSize), 0, 0), 0.25, 0.0, 0.0)
+        clean_by_TR(average_downsample(interpolate_zero_runs(pupilSize, F_SAMPLE), F_SAMPLE / F_DOWNSAMPLE), F_DOWNSAMPLE, 1, 0.5)
+        records.append({'stage': 'jit_compile', 'backend': backend, 'n_subjects': n_subjects,
+                        'wall_s': time.perf_counter() - start, 'per_subject_ms': None, 'peak_mb': None, 'samples_per_s': None})
+
+    timings = {stage: [] for stage in ['fetch_mat', 'calculate_noise', 'interpolate_blinks', 'average_downsample', 'compute_epoch_noise']}
+    peaks = {}
+    n_samples = {stage: 0 for stage in timings}
+    by_TR = []
+
+    with tempfile.TemporaryDirectory() as mat_path:
+        file_ids = generate_cohort(mat_path, min(n_subjects, max_files), duration=duration, seed=seed)
+
+        for i, sub in enumerate(range(FIRST_SUB_ID, FIRST_SUB_ID + n_subjects)):
+            memory = i == 0
+
+            (samples, events), wall, peak = measure(fetch_mat, mat_path, file_ids[i % len(file_ids)], memory=memory)
+            timings['fetch_mat'].append(wall)
+            n_samples['fetch_mat'] += len(samples['time'])
+            peaks.setdefault('fetch_mat', peak)
+
+            samples, events = make_session(sub, duration=duration, seed=seed)
+            pupilSize = story_segment(samples, events)
+
+            # Stage 2 thresholds (1 SD) from this subject, as a stand-in for the group statistics
+            differences = np.insert(np.diff(pupilSize), 0, 0)
+            lower_lim = np.mean(pupilSize) - np.std(pupilSize)
+            diff_thresh = np.mean(differences) + np.std(differences)
+            _, wall, peak = measure(calculate_noise, pupilSize, differences, 0.25, diff_thresh, lower_lim, memory=memory)
+            timings['calculate_noise'].append(wall)
+            n_samples['calculate_noise'] += len(pupilSize)
+            peaks.setdefault('calculate_noise', peak)
+
+            pupilSize, wall, peak = measure(interpolate_zero_runs, pupilSize, F_SAMPLE, memory=memory)
+            timings['interpolate_blinks'].append(wall)
+            n_samples['interpolate_blinks'] += len(pupilSize)
+            peaks.setdefault('interpolate_blinks', peak)
+
+            downsampled, wall, peak = measure(average_downsample, pupilSize, F_SAMPLE / F_DOWNSAMPLE, memory=memory)
+            timings['average_downsample'].append(wall)
+            n_samples['average_downsample'] += len(pupilSize)
+            peaks.setdefault('average_downsample', peak)
+
+            data_by_TR, wall, peak = measure(clean_by_TR, downsampled, F_DOWNSAMPLE, 1, 0.5, memory=memory)
+            timings['compute_epoch_noise'].append(wall)
+            n_samples['compute_epoch_noise'] += len(downsampled)
+            peaks.setdefault('compute_epoch_noise', peak)
+
+            by_TR.append(pd.Series(data_by_TR, name=str(sub)))
+
+    for stage, walls in timings.items():
+        records.append({'stage': stage, 'backend': backend, 'n_subjects': n_subjects, 'wall_s': float(np.sum(walls)),
+                        'per_subject_ms': 1000 * float(np.mean(walls)), 'peak_mb': peaks[stage],
+                        'samples_per_s': n_samples[stage] / float(np.sum(walls))})
+
+    if not cohort:
+        return records
+
+    # Cohort stages on the subjects x TR matrix
+    pupilSize_by_sub = pd.concat(by_TR, axis=1)
+
+    def all_isc_loo(df):
+        return [isc_loo(df, i) for i in range(df.shape[1])]
+
+    for stage, func, args in [('isc_loo', all_isc_loo, (pupilSize_by_sub,)),
+                              ('bootstrap', bootstrap_isc, (pupilSize_by_sub, n_boot, seed))]:
+        _, wall, _ = measure(func, *args)
+        _, _, peak = measure(func, *args, memory=True)
+        records.append({'stage': stage, 'backend': backend, 'n_subjects': n_subjects, 'wall_s': wall,
+                        'per_subject_ms': 1000 * wall / n_subjects, 'peak_mb': peak,
+                        'samples_per_s': pupilSize_by_sub.size / wall})
+        if stage == 'bootstrap':
+            records[-1]['n_boot'] = n_boot
+
+    return records
+
+
+def compare(records, baseline_file, tolerance=1.2):
+    """
+    Prints the wall time of each stage relative to an earlier run; ratios above tolerance are flagged.
+    """
+    with open(baseline_file) as f:
+        baseline = {(r['stage'], r.get('backend', 'numpy'), r['n_subjects']): r for r in json.load(f)['records']}
+
+    print('\nstage                backend  n_subjects   wall_s   baseline   ratio')
+    for r in records:
+        base = baseline.get((r['stage'], r['backend'], r['n_subjects']))
+        if base is None:
+            continue
+        ratio = r['wall_s'] / base['wall_s']
+        flag = '  REGRESSION' if ratio > tolerance else ''
+        print(f"{r['stage']:<20} {r['backend']:<7} {r['n_subjects']:>10} {r['wall_s']:>8.3f} {base['wall_s']:>10.3f} {ratio:>7.2f}{flag}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the pupil preprocessing stages')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000], help='cohort sizes')
+    parser.add_argument('--duration', type=float, default=1320, help='story length (s)')
+    parser.add_argument('--n-boot', type=int, default=20, help='bootstrap iterations to time')
+    parser.add_argument('--max-files', type=int, default=10, help='number of .mat files to generate for fetch_mat')
+    parser.add_argument('--backends', nargs='+', default=['numpy', 'numba'], help='kernel backends to compare')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    args = parser.parse_args()
+
+    backends = [b for b in args.backends if b != 'numba' or pupil_kernels_numba.AVAILABLE]
+    if backends != args.backends:
+        print('numba is not installed, skipping the numba backend')
+
+    check_backends(backends, min(args.duration, 120))
+    print('Kernel results identical across backends:', ', '.join(backends))
+
+    records = []
+    for n_subjects in args.sizes:
+        for i, backend in enumerate(backends):
+            for r in run_benchmarks(n_subjects, args.duration, args.n_boot, args.max_files, backend=backend, cohort=i == 0):
+                if r['per_subject_ms'] is None:
+                    print(f"{r['stage']:<20} {r['backend']:<6} n={r['n_subjects']:<5} {r['wall_s']:9.3f} s")
+                else:
+                    print(f"{r['stage']:<20} {r['backend']:<6} n={r['n_subjects']:<5} {r['wall_s']:9.3f} s  "
+                          f"{r['per_subject_ms']:9.2f} ms/sub  peak {r['peak_mb']:8.1f} MB")
+                records.append(r)
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=_thisDir, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ''
+
+    if not os.path.exists(RESULTS_PATH):
+        os.makedirs(RESULTS_PATH)
+    filename = os.path.join(RESULTS_PATH, 'bench_' + time.strftime('%Y%m%d_%H%M%S') + '.json')
+    with open(filename, 'w') as f:
+        json.dump({'commit': commit, 'python': platform.python_version(), 'numpy': np.__version__,
+                   'numba': pupil_kernels_numba.numba.__version__ if pupil_kernels_numba.AVAILABLE else None,
+                   'machine': platform.platform(), 'duration': args.duration, 'records': records}, f, indent=1)
+    print('Saved', filename)
+
+    if args.compare:
+        compare(records, args.compare)
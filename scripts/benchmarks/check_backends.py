@@ -0,0 +1,113 @@
+# Authors: Kruthi Gollapudi (kruthig@uchicago.edu), Jadyn Park (jadynpark@uchicago.edu)
+# Last Edited: October 19, 2026
+# Description: Equivalence check of the kernel backends (NumPy / Numba, see preprocessing/pupil_kernels_numba.py).
+# Runs every compiled kernel and its NumPy counterpart on the same synthetic sessions (synthetic_sessions.py), in
+# float64 and float32, and compares results, dtypes and QC counters exactly. Also run by bench_stages.py before timing.
+# Exits with status 1 if any result differs, or if numba isn't installed (nothing to compare).
+# Usage: python check_backends.py [--n-sessions 5] [--duration 300]
+
+import argparse
+import os
+import sys
+import numpy as np
+
+_thisDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(_thisDir, '..', 'preprocessing'))
+from pupil_kernels import average_downsample, get_kernels
+import pupil_kernels_numba
+from synthetic_sessions import make_session, FIRST_SUB_ID
+
+F_SAMPLE = 500
+F_DOWNSAMPLE = 50
+
+
+# ------------------ Define functions ------------------ #
+def story_segment(samples, events, key='pupilSize'):
+    """
+    Pupil samples (or another channel, e.g. key='posX') between STORY_START and STORY_END, as cut out by stage 1.
+    """
+    info = events['Messages']['info']
+    msg_time = events['Messages']['time']
+    start, end = np.searchsorted(samples['time'], [msg_time[info.index('STORY_START')], msg_time[info.index('STORY_END')]])
+
+    return np.array(samples[key][start:end], dtype=float)
+
+
+def backend_mismatches(backend, pupilSize):
+    """
+    Runs the kernels of a backend and the NumPy kernels on the same session and lists every difference.
+
+    Params:
+        backend: (str) backend to check against NumPy
+        pupilSize: (np.ndarray) story segment of a session, in the dtype to check
+
+    Returns:
+        mismatches: (list of str) one description per kernel whose result, dtype or QC counters differ
+    """
+    reference = get_kernels('numpy')
+    kernels = get_kernels(backend)
+
+    differences = np.insert(np.diff(pupilSize), 0, 0)
+    lower_lim = np.mean(pupilSize, dtype=np.float64) - np.std(pupilSize, dtype=np.float64)
+    diff_thresh = np.mean(differences, dtype=np.float64) + np.std(differences, dtype=np.float64)
+    downsampled = average_downsample(reference['interpolate_zero_runs'](pupilSize.copy(), F_SAMPLE), F_SAMPLE / F_DOWNSAMPLE)
+
+    calls = {'zero_runs': ((pupilSize,), False),
+             'interpolate_zero_runs': ((pupilSize, F_SAMPLE), True),
+             'calculate_noise': ((pupilSize, differences, 0.25, diff_thresh, lower_lim), True),
+             'clean_by_TR': ((downsampled, F_DOWNSAMPLE, 1, 0.5), True)}
+
+    mismatches = []
+    for name, (args, has_qc) in calls.items():
+        # Some kernels work in place, so each call gets fresh copies of the arrays
+        expected_qc, result_qc = {}, {}
+        expected_kwargs, result_kwargs = ({'qc': expected_qc}, {'qc': result_qc}) if has_qc else ({}, {})
+        expected = reference[name](*[arg.copy() if isinstance(arg, np.ndarray) else arg for arg in args], **expected_kwargs)
+        result = kernels[name](*[arg.copy() if isinstance(arg, np.ndarray) else arg for arg in args], **result_kwargs)
+
+        if not np.array_equal(np.asarray(result), np.asarray(expected), equal_nan=True):
+            mismatches.append(f'{name}: results differ')
+        if np.asarray(result).dtype != np.asarray(expected).dtype:
+            mismatches.append(f'{name}: dtype {np.asarray(result).dtype} instead of {np.asarray(expected).dtype}')
+        if result_qc != expected_qc:
+            mismatches.append(f'{name}: QC counters {result_qc} instead of {expected_qc}')
+
+    return mismatches
+
+
+def check_backends(backends, duration, seed=0, n_sessions=1):
+    """
+    Checks every backend against NumPy on n_sessions synthetic sessions, in float64 and float32.
+    Raises an AssertionError listing the differences, if there are any.
+    """
+    mismatches = []
+    for sub in range(FIRST_SUB_ID, FIRST_SUB_ID + n_sessions):
+        samples, events = make_session(sub, duration=duration, seed=seed)
+        for dtype in (np.float64, np.float32):
+            pupilSize = story_segment(samples, events).astype(dtype)
+            for backend in backends:
+                if backend == 'numpy':
+                    continue
+                mismatches += [f'{backend} sub {sub} {np.dtype(dtype).name} {m}' for m in backend_mismatches(backend, pupilSize)]
+
+    assert not mismatches, 'Backends differ from numpy:\n' + '\n'.join(mismatches)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check that the numba kernels give the same results as the numpy kernels')
+    parser.add_argument('--n-sessions', type=int, default=5, help='synthetic sessions to compare on')
+    parser.add_argument('--duration', type=float, default=300, help='story length (s) of each session')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if not pupil_kernels_numba.AVAILABLE:
+        print('numba is not installed, nothing to compare')
+        sys.exit(1)
+
+    try:
+        check_backends(['numba'], args.duration, args.seed, args.n_sessions)
+    except AssertionError as e:
+        print(e)
+        sys.exit(1)
+
+    print('numba kernels identical to numpy on', args.n_sessions, 'sessions (float64 and float32)')
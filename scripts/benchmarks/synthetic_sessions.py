@@ -0,0 +1,147 @@
+# Authors: Kruthi Gollapudi (kruthig@uchicago.edu), Jadyn Park (jadynpark@uchicago.edu)
+# Last Edited: October 19, 2026
+# Description: Deterministic generator of synthetic EyeLink sessions shaped like the <sub>_ET.mat files read by
+# stage 1 (MATLAB v7.3, Samples/Events structs as written by edf2mat): 500 Hz samples with a slowly drifting pupil,
+# blinks (zeros, with matching Sblink/Eblink events), longer dropouts, and STORY_START/STORY_END messages.
+# Usage: python synthetic_sessions.py <out_dir> [--n-subjects 10] [--duration 1320]
+
+import argparse
+import os
+import h5py
+import numpy as np
+from scipy.signal import lfilter
+
+FIRST_SUB_ID = 1002
+
+
+# ------------------ Define functions ------------------ #
+def make_session(sub_id, duration=1320, f_sample=500, pre_story=30, post_story=10, blink_rate=15,
+                 dropout_rate=0.5, seed=0):
+    """
+    Simulates one session.
+
+    Params:
+        sub_id: (int) subject ID; together with seed it determines the data
+        duration: (float) story length (s)
+        f_sample: (int) sampling rate (Hz)
+        pre_story, post_story: (float) recording before STORY_START and after STORY_END (s)
+        blink_rate: (float) blinks per minute
+        dropout_rate: (float) dropouts (1-3 s of data loss) per minute
+        seed: (int) seed of the cohort
+
+    Returns:
+        samples: (dict) 'time' (ms), 'posX', 'posY', 'pupilSize'
+        events: (dict) 'Messages' ('info', 'time'), 'Sblink' ('time'), 'Eblink' ('start', 'end', 'duration')
+    """
+    rng = np.random.default_rng([seed, sub_id])
+    n = int((pre_story + duration + post_story) * f_sample)
+    step = 1000 / f_sample
+
+    time = 1e6 + rng.integers(0, 1e5) * step + np.arange(n) * step
+
+    # Pupil area: subject baseline + slow drift (AR(1) on a 1 sec scale) + sample noise
+    baseline = rng.uniform(800, 2000)
+    alpha = np.exp(-1 / f_sample)
+    innovations = rng.normal(0, baseline * 0.1 * np.sqrt(1 - alpha ** 2), n)
+    drift = lfilter([1], [1, -alpha], innovations)
+    pupilSize = np.round(baseline + drift + rng.normal(0, baseline * 0.005, n))
+
+    posX = 640 + rng.normal(0, 15, n)
+    posY = 360 + rng.normal(0, 15, n)
+
+    # Blinks: 50-400 ms of zeros, reported by EyeLink as Sblink/Eblink
+    n_blinks = rng.poisson(blink_rate * n / f_sample / 60)
+    blink_start = np.sort(rng.integers(0, n - f_sample, n_blinks))
+    blink_len = rng.integers(int(0.05 * f_sample), int(0.4 * f_sample), n_blinks)
+
+    # Dropouts: 1-3 sec of data loss without blink events (e.g. head movement)
+    n_dropouts = rng.poisson(dropout_rate * n / f_sample / 60)
+    dropout_start = rng.integers(0, n - 3 * f_sample, n_dropouts)
+    dropout_len = rng.integers(f_sample, 3 * f_sample, n_dropouts)
+
+    for start, length in zip(np.concatenate((blink_start, dropout_start)), np.concatenate((blink_len, dropout_len))):
+        pupilSize[start:start + length] = 0
+        posX[start:start + length] = np.nan
+        posY[start:start + length] = np.nan
+
+    blink_end = blink_start + blink_len - 1
+    story_start = time[int(pre_story * f_sample)]
+    story_end = story_start + duration * 1000
+
+    samples = {'time': time, 'posX': posX, 'posY': posY, 'pupilSize': pupilSize}
+    events = {
+        'Messages': {'info': ['TRACKER_START', 'STORY_START', 'STORY_END'],
+                     'time': np.array([time[0], story_start, story_end])},
+        'Sblink': {'time': time[blink_start]},
+        'Eblink': {'start': time[blink_start], 'end': time[blink_end],
+                   'duration': time[blink_end] - time[blink_start] + step},
+    }
+
+    return samples, events
+
+
+def _write_struct(group, struct, refs):
+    """
+    Writes a dict as a MATLAB v7.3 struct: numeric arrays as double column vectors,
+    lists of strings as cell arrays of char.
+    """
+    group.attrs['MATLAB_class'] = np.bytes_('struct')
+
+    for key, value in struct.items():
+        if isinstance(value, dict):
+            _write_struct(group.create_group(key), value, refs)
+        elif isinstance(value, list):
+            cell_refs = []
+            for item in value:
+                char = refs.create_dataset(f'{len(refs)}', data=np.array([ord(c) for c in item], dtype=np.uint16)[:, None])
+                char.attrs['MATLAB_class'] = np.bytes_('char')
+                cell_refs.append(char.ref)
+            cell = group.create_dataset(key, data=np.array(cell_refs, dtype=h5py.ref_dtype)[:, None])
+            cell.attrs['MATLAB_class'] = np.bytes_('cell')
+        else:
+            data = group.create_dataset(key, data=np.asarray(value, dtype=float)[None, :])
+            data.attrs['MATLAB_class'] = np.bytes_('double')
+
+
+def write_et_mat(filename, samples, events):
+    """
+    Saves a session as a MATLAB v7.3 .mat file with Samples and Events structs, readable by mat73/fetch_mat.
+    """
+    with h5py.File(filename, 'w', userblock_size=512) as f:
+        refs = f.create_group('#refs#')
+        _write_struct(f.create_group('Samples'), samples, refs)
+        _write_struct(f.create_group('Events'), events, refs)
+
+    # MATLAB v7.3 files start with a text header in the HDF5 user block
+    with open(filename, 'r+b') as f:
+        f.write(b'MATLAB 7.3 MAT-file, Platform: GLNXA64, Created on: synthetic HDF5 schema 1.00 .'.ljust(116) + b'\x00' * 8 + b'\x00\x02IM')
+
+
+def generate_cohort(out_dir, n_subjects, duration=1320, seed=0, first_sub_id=FIRST_SUB_ID):
+    """
+    Writes n_subjects sessions as <out_dir>/<sub>/<sub>_ET.mat (the layout fetch_mat expects).
+
+    Returns:
+        sub_ids: (list of int) the generated subject IDs
+    """
+    sub_ids = list(range(first_sub_id, first_sub_id + n_subjects))
+
+    for sub in sub_ids:
+        sub_dir = os.path.join(out_dir, str(sub))
+        if not os.path.exists(sub_dir):
+            os.makedirs(sub_dir)
+        samples, events = make_session(sub, duration=duration, seed=seed)
+        write_et_mat(os.path.join(sub_dir, str(sub) + "_ET.mat"), samples, events)
+
+    return sub_ids
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate synthetic <sub>_ET.mat sessions')
+    parser.add_argument('out_dir')
+    parser.add_argument('--n-subjects', type=int, default=10)
+    parser.add_argument('--duration', type=float, default=1320, help='story length (s)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    generate_cohort(args.out_dir, args.n_subjects, duration=args.duration, seed=args.seed)
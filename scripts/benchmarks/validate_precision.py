@@ -0,0 +1,150 @@
+# Authors: Kruthi Gollapudi (kruthig@uchicago.edu), Jadyn Park (jadynpark@uchicago.edu)
+# Last Edited: October 19, 2026
+# Description: Validation mode for the float32 data path (PARANOIA_DTYPE=float32, see preprocessing/precision.py).
+# Runs the stage 1-8 computations end to end on the same sessions in float64 and in float32 and reports, per stage,
+# the maximum absolute and relative deviation of the float32 results from the float64 ones. Stage 1 covers the
+# foreshortening correction and the round trip through the _aligned_ET.csv output.
+# Sessions are synthetic (synthetic_sessions.py) unless --aligned-path points to stage 1 outputs (<sub>_aligned_ET.csv).
+# Usage: python validate_precision.py [--n-subjects 10] [--aligned-path <dir> --subjects 1002 1003 ...]
+
+import argparse
+import io
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+_thisDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(_thisDir, '..', 'preprocessing'))
+from pupil_kernels import noise_proportions, interpolate_zero_runs, average_downsample, clean_by_TR, foreshortening_correction
+from isc_utils import isc_loo, bootstrap_isc
+from running_aggregate import new_state, add_subject, summarize
+from precision import ACCUM_DTYPE, as_data, max_deviation
+from synthetic_sessions import make_session, FIRST_SUB_ID
+from check_backends import story_segment, F_SAMPLE, F_DOWNSAMPLE
+
+
+# ------------------ Define functions ------------------ #
+def make_events(n_TRs, seed=0):
+    """
+    Random story segmentation (TR onsets/offsets of consecutive 10-40 TR events), standing in for paranoia_events.xlsx.
+    """
+    rng = np.random.default_rng(seed)
+    bounds = np.cumsum(np.concatenate(([0], rng.integers(10, 40, n_TRs // 10))))
+    bounds = bounds[bounds < n_TRs]
+
+    return bounds[:-1], bounds[1:]
+
+
+def run_chain(sessions, dtype, n_boot, seed=0):
+    """
+    Stage 1-8 computations on the story segment of each session, in the given dtype.
+
+    Params:
+        sessions: (dict) subject -> (pupilSize, posX, posY) of the story segment
+
+    Returns:
+        results: (dict) stage name -> result array
+    """
+    results = {'1_aligned': [], '1_corrected': []}
+
+    # Stage 1: foreshortening correction, and the aligned data as read back from the _aligned_ET.csv stage 1 writes
+    aligned = {}
+    for sub, (pupilSize, posX, posY) in sessions.items():
+        pupilSize, posX, posY = as_data(pupilSize, dtype), as_data(posX, dtype), as_data(posY, dtype)
+        pupilCorrected, _ = foreshortening_correction(pupilSize, posX, posY)
+
+        buffer = io.StringIO()
+        pd.DataFrame({'pupilSize': pupilSize, 'pupilCorrected': pupilCorrected}).to_csv(buffer, index=False)
+        buffer.seek(0)
+        saved = pd.read_csv(buffer)
+
+        aligned[sub] = as_data(saved['pupilSize'].to_numpy(), dtype)
+        results['1_aligned'].append(aligned[sub])
+        results['1_corrected'].append(as_data(saved['pupilCorrected'].to_numpy(), dtype))
+    results['1_aligned'] = np.concatenate(results['1_aligned'])
+    results['1_corrected'] = np.concatenate(results['1_corrected'])
+    sessions = aligned
+
+    # Stage 2: group statistics (float64 accumulation) and each subject's proportion of noise at 1 SD
+    all_pupil = np.concatenate([pupilSize[:-1] for pupilSize in sessions.values()])
+    all_diff = np.concatenate([np.diff(pupilSize) for pupilSize in sessions.values()])
+    lower_lim = np.mean(all_pupil, dtype=ACCUM_DTYPE) - np.std(all_pupil, dtype=ACCUM_DTYPE)
+    diff_thresh = np.mean(all_diff, dtype=ACCUM_DTYPE) + np.std(all_diff, dtype=ACCUM_DTYPE)
+    results['2_prop_noise'] = np.array([noise_proportions(pupilSize, np.insert(np.diff(pupilSize), 0, 0), [lower_lim], [diff_thresh])[0, 0]
+                                        for pupilSize in sessions.values()])
+
+    # Stages 3-5, per subject
+    by_TR = []
+    for stage in ['3_interpolated', '4_downsampled', '5_final']:
+        results[stage] = []
+    for sub, pupilSize in sessions.items():
+        interpolated = interpolate_zero_runs(pupilSize.copy(), F_SAMPLE)
+        downsampled = average_downsample(interpolated, F_SAMPLE / F_DOWNSAMPLE)
+        final = clean_by_TR(downsampled, F_DOWNSAMPLE, 1, 0.5)
+        results['3_interpolated'].append(interpolated)
+        results['4_downsampled'].append(downsampled)
+        results['5_final'].append(final)
+        by_TR.append(pd.Series(final, name=str(sub)))
+    for stage in ['3_interpolated', '4_downsampled', '5_final']:
+        results[stage] = np.concatenate(results[stage])
+
+    # Stage 6: one-to-average ISC and the bootstrap null (same random phases in both dtypes)
+    pupilSize_by_sub = pd.concat(by_TR, axis=1)
+    results['6_isc_loo'] = np.array([isc_loo(pupilSize_by_sub, i) for i in range(pupilSize_by_sub.shape[1])])
+    results['6_bootstrap'] = bootstrap_isc(pupilSize_by_sub, n_boot, seed).ravel()
+
+    # Stage 7: event averages
+    TR_onset, TR_offset = make_events(pupilSize_by_sub.shape[0], seed)
+    by_event = {sub: np.array([np.average(series.values[on:off]) for on, off in zip(TR_onset, TR_offset)], dtype=dtype)
+                for sub, series in pupilSize_by_sub.items()}
+    results['7_by_event'] = np.concatenate(list(by_event.values()))
+
+    # Stage 8: across-subject mean and SEM
+    state = new_state(n_boot=n_boot, seed=seed)
+    for sub, values in by_event.items():
+        add_subject(state, 'sub-' + sub, values)
+    summary = summarize(state)
+    results['8_mean'] = summary['mean']
+    results['8_sem'] = summary['sem']
+
+    return results
+
+
+def load_sessions(n_subjects, duration, aligned_path=None, subjects=None, seed=0):
+    """
+    Story segment (pupilSize, posX, posY) per subject: stage 1 outputs if aligned_path is given, otherwise
+    synthetic sessions.
+    """
+    if aligned_path is not None:
+        sessions = {}
+        for sub in subjects:
+            aligned = pd.read_csv(os.path.join(aligned_path, str(sub) + "_aligned_ET.csv"))
+            sessions[sub] = (aligned['pupilSize'].to_numpy(), aligned['posX'].to_numpy(), aligned['posY'].to_numpy())
+        return sessions
+
+    sessions = {}
+    for sub in range(FIRST_SUB_ID, FIRST_SUB_ID + n_subjects):
+        samples, events = make_session(sub, duration=duration, seed=seed)
+        sessions[sub] = tuple(story_segment(samples, events, key) for key in ['pupilSize', 'posX', 'posY'])
+
+    return sessions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the float32 data path with float64')
+    parser.add_argument('--n-subjects', type=int, default=10)
+    parser.add_argument('--duration', type=float, default=1320, help='story length (s) of synthetic sessions')
+    parser.add_argument('--n-boot', type=int, default=100, help='bootstrap iterations')
+    parser.add_argument('--aligned-path', help='directory with <sub>_aligned_ET.mat files to use instead of synthetic data')
+    parser.add_argument('--subjects', type=int, nargs='+', help='subject IDs to read from --aligned-path')
+    args = parser.parse_args()
+
+    sessions = load_sessions(args.n_subjects, args.duration, args.aligned_path, args.subjects)
+    reference = run_chain(sessions, np.float64, args.n_boot)
+    compact = run_chain(sessions, np.float32, args.n_boot)
+
+    print('stage                 max abs dev    max rel dev')
+    for stage in reference:
+        max_abs, max_rel = max_deviation(compact[stage], reference[stage])
+        print(f'{stage:<20} {max_abs:>12.3g} {max_rel:>14.3g}')
@@ -0,0 +1,125 @@
+# Authors: Kruthi Gollapudi (kruthig@uchicago.edu), Jadyn Park (jadynpark@uchicago.edu)
+# Last Edited: October 19, 2026
+# Description: Timing audit for the task script: per-flip timestamps and dropped frames of the story playback loop,
+# the audio onset latency (actual vs scheduled start) and the round-trip time of every message sent to the tracker.
+# Saved per session as a compact .npz (<file>_timing.npz) next to the timestamps.
+# To print the summary of a session: python frame_timing.py <file>_timing.npz
+
+import sys
+import numpy as np
+
+try:
+    import psychtoolbox as ptb
+except ImportError: # not needed to read saved timing files
+    ptb = None
+
+
+class TimingAudit:
+    """
+    Collects timing measurements during a session. Recording a flip or message only appends to a list,
+    so it adds no measurable time to the playback loop.
+
+    Params:
+        frame_period: (float) expected time between flips (s), e.g. 1 / measured refresh rate
+        drop_threshold: (float) an interval longer than drop_threshold * frame_period counts as dropped frame(s)
+    """
+
+    def __init__(self, frame_period, drop_threshold=1.5):
+        self.frame_period = frame_period
+        self.drop_threshold = drop_threshold
+        self.flips = []
+        self.messages = []
+        self.audio = {}
+
+    def flip(self, flip_time):
+        """
+        Records the time (s) of a flip, as returned by win.flip().
+        """
+        self.flips.append(flip_time)
+
+    def send_message(self, tracker, message):
+        """
+        Sends a message to the tracker and records when it was sent and how long the call took (psychtoolbox clock).
+
+        Returns:
+            sent, returned: (float) time before and after the call
+        """
+        sent = ptb.GetSecs()
+        tracker.sendMessage(message)
+        returned = ptb.GetSecs()
+        self.record_message(message, sent, returned)
+
+        return sent, returned
+
+    def record_message(self, message, sent, returned):
+        """
+        Records a tracker message that was timed by the caller (e.g. when the message contains the send time).
+        """
+        self.messages.append((message.split()[0], sent, returned - sent))
+
+    def audio_onset(self, sound, scheduled):
+        """
+        Records the scheduled and actual onset (psychtoolbox clock) of a sound started with play(when=scheduled).
+        The actual onset is the stream's StartTime reported by the psychtoolbox audio backend, NaN if unavailable.
+        """
+        try:
+            actual = float(sound.stream.status['StartTime'])
+        except (AttributeError, KeyError, TypeError):
+            actual = np.nan
+        self.audio = {'scheduled': scheduled, 'actual': actual if actual > 0 else np.nan}
+
+    def summary(self):
+        """
+        Returns the summary measures of the session (see summarize_timing).
+        """
+        return summarize_timing(np.asarray(self.flips), self.frame_period, self.drop_threshold,
+                                self.audio.get('scheduled', np.nan), self.audio.get('actual', np.nan),
+                                np.array([m[2] for m in self.messages]))
+
+    def save(self, path):
+        """
+        Writes the measurements and their summary to path (.npz) and returns the summary.
+        """
+        summary = self.summary()
+        np.savez_compressed(path,
+                            flip_times=np.asarray(self.flips, dtype=np.float64),
+                            frame_period=self.frame_period, drop_threshold=self.drop_threshold,
+                            audio_scheduled=self.audio.get('scheduled', np.nan),
+                            audio_actual=self.audio.get('actual', np.nan),
+                            message_names=np.array([m[0] for m in self.messages], dtype=str),
+                            message_sent=np.array([m[1] for m in self.messages], dtype=np.float64),
+                            message_round_trip=np.array([m[2] for m in self.messages], dtype=np.float64),
+                            **{'summary_' + key: value for key, value in summary.items()})
+
+        return summary
+
+
+def summarize_timing(flip_times, frame_period, drop_threshold, audio_scheduled, audio_actual, round_trips):
+    """
+    Summary of a session's timing.
+
+    Returns:
+        summary: (dict) n_flips, dropped_frames (frames missed: intervals of k frame periods count k - 1),
+            long_intervals (intervals above the threshold), max_interval_ms, interval_sd_ms,
+            audio_latency_ms (actual - scheduled onset), max_round_trip_ms and median_round_trip_ms
+    """
+    intervals = np.diff(flip_times)
+    late = intervals > drop_threshold * frame_period
+
+    return {
+        'n_flips': len(flip_times),
+        'dropped_frames': int(np.sum(np.round(intervals[late] / frame_period) - 1)),
+        'long_intervals': int(late.sum()),
+        'max_interval_ms': 1000 * intervals.max() if len(intervals) else np.nan,
+        'interval_sd_ms': 1000 * intervals.std() if len(intervals) else np.nan,
+        'audio_latency_ms': 1000 * (audio_actual - audio_scheduled),
+        'max_round_trip_ms': 1000 * round_trips.max() if len(round_trips) else np.nan,
+        'median_round_trip_ms': 1000 * np.median(round_trips) if len(round_trips) else np.nan,
+    }
+
+
+if __name__ == '__main__':
+    saved = np.load(sys.argv[1])
+    for key in saved.files:
+        if key.startswith('summary_'):
+            print(key[len('summary_'):], '=', saved[key])
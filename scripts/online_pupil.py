@@ -0,0 +1,180 @@
+# Authors: Kruthi Gollapudi (kruthig@uchicago.edu), Jadyn Park (jadynpark@uchicago.edu)
+# Last Edited: October 19, 2026
+# Description: Companion to 1_arousal_eyetracker.py. Receives the live LSL pupil stream during the task and
+# preprocesses it causally with the same kernels as stages 3-5: blink gaps are filled with the last valid sample,
+# samples are block-averaged to 50 Hz, and the 50 Hz samples are averaged per TR (1 sec epochs, from STORY_START).
+# The results are re-published on LSL and printed, so arousal can be watched while the story plays.
+# Run in a separate terminal: python online_pupil.py
+
+import numpy as np
+import os
+import sys
+import warnings
+from collections import deque
+from pylsl import StreamInfo, StreamOutlet, StreamInlet, resolve_byprop, local_clock
+
+_thisDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(_thisDir, 'preprocessing'))
+from pupil_kernels import causal_fill, average_downsample, compute_epoch_noise
+from stream_names import STREAM_NAME, MARKER_STREAM_NAME
+
+
+class OnlinePupilProcessor:
+    """
+    Causal, chunk-by-chunk version of stages 3-5. Every buffer is bounded: raw samples are only held until
+    a 50 Hz block is complete, 50 Hz samples until a TR is complete, and the histories keep history_secs.
+
+    Params:
+        f_sample: (int) sampling rate of the raw stream (Hz)
+        f_cutoff: (int) rate to downsample to (Hz)
+        max_gap: (int) longest blink gap (in raw samples) to fill, as WINSIZE in stage 3
+        interval, prop: epoch noise criterion, as in stage 5
+        history_secs: (int) how much of the processed data to keep for display
+    """
+
+    def __init__(self, f_sample=500, f_cutoff=50, max_gap=500, interval=1, prop=0.5, history_secs=120):
+        self.factor = int(f_sample / f_cutoff)
+        self.f_cutoff = f_cutoff
+        self.max_gap = max_gap
+        self.interval = interval
+        self.prop = prop
+
+        self.block = np.full(self.factor, np.nan)
+        self.block_times = np.full(self.factor, np.nan)
+        self.n_block = 0
+        self.epoch = np.full(f_cutoff, np.nan)
+        self.n_epoch = 0
+
+        self.last_valid = np.nan
+        self.gap_len = 0
+        self.story_start = None
+        self.story_running = False
+        self.n_TR = 0
+
+        self.history_50Hz = deque(maxlen=history_secs * f_cutoff)
+        self.history_TR = deque(maxlen=history_secs)
+
+    def start_story(self, start_time):
+        """
+        Starts TR counting at the first sample at or after start_time (the audio onset sent with STORY_START).
+        """
+        self.story_start = start_time
+
+    def end_story(self):
+        self.story_running = False
+
+    def push(self, samples, timestamps):
+        """
+        Processes a chunk of raw pupil samples.
+
+        Params:
+            samples: (np.ndarray) raw pupil size, blinks are zeros
+            timestamps: (np.ndarray) LSL timestamp of each sample
+
+        Returns:
+            out_50Hz: (list) (timestamp of last raw sample, value) for every completed 50 Hz block
+            out_TR: (list) (TR index, timestamp, value) for every completed TR; noisy TRs are NaN
+        """
+        filled, self.last_valid, self.gap_len = causal_fill(samples, self.last_valid, self.gap_len, self.max_gap)
+
+        if self.story_start is None:
+            return self._push_blocks(filled, timestamps)
+
+        # Story starts within this chunk: TR epochs (and 50 Hz blocks) restart at the onset sample
+        onset = np.searchsorted(timestamps, self.story_start)
+        if onset == len(filled):
+            return self._push_blocks(filled, timestamps)
+
+        out_50Hz, out_TR = self._push_blocks(filled[:onset], timestamps[:onset])
+        self.n_block = 0
+        self.n_epoch = 0
+        self.n_TR = 0
+        self.story_start = None
+        self.story_running = True
+        story_50Hz, story_TR = self._push_blocks(filled[onset:], timestamps[onset:])
+
+        return out_50Hz + story_50Hz, out_TR + story_TR
+
+    def _push_blocks(self, filled, timestamps):
+        """
+        Adds gap-filled samples to the current 50 Hz block, and completed blocks to the current TR epoch.
+        """
+        out_50Hz, out_TR = [], []
+
+        i = 0
+        while i < len(filled):
+            n = min(self.factor - self.n_block, len(filled) - i)
+            self.block[self.n_block:self.n_block + n] = filled[i:i + n]
+            self.block_times[self.n_block:self.n_block + n] = timestamps[i:i + n]
+            self.n_block += n
+            i += n
+
+            if self.n_block < self.factor:
+                break
+
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', category=RuntimeWarning)
+                value = average_downsample(self.block, self.factor)[0]
+            block_time = self.block_times[-1]
+            self.n_block = 0
+            out_50Hz.append((block_time, value))
+            self.history_50Hz.append((block_time, value))
+
+            if not self.story_running:
+                continue
+
+            self.epoch[self.n_epoch] = value
+            self.n_epoch += 1
+            if self.n_epoch == self.f_cutoff:
+                epoch_mean = np.average(self.epoch)
+                TR_value = compute_epoch_noise(self.epoch, epoch_mean, self.interval, self.prop)
+                if TR_value == 0: # noisy epoch; stage 5 would interpolate it once the next TR is known
+                    TR_value = np.nan
+                out_TR.append((self.n_TR, block_time, TR_value))
+                self.history_TR.append((self.n_TR, block_time, TR_value))
+                self.n_TR += 1
+                self.n_epoch = 0
+
+        return out_50Hz, out_TR
+
+
+def main():
+    print('Looking for stream', STREAM_NAME, '...')
+    pupil_inlet = StreamInlet(resolve_byprop('name', STREAM_NAME)[0], max_buflen=10)
+    marker_streams = resolve_byprop('name', MARKER_STREAM_NAME, timeout=5)
+    marker_inlet = StreamInlet(marker_streams[0]) if marker_streams else None
+
+    f_sample = int(pupil_inlet.info().nominal_srate())
+    processor = OnlinePupilProcessor(f_sample=f_sample)
+
+    outlet_50Hz = StreamOutlet(StreamInfo(STREAM_NAME + '_50Hz', 'Pupil', 1, processor.f_cutoff, 'float32', 'paranoia_pupil_50Hz'))
+    outlet_TR = StreamOutlet(StreamInfo(STREAM_NAME + '_TR', 'Pupil', 1, 1, 'float32', 'paranoia_pupil_TR'))
+
+    max_latency = 0
+    while True:
+        if marker_inlet is not None:
+            markers, marker_times = marker_inlet.pull_chunk(timeout=0.0)
+            for marker, marker_time in zip(markers, marker_times):
+                if marker[0] == 'STORY_START':
+                    processor.start_story(marker_time)
+                elif marker[0] == 'STORY_END':
+                    processor.end_story()
+
+        chunk, timestamps = pupil_inlet.pull_chunk(timeout=0.005)
+        if not timestamps:
+            continue
+
+        chunk = np.asarray(chunk)
+        out_50Hz, out_TR = processor.push(chunk[:, 0], np.asarray(timestamps))
+
+        for block_time, value in out_50Hz:
+            outlet_50Hz.push_sample([value], block_time)
+            max_latency = max(max_latency, local_clock() - block_time)
+
+        for TR, TR_time, value in out_TR:
+            outlet_TR.push_sample([value], TR_time)
+            print(f'TR {TR}: pupil = {value:.1f}, latency = {1000 * (local_clock() - TR_time):.1f} ms (max {1000 * max_latency:.1f} ms)')
+
+
+if __name__ == '__main__':
+    main()
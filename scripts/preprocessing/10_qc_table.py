@@ -0,0 +1,36 @@
+# Authors: Kruthi Gollapudi (kruthig@uchicago.edu), Jadyn Park (jadynpark@uchicago.edu)
+# Last Edited: October 19, 2026
+# Description: Cohort QC table. Stages 1-5 record per-subject QC counters while they run (see instrument.py), from
+# quantities they compute anyway, so this script only reads the run manifests, not the data:
+#   1: audio onset delay, alignment offset of the matched start/end samples, pauses, length, off-fixation, blinks
+#   2: percent zeros, proportion of noisy samples, exclusion
+#   3: percent zeros as loaded, blink and artifact samples masked, percent missing after masking, gaps filled and
+#      skipped (> WINSIZE or at the edges), longest gap
+#   4: percent NaN and zero bins after downsampling
+#   5: TRs rejected (noisy or without data) and left unfilled
+# Saves one row per subject (qc_table.csv); columns are '<stage>.<counter>'
+
+import os
+from instrument import StageRun, collect_qc
+from session_index import story_path
+
+# Set save directory
+save_path = story_path(os.path.normpath('/Users/kruthigollapudi/src/paranoia/data/pupil/3_processed/10_qc'))
+
+if not os.path.exists(save_path):
+    os.makedirs(save_path)
+
+run = StageRun('10_qc_table', save_path)
+
+# Manifests of all stages of this story (the same directory this run's manifest goes to)
+with run.step('collect') as rec:
+    qc_table = collect_qc(run.manifest_path)
+    rec['subjects'] = len(qc_table)
+
+print(qc_table.to_string())
+
+filename = os.path.join(save_path, "qc_table.csv")
+qc_table.to_csv(filename)
+run.wrote(filename)
+
+run.finish()
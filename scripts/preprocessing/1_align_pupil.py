@@ -1,91 +1,219 @@
 # Authors: Kruthi Gollapudi (kruthig@uchicago.edu), Jadyn Park (jadynpark@uchicago.edu)
-# Last Edited: December 16, 2024
+# Last Edited: October 19, 2026
 # Description: The script aligns pupil data to stimulus presentation and excludes non-encoding data
+# EyeLink's blinks (Eblink events) within the story are saved as sample ranges of the aligned data (<sub>_aligned_blinks.csv)
+# Story pauses (storyPause/storyRestart in the timestamps csv) are spliced out, so the aligned data follows the story
+# timeline; the pauses removed per subject are saved in pause_summary.csv
+# Gaze position (posX/posY) is taken from the same load and carried in the aligned output, together with the pupil
+# size corrected for the foreshortening error (pupilCorrected) and the off-fixation mask (offFixation). These columns
+# are export-only: the later stages read pupilEncoding from <sub>_aligned_ET.mat and don't use them
+# Stories other than paranoia (PARANOIA_STORY, see session_index.py) are read from and written to <story> subdirectories
 
 import numpy as np
 import pandas as pd
 import os
 import math
-import mat73 # to load .mat files in MATLAB v7.3
+from pupil_io import fetch_mat
+from instrument import StageRun
+from job_queue import claimed, worker_filename
+from precision import as_data
+from pupil_kernels import interval_mask, foreshortening_correction, fixation_deviation_mask
+from session_timestamps import load_timestamps, pause_windows
+from session_index import STORY, INDEX, story_path, story_info, load_index
 
 # ------------------ Define functions ------------------ # 
-def fetch_mat(mat_path, sub_id):
+def find_message(messages_info, message):
     """
-    Grabs .mat file for a given subject and saves each struct as an array.
-    
-    Samples (1x1 Struct): contains time, posX, posY, pupilSize, etc.
-    Events (1x1 Struct): contains Messages (another Struct), Sblink, Eblink, etc.
-        Sblink: time of the start of the blink
-        Eblink: time of the start and end of the blink, and blink duration
-        Detailed description of the variables: http://sr-research.jp/support/EyeLink%201000%20User%20Manual%201.5.0.pdf
-    
+    Returns the index of the first event message that is message, or starts with message followed by
+    parameters (e.g. "STORY_START AUDIO_ONSET_MS=250.118").
     """
-    mat = mat73.loadmat(os.path.join(mat_path, str(sub_id), str(sub_id) + "_ET.mat"))
-    samples = mat['Samples']
-    events = mat['Events']
-        
-    return samples, events
+    for idx, info in enumerate(messages_info):
+        if info == message or info.startswith(message + ' '):
+            return idx
+
+    raise ValueError(message + " not found in event messages")
+
+
+def audio_onset_delay(info):
+    """
+    Returns the delay (ms) from a STORY_START message to the scheduled audio onset, as sent by the task
+    ("STORY_START AUDIO_ONSET_MS=<delay>"), or 0 for sessions recorded before the audio onset was scheduled.
+    """
+    for param in info.split()[1:]:
+        if param.startswith('AUDIO_ONSET_MS='):
+            return float(param.split('=')[1])
+
+    return 0.0
+
+
+def blink_intervals(events, samples_time, start_idx, end_idx):
+    """
+    Converts EyeLink's blink events to [start, end) sample ranges of the aligned data (samples start_idx to end_idx).
+
+    Params:
+        events: (dict) Events struct from fetch_mat; Eblink holds the start and end time (ms) of every blink
+        samples_time: (np.ndarray) time of every sample (ms)
+        start_idx, end_idx: (int) samples of the story start and end
+
+    Returns:
+        blinks: (pd.DataFrame) start_idx, end_idx (exclusive) and duration_ms of every blink overlapping the story
+    """
+    if 'Eblink' not in events:
+        return pd.DataFrame({'start_idx': [], 'end_idx': [], 'duration_ms': []}, dtype=np.int64)
+
+    # A single blink is loaded as scalars
+    blink_start = np.atleast_1d(events['Eblink']['start'])
+    blink_end = np.atleast_1d(events['Eblink']['end'])
+
+    first = np.searchsorted(samples_time, blink_start, side='left') - start_idx
+    last = np.searchsorted(samples_time, blink_end, side='right') - start_idx
+    inside = (last > 0) & (first < end_idx - start_idx)
+
+    return pd.DataFrame({'start_idx': np.clip(first[inside], 0, None),
+                         'end_idx': np.clip(last[inside], None, end_idx - start_idx),
+                         'duration_ms': (blink_end - blink_start)[inside]})
 
 
 # ------------------ Hardcoded parameters ------------------ #
 _THISDIR = os.getcwd()
-MAT_PATH = os.path.normpath(os.path.join(_THISDIR, '../../data/pupil/2_mat'))
-SAVE_PATH = os.path.normpath(os.path.join(_THISDIR, '../../data/pupil/3_processed/1_aligned'))
+MAT_PATH = story_path(os.path.normpath(os.path.join(_THISDIR, '../../data/pupil/2_mat')))
+SAVE_PATH = story_path(os.path.normpath(os.path.join(_THISDIR, '../../data/pupil/3_processed/1_aligned')))
+TS_PATH = os.path.normpath(os.path.join(_THISDIR, '../../data/timestamps'))
 
 if not os.path.exists(SAVE_PATH):
     os.makedirs(SAVE_PATH)
 
 SUBJ_IDS = range(1002, 1029)
 SAMPLING_RATE = 500 # Hz
+
+# Expected story length (s), to flag sessions that were cut short; from the session index if PARANOIA_INDEX is set
+STORY_LENGTH = story_info(load_index(INDEX))[1] if INDEX is not None else 1320
+
+# Gaze: degree of the foreshortening regression, and the largest distance (pixels) from the median gaze position
+# before a sample counts as off fixation
+GAZE_DEGREE = 2
+FIXATION_MAX_DEV = 100
 # PUPIL_INFO = Area
 
 # ------------------- Main ------------------ #
-for sub in SUBJ_IDS:
-    
-    # Load .mat data
-    samples, events = fetch_mat(MAT_PATH, sub)
+run = StageRun('1_align_pupil', SAVE_PATH)
+
+# Timestamps of all sessions, read once
+with run.step('load_timestamps'):
+    timestamps = load_timestamps(TS_PATH, pattern='*_' + STORY + '_timestamps.csv')
+
+pause_summary = []
 
-    # Time stamp of samples
-    samples_time = samples['time'] # in milliseconds; samples_time[1] - samples_time[0] = 2 ms
+# With PARANOIA_QUEUE set, only the subjects this worker claims (see job_queue.py)
+for sub in claimed('1_align_pupil', SUBJ_IDS):
+    with run.step(sub) as rec:
     
-    # Pupil size during the entire timecourse
-    samples_pupilSize = samples['pupilSize']
+        # Load .mat data
+        run.read(os.path.join(MAT_PATH, str(sub), str(sub) + "_ET.mat"))
+        samples, events = fetch_mat(MAT_PATH, sub)
+        rec['samples'] = len(samples['time'])
 
-    # Event messages
-    events_messages_info = events['Messages']['info']
-    events_messages_time = events['Messages']['time']
+        # Time stamp of samples
+        samples_time = samples['time'] # in milliseconds; samples_time[1] - samples_time[0] = 2 ms
+    
+        # Pupil size and gaze position during the entire timecourse (all from the one load)
+        samples_pupilSize = as_data(samples['pupilSize'])
+        samples_posX = as_data(samples['posX'])
+        samples_posY = as_data(samples['posY'])
 
-    # Index and timestamp of STORY_START and STORY_END
-    story_start_idx = events_messages_info.index('STORY_START')
-    story_end_idx = events_messages_info.index('STORY_END')
+        # Event messages
+        events_messages_info = events['Messages']['info']
+        events_messages_time = events['Messages']['time']
 
-    story_start_time = events_messages_time[story_start_idx]
-    story_end_time = events_messages_time[story_end_idx]
+        # Index and timestamp of STORY_START and STORY_END
+        story_start_idx = find_message(events_messages_info, 'STORY_START')
+        story_end_idx = find_message(events_messages_info, 'STORY_END')
 
-    # Align pupil data to stimulus presentation
-    pupil_start_idx = np.where(samples_time == story_start_time)
-    pupil_end_idx = np.where(samples_time == story_end_time)
+        # Story starts at the audio onset, which the task schedules a measured delay after STORY_START
+        onset_delay = audio_onset_delay(events_messages_info[story_start_idx])
+        story_start_time = events_messages_time[story_start_idx] + round(onset_delay)
+        story_end_time = events_messages_time[story_end_idx]
+        scheduled_start, scheduled_end = story_start_time, story_end_time
 
-    # If Samples.time and events.Messages.time aren't aligned
-    if len(pupil_start_idx[0]) == 0:
-        story_start_time = story_start_time - 1
+        # Align pupil data to stimulus presentation
         pupil_start_idx = np.where(samples_time == story_start_time)
-    if len(pupil_end_idx[0]) == 0:
-        story_end_time = story_end_time + 1
         pupil_end_idx = np.where(samples_time == story_end_time)
+
+        # If Samples.time and events.Messages.time aren't aligned
+        if len(pupil_start_idx[0]) == 0:
+            story_start_time = story_start_time - 1
+            pupil_start_idx = np.where(samples_time == story_start_time)
+        if len(pupil_end_idx[0]) == 0:
+            story_end_time = story_end_time + 1
+            pupil_end_idx = np.where(samples_time == story_end_time)
         
-    # Extract element from array
-    pupil_start_idx = pupil_start_idx[0][0]
-    pupil_end_idx = pupil_end_idx[0][0]
-    
-    # New array of samples during stimulus presentation
-    pupilSize_encoding = samples_pupilSize[pupil_start_idx:pupil_end_idx]
+        # Extract element from array
+        pupil_start_idx = pupil_start_idx[0][0]
+        pupil_end_idx = pupil_end_idx[0][0]
+
+        # Alignment: audio onset after STORY_START, and how far the matched samples are from the message times
+        run.qc(sub, audio_onset_ms=onset_delay, start_offset_ms=float(story_start_time - scheduled_start),
+               end_offset_ms=float(story_end_time - scheduled_end))
     
-    # Corresponding time stamp of the new array
-    encoding_time = samples_time[pupil_start_idx:pupil_end_idx]
-    encoding_time_corrected = encoding_time - encoding_time[0]
+        # New array of samples during stimulus presentation
+        pupilSize_encoding = samples_pupilSize[pupil_start_idx:pupil_end_idx]
+        posX_encoding = samples_posX[pupil_start_idx:pupil_end_idx]
+        posY_encoding = samples_posY[pupil_start_idx:pupil_end_idx]
     
-    filename = os.path.join(SAVE_PATH, str(sub) + "_aligned_ET.csv")
-    pd.DataFrame({'pupilSize': pupilSize_encoding, 'time_in_ms': encoding_time_corrected}).to_csv(filename, index=False)
+        # Corresponding time stamp of the new array
+        encoding_time = samples_time[pupil_start_idx:pupil_end_idx]
+        encoding_time_corrected = encoding_time - encoding_time[0]
+
+        # Story pauses (task clock, relative to STORY_START) as samples of the story segment
+        pauses, restarts = pause_windows(timestamps, sub)
+        message_time = events_messages_time[story_start_idx]
+        paused = interval_mask(len(encoding_time),
+                               np.searchsorted(encoding_time, message_time + pauses * 1000),
+                               np.searchsorted(encoding_time, message_time + restarts * 1000))
+
+        # Splice out the pauses; story time doesn't advance while paused
+        kept_before = np.concatenate(([0], np.cumsum(~paused))) # samples kept before each sample
+        pupilSize_encoding = pupilSize_encoding[~paused]
+        posX_encoding = posX_encoding[~paused]
+        posY_encoding = posY_encoding[~paused]
+        encoding_time_corrected = encoding_time_corrected[~paused] - np.cumsum(paused)[~paused] * 1000 / SAMPLING_RATE
+
+        run.qc(sub, pauses=len(pauses), paused_s=paused.sum() / SAMPLING_RATE)
+        pause_summary.append({'subject': sub, 'n_pauses': len(pauses), 'paused_samples': int(paused.sum()),
+                              'paused_s': paused.sum() / SAMPLING_RATE})
+        if len(pauses) > 0:
+            print(str(sub), ":", len(pauses), "pause(s),", paused.sum() / SAMPLING_RATE, "s removed")
+
+        length_s = len(pupilSize_encoding) / SAMPLING_RATE
+        run.qc(sub, length_s=length_s)
+        if abs(length_s - STORY_LENGTH) > 1:
+            print(str(sub), ": aligned data is", length_s, "s, expected", STORY_LENGTH, "s")
+
+        # Foreshortening correction (regression on gaze position) and off-fixation mask
+        pupilCorrected, gaze_coefs = foreshortening_correction(pupilSize_encoding, posX_encoding, posY_encoding, GAZE_DEGREE)
+        off_fixation = fixation_deviation_mask(posX_encoding, posY_encoding, FIXATION_MAX_DEV)
+        run.qc(sub, pct_off_fixation=100 * off_fixation.sum() / len(off_fixation))
+        rec['gaze_coefs'] = gaze_coefs.tolist()
+
+        filename = os.path.join(SAVE_PATH, str(sub) + "_aligned_ET.csv")
+        pd.DataFrame({'pupilSize': pupilSize_encoding, 'time_in_ms': encoding_time_corrected,
+                      'posX': posX_encoding, 'posY': posY_encoding, 'pupilCorrected': pupilCorrected,
+                      'offFixation': off_fixation}).to_csv(filename, index=False)
+        run.wrote(filename)
+
+        # Blinks as samples of the spliced data; blinks entirely within a pause are dropped
+        blinks = blink_intervals(events, samples_time, pupil_start_idx, pupil_end_idx)
+        blinks['start_idx'] = kept_before[blinks['start_idx'].to_numpy()]
+        blinks['end_idx'] = kept_before[blinks['end_idx'].to_numpy()]
+        blinks = blinks[blinks['end_idx'] > blinks['start_idx']]
+        run.qc(sub, blinks=len(blinks))
+
+        filename = os.path.join(SAVE_PATH, str(sub) + "_aligned_blinks.csv")
+        blinks.to_csv(filename, index=False)
+        run.wrote(filename)
 
+filename = worker_filename(os.path.join(SAVE_PATH, "pause_summary.csv"))
+pd.DataFrame(pause_summary).to_csv(filename, index=False)
+run.wrote(filename)
 
+run.finish()
@@ -1,7 +1,9 @@
 # Authors: Kruthi Gollapudi (kruthig@uchicago.edu), Jadyn Park (jadynpark@uchicago.edu)
-# Last Edited: May 8, 2024
+# Last Edited: October 19, 2026
 # Description: The script calculated group mean pupil dilation and excludes noisy participants
 # A participant is excluded if 25% of the raw samples are more than 3 standard deviations from the mean
+# Set SWEEP = 1 to evaluate a grid of (z_all_data, z_diff, p) settings in one pass instead; the table of excluded
+# participants per setting is saved as noise_threshold_sweep.csv
 
 import numpy as np
 import pandas as pd
@@ -9,106 +11,86 @@ import os
 import scipy.io as sio
 import scipy.stats as stats
 import math
+from pupil_kernels import calculate_noise, noise_proportions
+from instrument import StageRun
+from job_queue import subjects_override
+from session_index import story_path
+from precision import DTYPE, ACCUM_DTYPE, as_data
 
 ## USE 1 SD FOR BOTH !!
 
-def calculate_noise(arr1, arr2, p, diff, lower):
-    """
-    Determines if data in array is noisy based on percent of data allowed to be below lower limit and above upper limit.
-
-    Inputs:
-    - arr1 (numpy array) containing the pupil size data
-    - arr2 (numpy array) containing the pupil size difference data
-    - p (float) specifying threshold for determining if data is noisy
-    - upper (float) limit for non-noisy data
-    - lower (float) limit for non-noisy data
-
-    Outputs:
-    - noisy (bool), True if noisy and False if not
-
-    """
-
-    full_length = len(arr1)
-    count = 0
-
-    for idx, item in enumerate(arr1):
-        if idx != 0:
-            if (item < lower):
-                count +=1
-            elif arr2[idx] > diff:
-                count +=1
-        else:
-            if (item < lower):
-                count +=1
-
-    # proportion of noise in subject
-    prop_noise = count/full_length
-    
-    if prop_noise >= p:
-        noisy = True
-    else:
-        noisy = False
-    
-    return noisy
-
-
 # Set data directories
-mat_path = os.path.normpath('/Users/kruthigollapudi/src/paranoia/data/pupil/3_processed/1_aligned')
+mat_path = story_path(os.path.normpath('/Users/kruthigollapudi/src/paranoia/data/pupil/3_processed/1_aligned'))
 ts_path = os.path.normpath('/Users/kruthigollapudi/src/paranoia/data/timestamps')
 
 # Set save directory
-save_path = os.path.normpath('/Users/kruthigollapudi/src/paranoia/data/pupil/3_processed/2_excluded_participants')
+save_path = story_path(os.path.normpath('/Users/kruthigollapudi/src/paranoia/data/pupil/3_processed/2_excluded_participants'))
 
 if not os.path.exists(save_path):
     os.makedirs(save_path)
 
 
 # Set range of subjects
-subj_ids = range(1002, 1030)
+subj_ids = subjects_override(range(1002, 1030))
+
+# Threshold sweep (1 = evaluate the grids below, 0 = the single setting further down)
+SWEEP = 0
+z_all_grid = [0.5, 1, 1.5, 2, 2.5, 3]
+z_diff_grid = [0.5, 1, 1.5, 2, 2.5, 3]
+p_grid = [0.1, 0.15, 0.2, 0.25, 0.3, 0.4, 0.5]
+
+run = StageRun('2_exclude_noise', save_path)
 
 # Create list with all pupil data
-all_pupil = np.array([])
+all_pupil = np.array([], dtype=DTYPE)
 #all_pupil_z = np.array([])
-pupilDiff = np.array([])
+pupilDiff = np.array([], dtype=DTYPE)
 
-for sub in subj_ids:
+# Each subject's samples and sample-to-sample differences, kept so the files are only read once
+subject_data = {}
 
-    # get data files
-    mat = sio.loadmat(os.path.join(mat_path, str(sub) + "_aligned_ET.mat"))
-
-    # Pupil size during the entire timecourse
-    pupilSize = mat['pupilEncoding'].flatten()
-    time = mat['time'].flatten()
-
-    pupilSize_next = np.copy(pupilSize)
-    pupilSize_next = np.delete(pupilSize_next, 0)
-    pupilSize = np.delete(pupilSize, -1)
-    differences = pupilSize_next - pupilSize
-    #differences = np.insert(differences, 0, 0)
-    pupilDiff = np.append(differences, pupilDiff)
-
-    #for i, val in enumerate(pupilSize):
-        #if i != 0:
-            #diff = val - prev_val
-            #pupilDiff = np.append(diff, pupilDiff)    
-        #else:
-            #pupilDiff = np.append(0, pupilDiff) 
-        #prev_val = val
+for sub in subj_ids:
+    with run.step(str(sub) + '_stats') as rec:
+        # get data files
+        mat = sio.loadmat(run.read(os.path.join(mat_path, str(sub) + "_aligned_ET.mat")))
+
+        # Pupil size during the entire timecourse
+        pupilSize = as_data(mat['pupilEncoding'].flatten())
+        time = mat['time'].flatten()
+        rec['samples'] = len(pupilSize)
+        pupilSize_full = pupilSize
+
+        pupilSize_next = np.copy(pupilSize)
+        pupilSize_next = np.delete(pupilSize_next, 0)
+        pupilSize = np.delete(pupilSize, -1)
+        differences = pupilSize_next - pupilSize
+        #differences = np.insert(differences, 0, 0)
+        pupilDiff = np.append(differences, pupilDiff)
+        subject_data[sub] = (pupilSize_full, np.insert(differences, 0, 0))
+        run.qc(sub, pct_zeros=100 * np.count_nonzero(pupilSize_full == 0) / len(pupilSize_full))
+
+        #for i, val in enumerate(pupilSize):
+            #if i != 0:
+                #diff = val - prev_val
+                #pupilDiff = np.append(diff, pupilDiff)    
+            #else:
+                #pupilDiff = np.append(0, pupilDiff) 
+            #prev_val = val
     
 
-    # combine all data
-    all_pupil = np.append(all_pupil, pupilSize)
-    #all_pupil_z = np.append(all_pupil, pupil_z_scored)
+        # combine all data
+        all_pupil = np.append(all_pupil, pupilSize)
+        #all_pupil_z = np.append(all_pupil, pupil_z_scored)
 
 
 print(len(pupilDiff), len(all_pupil))
 
 # Get group statistics
-all_avg = np.mean(all_pupil)
-all_sd = np.std(all_pupil, ddof=0)
+all_avg = np.mean(all_pupil, dtype=ACCUM_DTYPE)
+all_sd = np.std(all_pupil, ddof=0, dtype=ACCUM_DTYPE)
 
-all_diff_mean = np.mean(pupilDiff)
-all_diff_sd = np.std(pupilDiff, ddof=0)
+all_diff_mean = np.mean(pupilDiff, dtype=ACCUM_DTYPE)
+all_diff_sd = np.std(pupilDiff, ddof=0, dtype=ACCUM_DTYPE)
 
 
 # specify boundaries
@@ -122,34 +104,69 @@ diff_thresh = all_diff_mean + z_diff*all_diff_sd
 print(lower_lim, diff_thresh)
 
 exclusions = np.array([])
-for sub in subj_ids:
-    
-    # get data files
-    mat = sio.loadmat(os.path.join(mat_path, str(sub) + "_aligned_ET.mat"))
-
-    # Pupil size during the entire timecourse
-    pupilSize = mat['pupilEncoding'].flatten()
-    time = mat['time'].flatten()
-
-    # calculate percentage of noise
-    result = calculate_noise(pupilSize, pupilDiff, 0.25, diff_thresh, lower_lim)
-
-    if result:
-        print(str(sub), " data is too noisy, will be excluded")
-        exclusions = np.append(str(sub), exclusions)
-
-    #else:
-        #pupil_z_scored = stats.zscore(pupilSize)
-        # save text file with participants to exclude
-        #filename = os.path.join(save_path, str(sub) + "_excluded_participants.mat")
-        #sio.savemat(filename, {'pupilZScored':pupil_z_scored, 'time': time, 'sample_num': mat['sample_num'], 'stim_min': mat['stim_min']})
-
-filename = os.path.join(save_path, str(z_all_data) + '_' + str(z_diff) + "_excluded_participants.mat")
-sio.savemat(filename, {'excluded_participants': exclusions})
-
-
-
-
-
-
-
+if not SWEEP:
+    for sub in subj_ids:
+        with run.step(str(sub) + '_noise') as rec:
+
+            # Pupil size during the entire timecourse and its sample-to-sample differences
+            pupilSize, differences = subject_data[sub]
+            rec['samples'] = len(pupilSize)
+
+            # calculate percentage of noise
+            noise_qc = {}
+            result = calculate_noise(pupilSize, differences, 0.25, diff_thresh, lower_lim, qc=noise_qc)
+            run.qc(sub, excluded=bool(result), **noise_qc)
+
+            if result:
+                print(str(sub), " data is too noisy, will be excluded")
+                exclusions = np.append(str(sub), exclusions)
+
+            #else:
+                #pupil_z_scored = stats.zscore(pupilSize)
+                # save text file with participants to exclude
+                #filename = os.path.join(save_path, str(sub) + "_excluded_participants.mat")
+                #sio.savemat(filename, {'pupilZScored':pupil_z_scored, 'time': time, 'sample_num': mat['sample_num'], 'stim_min': mat['stim_min']})
+
+    filename = os.path.join(save_path, str(z_all_data) + '_' + str(z_diff) + "_excluded_participants.mat")
+    sio.savemat(filename, {'excluded_participants': exclusions})
+    run.wrote(filename)
+
+else:
+    lower_lims = all_avg - np.array(z_all_grid) * all_sd
+    diff_threshs = all_diff_mean + np.array(z_diff_grid) * all_diff_sd
+
+    # Proportion of noise per subject for every (z_all_data, z_diff); shape subjects x z_all x z_diff
+    prop_noise = []
+    for sub in subj_ids:
+        with run.step(str(sub) + '_sweep') as rec:
+            pupilSize, differences = subject_data[sub]
+            rec['samples'] = len(pupilSize)
+            prop_noise.append(noise_proportions(pupilSize, differences, lower_lims, diff_threshs))
+    prop_noise = np.array(prop_noise)
+
+    # Excluded where the proportion of noise reaches p; shape subjects x z_all x z_diff x p
+    excluded = prop_noise[..., None] >= np.array(p_grid)
+
+    rows = []
+    for i, z_all in enumerate(z_all_grid):
+        for j, z_d in enumerate(z_diff_grid):
+            for k, p in enumerate(p_grid):
+                excluded_subs = [str(sub) for sub, flag in zip(subj_ids, excluded[:, i, j, k]) if flag]
+                rows.append({'z_all_data': z_all, 'z_diff': z_d, 'p': p,
+                             'lower_lim': lower_lims[i], 'diff_thresh': diff_threshs[j],
+                             'n_excluded': len(excluded_subs),
+                             'excluded_participants': ' '.join(excluded_subs)})
+    sweep_df = pd.DataFrame(rows)
+    print(sweep_df[['z_all_data', 'z_diff', 'p', 'n_excluded']].to_string(index=False))
+
+    filename = os.path.join(save_path, "noise_threshold_sweep.csv")
+    sweep_df.to_csv(filename, index=False)
+    run.wrote(filename)
+
+    # Proportion of noise of each subject, for picking thresholds by hand
+    filename = os.path.join(save_path, "noise_threshold_sweep_props.csv")
+    pd.DataFrame(prop_noise.reshape(len(subj_ids), -1), index=[str(sub) for sub in subj_ids],
+                 columns=pd.MultiIndex.from_product([z_all_grid, z_diff_grid], names=['z_all_data', 'z_diff'])).to_csv(filename)
+    run.wrote(filename)
+
+run.finish()
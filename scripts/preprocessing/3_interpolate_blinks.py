@@ -1,6 +1,10 @@
 # Authors: Kruthi Gollapudi (kruthig@uchicago.edu), Jadyn Park (jadynpark@uchicago.edu)
-# Last Edited: May 28, 2024
+# Last Edited: October 19, 2026
 # Description: The script interpolates over blinks using both Eyelink's blink detection algorithm and basic interpolation scheme for data loss < 1 sec (Murphy et al. 2014)
+# EyeLink's blinks (<sub>_aligned_blinks.csv from stage 1), padded by BLINK_PAD_PRE/BLINK_PAD_POST, are set to zero and
+# interpolated together with the runs of zeros
+# Artifacts that aren't zeros (partial blinks, spurious jumps) are detected by their dilation speed (Kret & Sjak-Shie,
+# 2019), widened by GAP_PAD around every gap and interpolated as well (DETECT_ARTIFACTS = 0 to skip)
 
 
 import numpy as np
@@ -8,13 +12,18 @@ import pandas as pd
 import os
 import scipy.io as sio
 import math
+from pupil_kernels import interpolate_zero_runs, interval_mask, merge_intervals, speed_artifact_mask
+from instrument import StageRun
+from session_index import story_path
+from job_queue import claimed
+from precision import as_data
 
 # Set data directories
-mat_path = os.path.normpath('/Users/kruthigollapudi/src/paranoia/data/pupil/3_processed/1_aligned')
+mat_path = story_path(os.path.normpath('/Users/kruthigollapudi/src/paranoia/data/pupil/3_processed/1_aligned'))
 ts_path = os.path.normpath('/Users/kruthigollapudi/src/paranoia/data/timestamps')
 
 # Set save directory
-save_path = os.path.normpath('/Users/kruthigollapudi/src/paranoia/data/pupil/3_processed/3_interpolated')
+save_path = story_path(os.path.normpath('/Users/kruthigollapudi/src/paranoia/data/pupil/3_processed/3_interpolated'))
 
 if not os.path.exists(save_path):
     os.makedirs(save_path)
@@ -25,98 +34,61 @@ subj_ids = range(1002, 1022)
 ## EXCLUDE 1022 and 1027
 ## ALTER FOLLOWING FUNCTION TO INCLUDE < 1 SEC INTERPOLATION
 
-def interpolate_blinks(sblink_minus1, eblink_plus1, pupilSize):
-    """
-    This function performs linear interpolation to estimate pupil size during blinks
-    
-    Params:
-        sblink_minus1: index of the sample right before blink
-        eblink_plus1: index of the sample right after blink
-        pupilSize: pupil size during the entire time course, where blinks are zeros
-        
-    Returns:
-        np.ndarray: modified pupil size with interpolated values for blinks
-    
-    """
-    
-    # Two points must be present for interpolations; if the data begins or ends with a blink, you cannot interpolate
-    if ((eblink_plus1 < len(pupilSize)) and (sblink_minus1 >= 0)):
-        
-        # Interpolate over these samples
-        blink_data = pupilSize[sblink_minus1:eblink_plus1]
-
-        # Pupil size right before and after blink
-        toInterp = [blink_data[0], blink_data[-1]]
-
-        # Timepoint to interpolate over
-        toInterp_TP = [0, len(blink_data)-1] # x-coordinate of query points
-        
-        # Perform interpolation
-        afterInterpolate = np.interp(range(len(blink_data)), toInterp_TP, toInterp)
-        afterInterpolate = afterInterpolate[1:-1]
-        
-        # Put the interpolated data back in
-        pupilSize[sblink_minus1 + 1:eblink_plus1-1] = afterInterpolate
-        
-    return pupilSize
-
-
-def zero_runs(arr):
-    """
-    Takes in array and outputs new array where each row contains the first and 
-    last index of the consecutive zeros present in the original array.
-    
-    Params:
-        arr: (np.ndarray) containing values with consecutive zeros
-        
-    Returns:
-        ranges: (np.ndarray) containing indices of consecutive zeros
-    
-    """
-
-    # Create an array that is 1 where a is 0, and pad each end with an extra 0.
-    iszero = np.concatenate(([0], np.equal(arr, 0).view(np.int8), [0]))
-    absdiff = np.abs(np.diff(iszero))
-
-    # Runs start and end where absdiff is 1.
-    result = np.where(absdiff == 1)[0].reshape(-1, 2)
-    return result
-
-
 WINSIZE = 1000 ## cap for ms needed for interpolation
 f_sample = int(500) # Sampling frequency/rate(Hz)
 
-for sub in subj_ids:
-
-    # get data
-    mat = sio.loadmat(os.path.join(mat_path, str(sub) + "_aligned_ET.mat"))
-    
-    # Pupil size during the entire timecourse
-    pupilSize = mat['pupilEncoding'].flatten()
-    time = mat['time'].flatten()
-    sample_num = mat['sample_num']
-    stim_length = mat['stim_min']
-
-    # get array containing index values of ranges to interpolate over
-    ranges = zero_runs(pupilSize)
-
-    for val in ranges:
-
-        # get first consec. zeros
-        start, end = (val[0], val[-1])
-
-        if (end - start) <= f_sample:  # make sure that the range is less than or eq. to 1 sec
-
-            i1, i2 = (start-1, end+1)
-            pupilSize_new = interpolate_blinks(i1, i2, pupilSize)
-            pupilSize = pupilSize_new
-
-    filename = os.path.join(save_path, str(sub) + "_interpolated_ET.mat")
-    sio.savemat(filename, {'pupilInterpolated':pupilSize, 'time': time, 'sample_num': sample_num, 'stim_min': stim_length})
-
-
+# Padding (ms) before and after each EyeLink blink, covering the lid closing and reopening
+BLINK_PAD_PRE = 100
+BLINK_PAD_POST = 100
 
+# Dilation-speed artifact detection: threshold in MADs above the median speed, and padding (ms) around every gap
+DETECT_ARTIFACTS = 1
+SPEED_MAD = 16
+GAP_PAD = 50
 
+run = StageRun('3_interpolate_blinks', save_path)
 
+# With PARANOIA_QUEUE set, only the subjects this worker claims (see job_queue.py)
+for sub in claimed('3_interpolate_blinks', subj_ids):
+    with run.step(sub) as rec:
+        # get data
+        mat = sio.loadmat(run.read(os.path.join(mat_path, str(sub) + "_aligned_ET.mat")))
     
-    
\ No newline at end of file
+        # Pupil size during the entire timecourse
+        pupilSize = as_data(mat['pupilEncoding'].flatten())
+        time = mat['time'].flatten()
+        sample_num = mat['sample_num']
+        stim_length = mat['stim_min']
+        rec['samples'] = len(pupilSize)
+        run.qc(sub, pct_zeros=100 * np.count_nonzero(pupilSize == 0) / len(pupilSize))
+
+        # mask EyeLink's blinks (plus padding) so they're interpolated along with the zeros
+        blink_file = os.path.join(mat_path, str(sub) + "_aligned_blinks.csv")
+        if os.path.exists(blink_file):
+            blinks = pd.read_csv(run.read(blink_file))
+            mask = interval_mask(len(pupilSize), blinks['start_idx'], blinks['end_idx'],
+                              pre=BLINK_PAD_PRE * f_sample // 1000, post=BLINK_PAD_POST * f_sample // 1000)
+            pupilSize[mask] = 0
+            run.qc(sub, blinks=len(merge_intervals(blinks['start_idx'], blinks['end_idx'])), blink_samples=int(mask.sum()))
+        else:
+            print(str(sub), "has no blink events, interpolating over zeros only")
+
+        # mask dilation-speed artifacts and the edges of every gap
+        if DETECT_ARTIFACTS:
+            artifacts = speed_artifact_mask(pupilSize, f_sample, SPEED_MAD, GAP_PAD * f_sample // 1000)
+            pupilSize[artifacts] = 0
+            run.qc(sub, artifact_samples=int(artifacts.sum()))
+
+        # interpolate over runs of zeros less than or eq. to 1 sec (gaps filled and skipped are counted on the way;
+        # pct_missing includes the masked blinks and artifacts, pct_zeros above is the raw data loss)
+        gap_qc = {}
+        pupilSize = interpolate_zero_runs(pupilSize, f_sample, qc=gap_qc)
+        run.qc(sub, pct_missing=100 * (gap_qc['filled_samples'] + gap_qc['skipped_samples']) / len(pupilSize),
+               pct_unfilled=100 * gap_qc['skipped_samples'] / len(pupilSize),
+               longest_gap_ms=gap_qc.pop('longest_gap') * 1000 / f_sample, **gap_qc)
+
+        filename = os.path.join(save_path, str(sub) + "_interpolated_ET.mat")
+        sio.savemat(filename, {'pupilInterpolated':pupilSize, 'time': time, 'sample_num': sample_num, 'stim_min': stim_length})
+        run.wrote(filename)
+
+run.finish()
@@ -1,7 +1,9 @@
 # Authors: Kruthi Gollapudi (kruthig@uchicago.edu), Jadyn Park (jadynpark@uchicago.edu)
-# Last Edited: June 12, 2024
+# Last Edited: October 19, 2026
 # Description: This script segments data into 1 second epochs (1 TR) and averages and removes data +/- 1 SD from segment mean
 # If 40% (changed to 50% for now) of the epoch data had to be removed, then interpolates across previous and following segments. (Murphy 2014)
+# Set SWEEP = 1 to evaluate a grid of (interval, prop) settings instead: the TRs lost per subject and setting are saved as
+# clean_by_TR_sweep.csv and each subject's cleaned series for every setting as <sub>_TR_sweep.mat
 
 import numpy as np
 import pandas as pd
@@ -9,18 +11,18 @@ import os
 import scipy.io as sio
 import math
 import importlib
-
-module_name = '3_interpolate_blinks'
-module = importlib.import_module(module_name)
-zero_runs = getattr(module, 'zero_runs')
-interpolate_blinks = getattr(module, 'interpolate_blinks')
+from pupil_kernels import clean_by_TR, clean_by_TR_sweep
+from instrument import StageRun
+from session_index import story_path
+from job_queue import claimed, worker_filename
+from precision import as_data
 
 # Set data directories
-mat_path = os.path.normpath('/Users/kruthigollapudi/src/paranoia/data/pupil/3_processed/4_downsampled')
+mat_path = story_path(os.path.normpath('/Users/kruthigollapudi/src/paranoia/data/pupil/3_processed/4_downsampled'))
 ts_path = os.path.normpath('/Users/kruthigollapudi/src/paranoia/data/timestamps')
 
 # Set save directory
-save_path = os.path.normpath('/Users/kruthigollapudi/src/paranoia/data/pupil/3_processed/5_last_interp')
+save_path = story_path(os.path.normpath('/Users/kruthigollapudi/src/paranoia/data/pupil/3_processed/5_last_interp'))
 
 if not os.path.exists(save_path):
     os.makedirs(save_path)
@@ -28,81 +30,56 @@ if not os.path.exists(save_path):
 # Set range of subjects
 subj_ids = range(1002, 1023)
 
-def compute_epoch_noise(arr, mean, interval, prop):
-    '''
-    Determines if segment of data is considered noisy, which is when 40% or more of the samples
-    are +/- 1 SD from the epoch mean.
-
-    Inputs:
-        - arr: (np.ndarray) containing samples from duration of 1 sec
-        - mean: (float) mean of epoch set
-        - interval: (float/int) how many SDs away from mean we want to measure
-        - prop: (float) percent of data that is the noise limit 
-
-    Outputs:
-        - float/int/np.nan, the mean if not noisy, otherwise NaN
-    '''
-
-    sd = np.std(arr)
-
-    upper_lim = mean + sd * interval
-    lower_lim = mean - sd * interval
-
-    count = 0
-
-    for m in arr:
-        if (m > upper_lim) or m < lower_lim:
-            count +=1
-
-    if count / len(arr) > prop:
-        #print("this set is noisy")
-        result = 0
-    else:
-        result = mean
-    
-    return result
-
-
 f_sample = 50  # sampling rate (downsampled to)
 
-for sub in subj_ids:
-    
-    # fetch data
-    mat = sio.loadmat(os.path.join(mat_path, str(sub) + "_downsampled_ET.mat"))
-    pupilSize = mat['pupilDownsampled'].flatten()
+# Parameter sweep (1 = evaluate the grids below, 0 = interval 1, prop 0.5 only)
+SWEEP = 0
+interval_grid = [0.5, 1, 1.5, 2]
+prop_grid = [0.3, 0.4, 0.5, 0.6]
 
-    n = len(pupilSize)
-    epoch_set = np.array([])
-    data_by_TR = np.array([])
+sweep_rows = []
 
-    for idx, val in enumerate(pupilSize):
-        epoch_set = np.append(val, epoch_set)
+run = StageRun('5_clean_by_TR', save_path)
 
-        if (idx + 1) % f_sample == 0 or idx == n-1:
-
-            epoch_mean = np.average(epoch_set)
-            output = compute_epoch_noise(epoch_set, epoch_mean, 1, 0.5)
-
-            data_by_TR = np.append(output, data_by_TR)
-            epoch_set = np.array([])
-    
-
-    # start interpolation
-    # get array containing index values of ranges to interpolate over
+# With PARANOIA_QUEUE set, only the subjects this worker claims (see job_queue.py)
+for sub in claimed('5_clean_by_TR', subj_ids):
+    with run.step(sub) as rec:
     
-    ranges = zero_runs(data_by_TR)
-
-    for val in ranges:
-
-        # get first consec. zeros
-        start, end = (val[0], val[-1])
-        i1, i2 = (start-1, end+1)
-        data_TR_new = interpolate_blinks(i1, i2, data_by_TR)
-        data_by_TR = data_TR_new
-
-
-    filename = os.path.join(save_path, str(sub) + "_final_interp_ET.mat")
-    sio.savemat(filename, {'pupilFinal': data_by_TR})
-    
-
-
+        # fetch data
+        mat = sio.loadmat(run.read(os.path.join(mat_path, str(sub) + "_downsampled_ET.mat")))
+        pupilSize = as_data(mat['pupilDownsampled'].flatten())
+        rec['samples'] = len(pupilSize)
+
+        if SWEEP:
+            data_by_TR, n_noisy, n_unfilled = clean_by_TR_sweep(pupilSize, f_sample, interval_grid, prop_grid)
+
+            for i, interval in enumerate(interval_grid):
+                for j, prop in enumerate(prop_grid):
+                    sweep_rows.append({'subject': sub, 'interval': interval, 'prop': prop, 'n_TRs': data_by_TR.shape[2],
+                                       'n_noisy': n_noisy[i, j], 'n_unfilled': n_unfilled[i, j],
+                                       'prop_noisy': n_noisy[i, j] / data_by_TR.shape[2]})
+
+            filename = os.path.join(save_path, str(sub) + "_TR_sweep.mat")
+            sio.savemat(filename, {'pupilSweep': data_by_TR, 'intervals': interval_grid, 'props': prop_grid,
+                                   'nNoisy': n_noisy, 'nUnfilled': n_unfilled})
+            run.wrote(filename)
+            continue
+
+        # average by TR (epochs that are +/- 1 SD from the epoch mean for more than 50% of samples are interpolated)
+        TR_qc = {}
+        data_by_TR = clean_by_TR(pupilSize, f_sample, 1, 0.5, qc=TR_qc)
+        run.qc(sub, pct_TRs_rejected=100 * TR_qc['TRs_rejected'] / TR_qc['TRs'], **TR_qc)
+
+        filename = os.path.join(save_path, str(sub) + "_final_interp_ET.mat")
+        sio.savemat(filename, {'pupilFinal': data_by_TR})
+        run.wrote(filename)
+
+if SWEEP:
+    sweep_df = pd.DataFrame(sweep_rows)
+    print(sweep_df.pivot_table(index='subject', columns=['interval', 'prop'], values='n_noisy').to_string())
+
+    filename = worker_filename(os.path.join(save_path, "clean_by_TR_sweep.csv"))
+    sweep_df.to_csv(filename, index=False)
+    run.wrote(filename)
+
+run.finish()
@@ -0,0 +1,106 @@
+# Authors: Kruthi Gollapudi (kruthig@uchicago.edu), Jadyn Park (jadynpark@uchicago.edu)
+# Last Edited: October 19, 2026
+# Description: QC step after stage 5: power spectra and inter-subject coherence of the cleaned per-TR pupil data
+# Saves the group spectrum and coherence per frequency (spectra.csv), the group power and coherence per band
+# (band_summary.csv) and each subject's band power (subject_band_power.csv), to spot subjects with unusual spectra
+
+import numpy as np
+import pandas as pd
+import os
+import scipy.io as sio
+from spectra import tapered_fft, power_spectra, coherence, band_summary
+from instrument import StageRun
+from job_queue import subjects_override
+from session_index import story_path
+from precision import as_data
+
+# Set data directories
+mat_path = story_path(os.path.normpath('/Users/kruthigollapudi/src/paranoia/data/pupil/3_processed/5_last_interp'))
+
+# Set save directory
+save_path = story_path(os.path.normpath('/Users/kruthigollapudi/src/paranoia/data/pupil/3_processed/5b_spectral_qc'))
+
+if not os.path.exists(save_path):
+    os.makedirs(save_path)
+
+# Set range of subjects
+subj_ids = subjects_override(range(1002, 1030))
+
+fs = 1.0 # samples per second of the stage 5 data (one per TR)
+
+# Spectral estimate ('welch' or 'multitaper'; nperseg=None with multitaper uses the whole story)
+method = 'welch'
+nperseg = 256
+NW = 4
+
+# Frequency bands (Hz)
+bands = {'very_slow': (0.005, 0.02), 'slow': (0.02, 0.05), 'mid': (0.05, 0.15), 'fast': (0.15, 0.5)}
+
+run = StageRun('5b_spectral_qc', save_path)
+
+list_pupil = []
+
+for sub in subj_ids:
+    with run.step(sub) as rec:
+
+        filename = os.path.join(mat_path, str(sub) + "_final_interp_ET.mat")
+
+        try:
+            mat = sio.loadmat(run.read(filename))
+        except FileNotFoundError: # Skip subject if file doesn't exist
+            continue
+
+        pupilSize = as_data(mat['pupilFinal'].flatten())
+
+        # TRs stage 5 couldn't interpolate (at the edges) are still 0: treat them as gaps
+        pupilSize = np.where(pupilSize == 0, np.nan, pupilSize)
+        rec['samples'] = len(pupilSize)
+        list_pupil.append(pd.Series(pupilSize, name=str(sub)))
+
+# Subjects x time cohort matrix (shorter sessions padded with NaN)
+pupilSize_by_sub = pd.concat(list_pupil, axis=1)
+subjects = list(pupilSize_by_sub.columns)
+
+with run.step('spectra') as rec:
+    rec['samples'] = pupilSize_by_sub.size
+
+    freqs, coefs, valid = tapered_fft(pupilSize_by_sub.to_numpy().T, fs, method, nperseg, NW=NW)
+    psd = power_spectra(coefs, valid)
+    pairwise, loo = coherence(coefs, valid)
+    rows, subj_power = band_summary(freqs, psd, pairwise, loo, bands)
+
+n_valid = valid.sum(axis=1)
+if (n_valid == 0).any():
+    print("No complete segments (NaN gaps everywhere):", [s for s, n in zip(subjects, n_valid) if n == 0])
+
+pairs = np.triu_indices(len(subjects), k=1)
+spectra_df = pd.DataFrame({'freq_hz': freqs,
+                           'psd_mean': np.nanmean(psd, axis=0),
+                           'psd_sem': np.nanstd(psd, axis=0, ddof=1) / np.sqrt(np.sum(~np.isnan(psd), axis=0)),
+                           'coherence_pairwise': np.nanmean(pairwise[pairs[0], pairs[1]], axis=0),
+                           'coherence_loo': np.nanmean(loo, axis=0)})
+
+band_df = pd.DataFrame(rows)
+print(band_df.to_string())
+
+subj_power_df = pd.DataFrame(subj_power, index=subjects)
+subj_power_df['n_estimates'] = n_valid
+
+filename = os.path.join(save_path, "spectra.csv")
+spectra_df.to_csv(filename, index=False)
+run.wrote(filename)
+
+filename = os.path.join(save_path, "band_summary.csv")
+band_df.to_csv(filename, index=False)
+run.wrote(filename)
+
+filename = os.path.join(save_path, "subject_band_power.csv")
+subj_power_df.to_csv(filename, index_label='subject')
+run.wrote(filename)
+
+filename = os.path.join(save_path, "spectra.mat")
+sio.savemat(filename, {'freqs': freqs, 'psd': psd, 'coherencePairwise': pairwise, 'coherenceLoo': loo,
+                       'subjects': subjects})
+run.wrote(filename)
+
+run.finish()
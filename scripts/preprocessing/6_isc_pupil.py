@@ -1,7 +1,12 @@
 # Authors: Kruthi Gollapudi (kruthig@uchicago.edu), Jadyn Park (jadynpark@uchicago.edu)
-# Last Edited: June 29, 2024
+# Last Edited: October 19, 2026
 # Description: This script takes in subjects' preprocessed pupil data and calculates the one-to-average ISC, testing significance
 # using bootstrapping
+# The bootstrap null is checkpointed to <save_path>/bootstrap_null.npz: a rerun resumes an interrupted bootstrap, and
+# raising nIt extends a finished one without recomputing the saved iterations. The null is kept for later analyses.
+# Set EVENT_ISC = 1 to also test the ISC within every story event (paranoia_events.xlsx) against one shared set of
+# phase-randomized surrogates, with FWER (max statistic) and FDR corrected p-values, saved as event_isc.csv. The
+# surrogate ISCs (iterations x events) are kept in event_isc_null.npz for later analyses, like the whole-story null
 
 
 import os
@@ -13,110 +18,33 @@ import pandas as pd
 import matplotlib.pyplot as plt
 from matplotlib import gridspec
 import seaborn as sns
-from statsmodels.stats.multitest import multipletests
 from sklearn.utils import check_random_state
 from numpy import interp
+from isc_utils import isc_loo, bootstrap_isc, load_null, event_isc_test
+from event_table import load_event_table
+from instrument import StageRun
+from job_queue import subjects_override
+from session_index import story_path, events_file
+from precision import as_data
 
 
 # Set data directory
 _thisDir = os.getcwd()
-path = os.path.normpath('/Users/kruthigollapudi/src/paranoia/data/pupil/3_processed/5_last_interp')
+path = story_path(os.path.normpath('/Users/kruthigollapudi/src/paranoia/data/pupil/3_processed/5_last_interp'))
 
 # Set save directory
-save_path = os.path.normpath('/Users/kruthigollapudi/src/paranoia/data/pupil/3_processed/6_isc')
+save_path = story_path(os.path.normpath('/Users/kruthigollapudi/src/paranoia/data/pupil/3_processed/6_isc'))
 
 
-## FUNCTIONS HERE
-
-def isc_loo(df, thisSub_idx):
-    """
-    One-to-average ISC
-
-    Parameters:
-        df (pd.DataFrame): dataframe of pupilSize by subject
-        thisSub_idx (int): index of this subject's data column
-    
-    Returns:
-        corr (np.float): one-to-average ISC for a given subject
-
-    """
-
-    i = thisSub_idx
-    thisSubj = df.iloc[:,i]
-    everyoneElse = df.drop(df.columns[[i]], axis=1)
-    
-    # Average everyone else's data
-    avg = everyoneElse.mean(axis=1)
-    
-    # Create a temporary df to store thisSubj and avg
-    df_temp = pd.DataFrame({'thisSubj': thisSubj, 'avg': avg})
-    
-    # Correlate this Subject's data with the average of everyone else's
-    corr = df_temp.corr(method='pearson').iloc[0,1]
-    
-    return corr
-
-def phase_randomize(data, random_state=None):
-    """Perform phase randomization on time-series signal (from nltools.stats)
-
-    This procedure preserves the power spectrum/autocorrelation,
-    but destroys any nonlinear behavior. Based on the algorithm
-    described in:
-
-    Theiler, J., Galdrikian, B., Longtin, A., Eubank, S., & Farmer, J. D. (1991).
-    Testing for nonlinearity in time series: the method of surrogate data
-    (No. LA-UR-91-3343; CONF-9108181-1). Los Alamos National Lab., NM (United States).
-
-    Lancaster, G., Iatsenko, D., Pidde, A., Ticcinelli, V., & Stefanovska, A. (2018).
-    Surrogate data for hypothesis testing of physical systems. Physics Reports, 748, 1-60.
-
-    1. Calculate the Fourier transform ftx of the original signal xn.
-    2. Generate a vector of random phases in the range[0, 2π]) with
-       length L/2,where L is the length of the time series.
-    3. As the Fourier transform is symmetrical, to create the new phase
-       randomized vector ftr , multiply the first half of ftx (i.e.the half
-       corresponding to the positive frequencies) by exp(iφr) to create the
-       first half of ftr.The remainder of ftr is then the horizontally flipped
-       complex conjugate of the first half.
-    4. Finally, the inverse Fourier transform of ftr gives the FT surrogate.
-
-    Args:
-
-        data: (np.array) data (can be 1d or 2d, time by features)
-        random_state: (int, None, or np.random.RandomState) Initial random seed (default: None)
-
-    Returns:
-
-        shifted_data: (np.array) phase randomized data
-    """
-    random_state = check_random_state(random_state)
-
-    data = np.array(data)
-    fft_data = fft(data, axis=0)
-
-    if data.shape[0] % 2 == 0:
-        pos_freq = np.arange(1, data.shape[0] // 2)
-        neg_freq = np.arange(data.shape[0] - 1, data.shape[0] // 2, -1)
-    else:
-        pos_freq = np.arange(1, (data.shape[0] - 1) // 2 + 1)
-        neg_freq = np.arange(data.shape[0] - 1, (data.shape[0] - 1) // 2, -1)
-
-    if len(data.shape) == 1:
-        phase_shifts = random_state.uniform(0, 2 * np.pi, size=(len(pos_freq)))
-        fft_data[pos_freq] *= np.exp(1j * phase_shifts)
-        fft_data[neg_freq] *= np.exp(-1j * phase_shifts)
-    else:
-        phase_shifts = random_state.uniform(
-            0, 2 * np.pi, size=(len(pos_freq), data.shape[1])
-        )
-        fft_data[pos_freq, :] *= np.exp(1j * phase_shifts)
-        fft_data[neg_freq, :] *= np.exp(-1j * phase_shifts)
-        
-    return np.real(ifft(fft_data, axis=0))
+# Define range of subject ids
+subj_ids = subjects_override(range(1002, 1030))
 
+# Event-wise ISC (1 = also test every event of the story, 0 = whole story only)
+EVENT_ISC = 0
+events_xlsx = events_file(os.path.normpath('/Users/kruthigollapudi/src/paranoia/paranoia_events.xlsx'))
+nIt_events = 5000
 
-# Define range of subject ids
-subj_ids = range(1002, 1030)
+run = StageRun('6_isc_pupil', save_path)
 
 # Iterate through subjects
 list_pupil = []
@@ -127,8 +55,8 @@ for sub in subj_ids:
    
     try:
         
-        mat = sio.loadmat(filename)
-        pupilSize = mat['pupilFinal'].flatten()
+        mat = sio.loadmat(run.read(filename))
+        pupilSize = as_data(mat['pupilFinal'].flatten())
         df = pd.DataFrame(
             {'pupilDownsampled': pupilSize}
         )
@@ -156,10 +84,13 @@ print(total_nans)
 isc_loo_values = {}
 nSub = pupilSize_by_sub.shape[1]
 
-for i in range(nSub):
-    
-    # Save the one-to-average correlation for each subject
-    isc_loo_values[pupilSize_by_sub.columns[i]] = isc_loo(pupilSize_by_sub, i)
+with run.step('isc_loo') as rec:
+    rec['samples'] = pupilSize_by_sub.size
+
+    for i in range(nSub):
+        
+        # Save the one-to-average correlation for each subject
+        isc_loo_values[pupilSize_by_sub.columns[i]] = isc_loo(pupilSize_by_sub, i)
 
 # One-to-average ISC
 isc_df = pd.DataFrame([isc_loo_values], index=None)
@@ -176,41 +107,18 @@ print('True mean r value: ', true_mean_r)
 
 # Permute bootstrapped samples
 nIt = 5000
-boot_ISC_mean = np.full([nIt,1], np.nan)
-
-for iteration in range(nIt):
-
-    if iteration % 100 == 0:
-        print('Iteration =', iteration)
-
-    for sub_idx in range(nSub):
-
-        # This subject's time series data
-        thisSubj = pupilSize_by_sub.iloc[:, sub_idx]
-
-        # Interpolate all NaNs for phase randomization
-        # This also pads edge cases (head/tail NaNs) with first/last occurring value
-        nSample = len(thisSubj)
-        x = np.arange(0, len(thisSubj), 1) # x-coordinate of query points
-        nan_indices = np.isnan(thisSubj) 
-        thisSubj_interp = np.interp(x, x[~nan_indices], thisSubj[~nan_indices])
+checkpoint = os.path.join(save_path, 'bootstrap_null.npz')
+checkpoint_every = 100 # iterations between checkpoints
 
-        # Everyone else's time series data
-        everyoneElse = pupilSize_by_sub.drop(pupilSize_by_sub.columns[[sub_idx]], axis=1)
+with run.step('bootstrap') as rec:
+    saved = load_null(checkpoint)
+    n_saved = 0 if saved is None else min(len(saved['null']), nIt)
+    run.cache_hit(n_saved) # iterations reused from the checkpoint
 
-        # Phase randomize this subject's (interpolated) data
-        thisSubj_rand = phase_randomize(thisSubj_interp)
-
-        # Average everyone else's data
-        avg = everyoneElse.mean(axis=1, skipna=True)
-
-        # Create a temporary df to store thisSubj_rand and avg
-        df_temp = pd.DataFrame({'thisSubj_rand': thisSubj_rand, 'avg': avg})
-
-        # Correlate this subject's phase randomized data with the average of everyone else's
-        boot_ISC_loo = df_temp.corr(method='pearson').iloc[0,1]
-
-        boot_ISC_mean[iteration] = np.tanh(np.nanmean(np.arctanh(boot_ISC_loo)))
+    rec['samples'] = pupilSize_by_sub.size * (nIt - n_saved)
+    rec['iterations'] = nIt
+    boot_ISC_mean = bootstrap_isc(pupilSize_by_sub, nIt, checkpoint=checkpoint, checkpoint_every=checkpoint_every)
+    run.wrote(checkpoint)
 
 # Difference between actual and bootstrapped means
 boot_ISC_demean = boot_ISC_mean - true_mean_r
@@ -228,8 +136,25 @@ isc_final_df = pd.DataFrame(
 
 filename = os.path.join(save_path, str(sub) + "_isc_values.csv")
 isc_final_df.to_csv(filename)
+run.wrote(filename)
+
+if EVENT_ISC:
+    with run.step('event_isc') as rec:
+        events = load_event_table(events_xlsx, n_TRs=pupilSize_by_sub.shape[0])
+        run.cache_hit(events['cached'])
+        rec['samples'] = pupilSize_by_sub.size * nIt_events
+        rec['events'] = len(events['TR_onset'])
+
+        event_isc_df, event_null = event_isc_test(pupilSize_by_sub, events['TR_onset'], events['TR_offset'], nIt_events)
 
+    print(event_isc_df.to_string())
 
+    filename = os.path.join(save_path, "event_isc.csv")
+    event_isc_df.to_csv(filename, index_label='event')
+    run.wrote(filename)
 
+    filename = os.path.join(save_path, "event_isc_null.npz")
+    np.savez(filename, null=event_null, TR_onset=events['TR_onset'], TR_offset=events['TR_offset'])
+    run.wrote(filename)
 
-    
\ No newline at end of file
+run.finish()
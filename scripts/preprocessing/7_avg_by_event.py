@@ -1,5 +1,5 @@
 # Authors: Kruthi Gollapudi (kruthig@uchicago.edu), Jadyn Park (jadynpark@uchicago.edu)
-# Last Edited: July 31, 2024
+# Last Edited: October 19, 2026
 # Description: This script takes in pupil data and averages by story event
 
 import numpy as np
@@ -8,13 +8,18 @@ import os
 import scipy.io as sio
 import math
 import importlib
+from event_table import load_event_tables
+from instrument import StageRun
+from session_index import story_path, events_file
+from job_queue import claimed
+from precision import DTYPE, as_data
 
 # Set data directories
-mat_path = os.path.normpath('/Users/kruthigollapudi/src/paranoia/data/pupil/3_processed/5_last_interp')
+mat_path = story_path(os.path.normpath('/Users/kruthigollapudi/src/paranoia/data/pupil/3_processed/5_last_interp'))
 ts_path = os.path.normpath('/Users/kruthigollapudi/src/paranoia')
 
 # Set save directory
-save_path = os.path.normpath('/Users/kruthigollapudi/src/paranoia/data/pupil/3_processed/7_avg_by_event')
+save_path = story_path(os.path.normpath('/Users/kruthigollapudi/src/paranoia/data/pupil/3_processed/7_avg_by_event'))
 
 if not os.path.exists(save_path):
     os.makedirs(save_path)
@@ -22,36 +27,54 @@ if not os.path.exists(save_path):
 # Set range of subjects
 subj_ids = range(1033, 1034)
 
-#Load timestamps
-event_ts = pd.read_excel(os.path.join(ts_path, "paranoia_events.xlsx"), engine='openpyxl')
-num_events = event_ts.shape[0]
+# Event annotations to average over; the first one is saved as 'pupilByEvent',
+# any others (e.g. alternative story segmentations) as 'pupilByEvent_<name>'
+event_files = [events_file(os.path.join(ts_path, "paranoia_events.xlsx"))]
 
-for sub in subj_ids:
+run = StageRun('7_avg_by_event', save_path)
+
+#Load timestamps (parsed once, then read from the binary cache)
+with run.step('load_events') as rec:
+    event_tables = load_event_tables(event_files)
+    run.cache_hit(sum(events['cached'] for events in event_tables.values()))
+
+# With PARANOIA_QUEUE set, only the subjects this worker claims (see job_queue.py)
+for sub in claimed('7_avg_by_event', subj_ids):
+    with run.step(sub) as rec:
     
-    # fetch data
-    mat = sio.loadmat(os.path.join(mat_path, str(sub) + "_final_interp_ET.mat"))
-    pupilSize = mat['pupilFinal'].flatten()
+        # fetch data
+        mat = sio.loadmat(run.read(os.path.join(mat_path, str(sub) + "_final_interp_ET.mat")))
+        pupilSize = as_data(mat['pupilFinal'].flatten())
+        rec['samples'] = len(pupilSize)
 
+        to_save = {}
 
-    TR_onset = event_ts['TR_onset']
-    TR_offset = event_ts['TR_offset']
+        for table_idx, (name, event_ts) in enumerate(event_tables.items()):
 
+            TR_onset = event_ts['TR_onset']
+            TR_offset = event_ts['TR_offset']
+            num_events = len(TR_onset)
 
-    averaged_data = np.array([])
+            averaged_data = np.array([], dtype=DTYPE)
 
-    for event in range(num_events):
-        
-        # get TR timestamps for each event
-        tr_1 = TR_onset[event]
-        tr_2 = TR_offset[event]
+            for event in range(num_events):
+            
+                # get TR timestamps for each event
+                tr_1 = TR_onset[event]
+                tr_2 = TR_offset[event]
 
-        # get pupil data for event
-        pupil_event = pupilSize[tr_1:tr_2]
-        avg_pupil_event = np.average(pupil_event)
+                # get pupil data for event
+                pupil_event = pupilSize[tr_1:tr_2]
+                avg_pupil_event = np.average(pupil_event)
 
-        # append to array
-        averaged_data = np.append(avg_pupil_event, averaged_data)
+                # append to array
+                averaged_data = np.append(averaged_data, avg_pupil_event)
+
+            key = 'pupilByEvent' if table_idx == 0 else 'pupilByEvent_' + name
+            to_save[key] = averaged_data
     
-    filename = os.path.join(save_path, str(sub) + "_avg_event_ET.mat")
-    sio.savemat(filename, {'pupilByEvent': averaged_data})
-    
\ No newline at end of file
+        filename = os.path.join(save_path, str(sub) + "_avg_event_ET.mat")
+        sio.savemat(filename, to_save)
+        run.wrote(filename)
+
+run.finish()
@@ -1,6 +1,8 @@
 # Authors: Kruthi Gollapudi (kruthig@uchicago.edu), Jadyn Park (jadynpark@uchicago.edu)
-# Last Edited: August 1, 2024
+# Last Edited: October 19, 2026
 # Description: This script takes in event-by-event pupil data for all subjects and averages across all subs per event
+# Subjects are aggregated incrementally: only new or changed subject files are read, and excluded subjects are
+# subtracted from the running state, which is kept in save_path
 
 import numpy as np
 import pandas as pd
@@ -8,37 +10,77 @@ import os
 import scipy.io as sio
 import math
 import importlib
+from running_aggregate import load_state, save_state, add_subject, remove_subject, summarize
+from instrument import StageRun
+from session_index import story_path
+from precision import as_data
 
 # Set data directories
-mat_path = os.path.normpath('/Users/kruthigollapudi/src/paranoia/data/pupil/3_processed/7_avg_by_event')
+mat_path = story_path(os.path.normpath('/Users/kruthigollapudi/src/paranoia/data/pupil/3_processed/7_avg_by_event'))
 
 # Set save directory
-save_path = os.path.normpath('/Users/kruthigollapudi/src/paranoia/data/pupil/3_processed/8_avg_across_subs')
+save_path = story_path(os.path.normpath('/Users/kruthigollapudi/src/paranoia/data/pupil/3_processed/8_avg_across_subs'))
 
 if not os.path.exists(save_path):
     os.makedirs(save_path)
 
-all_subs = {}
+# Subjects to drop from the average (e.g. excluded after QC), as "sub-XXXX"
+exclude_subs = []
 
-for filename in os.listdir(mat_path):
-    
-    pupil_data = os.path.join(mat_path, filename)
-    mat = sio.loadmat(pupil_data)
-    pupilSize = mat['pupilByEvent'].flatten()
+# Bootstrap settings for the confidence interval
+n_boot = 5000
+alpha = 0.05
 
-    subid = "sub-" + filename[:4]
-    all_subs[subid] = pupilSize
+run = StageRun('8_avg_across_subs', save_path)
 
-df_all_subs = pd.DataFrame(all_subs)
-df_all_subs['avg'] = df_all_subs.mean(axis=1)
+state_file = os.path.join(save_path, "paranoia_across_subs_state.npz")
+state = load_state(run.read(state_file), n_boot=n_boot)
 
-avg_across_subs = df_all_subs['avg'].values
+# Stage 7 outputs by subject ID ("sub-" + session key, e.g. sub-1002 or sub-1002_s2 for a repeated session); other
+# entries (e.g. the <story> subdirectories of other stories, see session_index.py) are skipped
+suffix = "_avg_event_ET.mat"
+subject_files = {"sub-" + filename[:-len(suffix)]: os.path.join(mat_path, filename)
+                 for filename in sorted(os.listdir(mat_path))
+                 if filename.endswith(suffix) and os.path.isfile(os.path.join(mat_path, filename))}
 
-filename_2 = os.path.join(save_path, "paranoia_across_subs_avg.mat")
-sio.savemat(filename_2, {'pupilAcrossSubs': avg_across_subs})
+# Drop excluded subjects, and subjects whose file has been deleted since they were aggregated
+for subid in list(state['subjects']):
+    if subid in exclude_subs or subid not in subject_files:
+        remove_subject(state, subid)
 
+for subid, pupil_data in subject_files.items():
+    
+    mtime = os.path.getmtime(pupil_data)
 
+    # Skip excluded subjects and subjects already aggregated from this version of the file
+    if subid in exclude_subs:
+        continue
+    if subid in state['subjects'] and state['mtimes'][state['subjects'].index(subid)] == mtime:
+        run.cache_hit()
+        continue
 
+    with run.step(subid) as rec:
+        mat = sio.loadmat(run.read(pupil_data))
+        pupilSize = as_data(mat['pupilByEvent'].flatten())
+        rec['samples'] = len(pupilSize)
 
+        add_subject(state, subid, pupilSize, mtime)
 
+save_state(state, state_file)
+run.wrote(state_file)
 
+with run.step('summarize') as rec:
+    rec['samples'] = int(np.sum(state['count']))
+    summary = summarize(state, alpha)
+avg_across_subs = summary['mean']
+
+filename_2 = os.path.join(save_path, "paranoia_across_subs_avg.mat")
+sio.savemat(filename_2, {'pupilAcrossSubs': avg_across_subs,
+                         'semAcrossSubs': summary['sem'],
+                         'ciLower': summary['ci_lower'],
+                         'ciUpper': summary['ci_upper'],
+                         'nSubs': summary['count'],
+                         'subjects': np.array(state['subjects'])})
+run.wrote(filename_2)
+
+run.finish()
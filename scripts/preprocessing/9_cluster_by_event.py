@@ -0,0 +1,132 @@
+# Authors: Kruthi Gollapudi (kruthig@uchicago.edu), Jadyn Park (jadynpark@uchicago.edu)
+# Last Edited: October 19, 2026
+# Description: This script tests when, within the story events, pupil responses differ from baseline (or between two
+# event conditions) with a cluster-based permutation test over the event-locked time course
+# Each subject's time course is cut around every event onset (paranoia_events.xlsx), baseline corrected with the
+# mean of the pre-onset TRs and averaged over events; the subject averages are then tested by sign flipping.
+# If condition_column is set, the paired difference between its two conditions is tested instead.
+# Set resolution to 'TR' for the stage 5 per-TR data or '50Hz' for the stage 4 data (50 samples per TR)
+
+import numpy as np
+import pandas as pd
+import os
+import warnings
+import scipy.io as sio
+from cluster_perm import event_locked, cluster_permutation_test
+from event_table import load_event_table
+from instrument import StageRun
+from job_queue import subjects_override
+from session_index import story_path, events_file
+from precision import as_data
+
+# Set data directories
+mat_path = {'TR': story_path(os.path.normpath('/Users/kruthigollapudi/src/paranoia/data/pupil/3_processed/5_last_interp')),
+            '50Hz': story_path(os.path.normpath('/Users/kruthigollapudi/src/paranoia/data/pupil/3_processed/4_downsampled'))}
+ts_path = os.path.normpath('/Users/kruthigollapudi/src/paranoia')
+
+# Set save directory
+save_path = story_path(os.path.normpath('/Users/kruthigollapudi/src/paranoia/data/pupil/3_processed/9_cluster_by_event'))
+
+if not os.path.exists(save_path):
+    os.makedirs(save_path)
+
+# Set range of subjects
+subj_ids = subjects_override(range(1002, 1030))
+
+resolution = 'TR'
+samples_per_TR = {'TR': 1, '50Hz': 50}[resolution]
+
+# Event window (TRs before and after the onset)
+pre_TRs = 2
+post_TRs = 10
+
+# Column of paranoia_events.xlsx with two event conditions to compare (None = test against baseline)
+condition_column = None
+
+# Permutation settings
+n_perm = 10000
+p_threshold = 0.05 # cluster-forming threshold
+tail = 0 # 0 = two-sided, 1 = positive clusters only, -1 = negative clusters only
+
+run = StageRun('9_cluster_by_event', save_path)
+
+#Load timestamps
+with run.step('load_events') as rec:
+    events_xlsx = events_file(os.path.join(ts_path, "paranoia_events.xlsx"))
+    events = load_event_table(events_xlsx)
+    run.cache_hit(events['cached'])
+    TR_onset, TR_offset = events['TR_onset'], events['TR_offset']
+    rec['events'] = len(TR_onset)
+
+    # The conditions aren't in the cached table; the spreadsheet is only parsed when they are needed
+    if condition_column is not None:
+        conditions = pd.read_excel(run.read(events_xlsx), engine='openpyxl')[condition_column].to_numpy()
+        condition_levels = np.unique(conditions)
+        if len(condition_levels) != 2:
+            raise ValueError(f"{condition_column} must have exactly two conditions, not {condition_levels}")
+
+subj_tcourses = []
+subj_names = []
+
+for sub in subj_ids:
+    with run.step(sub) as rec:
+
+        # fetch data
+        if resolution == 'TR':
+            filename, key = os.path.join(mat_path[resolution], str(sub) + "_final_interp_ET.mat"), 'pupilFinal'
+        else:
+            filename, key = os.path.join(mat_path[resolution], str(sub) + "_downsampled_ET.mat"), 'pupilDownsampled'
+
+        try:
+            mat = sio.loadmat(run.read(filename))
+        except FileNotFoundError: # Skip subject if file doesn't exist
+            continue
+
+        pupilSize = as_data(mat[key].flatten())
+        rec['samples'] = len(pupilSize)
+
+        # Event-locked epochs, baseline corrected with the mean of the pre-onset samples
+        epochs = event_locked(pupilSize, TR_onset, pre_TRs, post_TRs, samples_per_TR)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning) # windows whose baseline is outside the data
+            epochs = epochs - np.nanmean(epochs[:, :pre_TRs * samples_per_TR], axis=1, keepdims=True)
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning) # time points outside the data in every window
+            if condition_column is None:
+                tcourse = np.nanmean(epochs, axis=0)
+            else:
+                tcourse = (np.nanmean(epochs[conditions == condition_levels[1]], axis=0)
+                           - np.nanmean(epochs[conditions == condition_levels[0]], axis=0))
+
+        subj_tcourses.append(tcourse)
+        subj_names.append(str(sub))
+
+X = np.array(subj_tcourses)
+time_TR = np.arange(-pre_TRs * samples_per_TR, post_TRs * samples_per_TR) / samples_per_TR # in TRs from onset
+
+# Subjects without data at some time point (e.g. every window leaves the data) are left out
+complete = ~np.isnan(X).any(axis=1)
+if not complete.all():
+    print("Leaving out subjects with incomplete time courses:", [s for s, c in zip(subj_names, complete) if not c])
+
+with run.step('permutation') as rec:
+    rec['samples'] = X[complete].size * n_perm
+    rec['permutations'] = n_perm
+    t_obs, clusters, null = cluster_permutation_test(X[complete], n_perm, p_threshold=p_threshold, tail=tail)
+
+cluster_df = pd.DataFrame(clusters, columns=['start', 'end', 'sign', 'mass', 'p'])
+cluster_df['start_TR'] = time_TR[cluster_df['start']] if len(cluster_df) else []
+cluster_df['end_TR'] = time_TR[cluster_df['end'] - 1] + 1 / samples_per_TR if len(cluster_df) else []
+print(cluster_df.to_string())
+
+filename = os.path.join(save_path, "cluster_test_" + resolution + ".csv")
+cluster_df.to_csv(filename, index=False)
+run.wrote(filename)
+
+filename = os.path.join(save_path, "cluster_test_" + resolution + ".mat")
+sio.savemat(filename, {'tObs': t_obs, 'timeTR': time_TR, 'pupilByTime': X, 'subjects': subj_names,
+                       'included': complete, 'nullMaxMass': null})
+run.wrote(filename)
+
+run.finish()
@@ -0,0 +1,159 @@
+# Authors: Kruthi Gollapudi (kruthig@uchicago.edu), Jadyn Park (jadynpark@uchicago.edu)
+# Last Edited: October 19, 2026
+# Description: Cluster-based permutation test (Maris & Oostenveld, 2007) on event-locked pupil time courses.
+# Permutations are evaluated in batches as matrix products (sign flips or label permutations x data), and clusters
+# of every permutation are labeled at once, so 10k permutations take seconds rather than a loop per permutation.
+
+import numpy as np
+import scipy.stats as stats
+from sklearn.utils import check_random_state
+
+
+# ------------------ Define functions ------------------ #
+def event_locked(data, TR_onset, pre, post, samples_per_TR=1):
+    """
+    Cuts a window around every event onset.
+
+    Params:
+        data: (np.ndarray) time course of one subject (per TR, or samples_per_TR samples per TR)
+        TR_onset: (np.ndarray) onset TR of each event
+        pre: (int) TRs before the onset (baseline)
+        post: (int) TRs after the onset
+        samples_per_TR: (int) samples per TR of data (1 for per-TR data, 50 for the 50 Hz data)
+
+    Returns:
+        epochs: (np.ndarray) events x (pre + post) * samples_per_TR array; NaN where the window leaves the data
+    """
+    offsets = np.arange(-pre * samples_per_TR, post * samples_per_TR)
+    idx = np.asarray(TR_onset)[:, None] * samples_per_TR + offsets
+    inside = (idx >= 0) & (idx < len(data))
+
+    return np.where(inside, np.asarray(data, dtype=np.float64)[np.clip(idx, 0, len(data) - 1)], np.nan)
+
+
+def t_stats(X, flips=None, labels=None):
+    """
+    t statistic at every time point for a batch of permutations.
+
+    Params:
+        X: (np.ndarray) units (subjects) x time array
+        flips: (np.ndarray) permutations x units array of +/-1 (one-sample t test of sign-flipped data)
+        labels: (np.ndarray) permutations x units array of 0/1 (Welch t test of group 1 vs group 0)
+
+    Returns:
+        t: (np.ndarray) permutations x time array
+    """
+    if flips is not None:
+        n = X.shape[0]
+        mean = flips @ X / n
+        var = ((X ** 2).sum(axis=0) - n * mean ** 2) / (n - 1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return mean / np.sqrt(var / n)
+
+    X2 = X ** 2
+    t_groups = []
+    for member in (1 - labels, labels):
+        n = member.sum(axis=1, keepdims=True)
+        mean = member @ X / n
+        var = (member @ X2 - n * mean ** 2) / (n - 1)
+        t_groups.append((mean, var / n))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (t_groups[1][0] - t_groups[0][0]) / np.sqrt(t_groups[0][1] + t_groups[1][1])
+
+
+def cluster_masses(t, threshold):
+    """
+    Labels the clusters (runs of consecutive time points with t above threshold) of every row at once.
+
+    Params:
+        t: (np.ndarray) permutations x time array of t statistics (or -t for negative clusters)
+        threshold: (float) cluster-forming threshold
+
+    Returns:
+        row: (np.ndarray) row of each cluster
+        start, end: (np.ndarray) first and last + 1 time point of each cluster
+        mass: (np.ndarray) sum of t over each cluster
+    """
+    above = t > threshold
+    padded = np.pad(above, ((0, 0), (1, 1)))
+    edges = np.diff(padded.astype(np.int8), axis=1)
+    row, start = np.nonzero(edges == 1)
+    _, end = np.nonzero(edges == -1)
+
+    # Cluster id of every above-threshold point, counting across rows
+    label = np.cumsum(edges[:, :-1] == 1).reshape(t.shape) - 1
+    mass = np.bincount(label[above], weights=t[above], minlength=len(row))
+
+    return row, start, end, mass
+
+
+def max_cluster_mass(t, threshold, tail=0):
+    """
+    Largest cluster mass of every row (0 if a row has no cluster); for tail=0 the largest absolute mass
+    of the positive and negative clusters.
+    """
+    max_mass = np.zeros(t.shape[0])
+    signs = {1: [1], -1: [-1], 0: [1, -1]}[tail]
+
+    for sign in signs:
+        row, _, _, mass = cluster_masses(sign * t, threshold)
+        np.maximum.at(max_mass, row, mass)
+
+    return max_mass
+
+
+def cluster_permutation_test(X, n_perm=10000, labels=None, p_threshold=0.05, tail=0, random_state=None,
+                             batch_size=1000):
+    """
+    Cluster-based permutation test over time.
+
+    Without labels, tests whether X (e.g. baseline-corrected responses or paired condition differences) differs
+    from 0 by flipping the sign of whole units. With labels, tests group 1 vs group 0 by permuting the labels.
+
+    Params:
+        X: (np.ndarray) units (subjects) x time array
+        n_perm: (int) number of permutations
+        labels: (np.ndarray, optional) 0/1 group of each unit
+        p_threshold: (float) cluster-forming threshold, as a (per tail) p-value of the t statistic
+        tail: (int) 1 = positive clusters, -1 = negative clusters, 0 = both
+        random_state: (int, None, or np.random.RandomState) Initial random seed (default: None)
+        batch_size: (int) permutations evaluated per matrix product
+
+    Returns:
+        t_obs: (np.ndarray) observed t statistic at every time point
+        clusters: (list of dict) observed clusters with 'start', 'end' (time points, end exclusive), 'sign',
+            'mass' and 'p' (family-wise corrected over time)
+        null: (np.ndarray) largest cluster mass of every permutation
+    """
+    random_state = check_random_state(random_state)
+    X = np.asarray(X, dtype=np.float64)
+    n_units = X.shape[0]
+
+    if labels is None:
+        df = n_units - 1
+        observed = {'flips': np.ones((1, n_units))}
+    else:
+        labels = np.asarray(labels).astype(int)
+        df = n_units - 2
+        observed = {'labels': labels[None, :]}
+    threshold = stats.t.ppf(1 - p_threshold / (2 if tail == 0 else 1), df)
+
+    t_obs = t_stats(X, **observed)[0]
+
+    null = np.zeros(n_perm)
+    for start in range(0, n_perm, batch_size):
+        n = min(batch_size, n_perm - start)
+        if labels is None:
+            perm = {'flips': random_state.choice([-1.0, 1.0], size=(n, n_units))}
+        else:
+            perm = {'labels': np.array([random_state.permutation(labels) for _ in range(n)], dtype=np.float64)}
+        null[start:start + n] = max_cluster_mass(t_stats(X, **perm), threshold, tail)
+
+    clusters = []
+    for sign in {1: [1], -1: [-1], 0: [1, -1]}[tail]:
+        _, starts, ends, masses = cluster_masses(sign * t_obs[None, :], threshold)
+        for start, end, mass in zip(starts, ends, masses):
+            clusters.append({'start': int(start), 'end': int(end), 'sign': sign, 'mass': mass,
+                             'p': (1 + np.sum(null >= mass)) / (n_perm + 1)})
+
+    return t_obs, sorted(clusters, key=lambda c: c['start']), null
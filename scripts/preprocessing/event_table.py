@@ -0,0 +1,177 @@
+# Authors: Kruthi Gollapudi (kruthig@uchicago.edu), Jadyn Park (jadynpark@uchicago.edu)
+# Last Edited: October 19, 2026
+# Description: Loads story event annotations (e.g. paranoia_events.xlsx) as integer TR onset/offset arrays.
+# The spreadsheet is parsed once and cached as a .npz file; the cache is reused as long as the
+# spreadsheet's mtime or content hash is unchanged.
+# The cache is written atomically (temporary file + rename), so queue workers running stages 6, 7 and 9 at the same
+# time never read a half-written cache; a cache that can't be read is reparsed.
+
+import numpy as np
+import pandas as pd
+import os
+import hashlib
+import tempfile
+import zipfile
+
+CACHE_VERSION = 1
+
+
+# ------------------ Define functions ------------------ #
+def file_hash(path):
+    """
+    Computes the SHA-1 hash of a file's contents.
+
+    Params:
+        path: (str) path to the file
+
+    Returns:
+        (str) hex digest of the file
+    """
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+
+    return h.hexdigest()
+
+
+def validate_events(TR_onset, TR_offset, n_TRs=None, name='events'):
+    """
+    Checks that event onsets/offsets are whole, non-negative TR indices with offset > onset.
+
+    Params:
+        TR_onset: (array-like) onset TR of each event
+        TR_offset: (array-like) offset TR of each event (exclusive, as used in pupilSize[tr_1:tr_2])
+        n_TRs: (int, optional) number of TRs in the story; offsets must not exceed it
+        name: (str) name of the annotation, used in error messages
+
+    Returns:
+        TR_onset, TR_offset: (np.ndarray) validated int64 arrays
+    """
+    onset = np.asarray(TR_onset, dtype=float)
+    offset = np.asarray(TR_offset, dtype=float)
+
+    if onset.shape != offset.shape or onset.ndim != 1:
+        raise ValueError(f"{name}: TR_onset and TR_offset must be 1D and of equal length")
+    if np.isnan(onset).any() or np.isnan(offset).any():
+        raise ValueError(f"{name}: missing TR_onset/TR_offset values in rows {np.where(np.isnan(onset) | np.isnan(offset))[0]}")
+    if (onset != np.round(onset)).any() or (offset != np.round(offset)).any():
+        raise ValueError(f"{name}: TR_onset/TR_offset must be whole TRs")
+
+    onset = onset.astype(np.int64)
+    offset = offset.astype(np.int64)
+
+    if (onset < 0).any():
+        raise ValueError(f"{name}: negative TR_onset in rows {np.where(onset < 0)[0]}")
+    if (offset <= onset).any():
+        raise ValueError(f"{name}: TR_offset <= TR_onset in rows {np.where(offset <= onset)[0]}")
+    if n_TRs is not None and (offset > n_TRs).any():
+        raise ValueError(f"{name}: TR_offset beyond story length ({n_TRs} TRs) in rows {np.where(offset > n_TRs)[0]}")
+
+    return onset, offset
+
+
+def _read_cache(cache_file):
+    """
+    Reads a cache file into memory, or returns None if it is missing or can't be read (e.g. corrupt).
+    """
+    try:
+        with np.load(cache_file) as cache:
+            return {key: cache[key] for key in cache.files}
+    except (OSError, ValueError, EOFError, zipfile.BadZipFile):
+        return None
+
+
+def _write_cache(cache_file, **arrays):
+    """
+    Writes a cache file. Written to a uniquely named temporary file in the same directory first and then renamed,
+    so concurrent writers don't clash and readers only ever see a complete file.
+    """
+    fd, tmp_path = tempfile.mkstemp(suffix='.tmp.npz', dir=os.path.dirname(cache_file))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, cache_file)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def load_event_table(xlsx_path, cache_dir=None, n_TRs=None):
+    """
+    Returns the TR onsets/offsets of an event spreadsheet, using the binary cache when it is current.
+
+    The cache stores the spreadsheet's mtime and SHA-1 hash. If the mtime matches the cache is used
+    directly; if only the mtime changed (e.g. the file was copied) the hash is checked before reparsing.
+
+    Params:
+        xlsx_path: (str) path to the event spreadsheet with TR_onset and TR_offset columns
+        cache_dir: (str, optional) where to keep the cache; defaults to .event_cache next to the spreadsheet
+        n_TRs: (int, optional) number of TRs in the story, used for validation
+
+    Returns:
+        events: (dict) with 'TR_onset' and 'TR_offset' (np.ndarray of int64), 'name' (str) and 'cached'
+            (bool, whether the cache was used)
+    """
+    xlsx_path = os.path.abspath(xlsx_path)
+    name = os.path.splitext(os.path.basename(xlsx_path))[0]
+
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(xlsx_path), '.event_cache')
+    os.makedirs(cache_dir, exist_ok=True)
+
+    cache_file = os.path.join(cache_dir, name + '_events.npz')
+    mtime = os.path.getmtime(xlsx_path)
+    sha1 = None
+
+    cache = _read_cache(cache_file)
+    if cache is not None and {'version', 'mtime', 'sha1', 'TR_onset', 'TR_offset'} <= set(cache):
+
+        if int(cache['version']) == CACHE_VERSION:
+            hit = float(cache['mtime']) == mtime
+
+            # mtime changed but the contents may not have
+            if not hit:
+                sha1 = file_hash(xlsx_path)
+                hit = str(cache['sha1']) == sha1
+                if hit:
+                    _write_cache(cache_file, version=CACHE_VERSION, mtime=mtime, sha1=sha1,
+                                 TR_onset=cache['TR_onset'], TR_offset=cache['TR_offset'])
+
+            if hit:
+                onset, offset = validate_events(cache['TR_onset'], cache['TR_offset'], n_TRs, name)
+                return {'name': name, 'TR_onset': onset, 'TR_offset': offset, 'cached': True}
+
+    # Cache missing or stale: parse the spreadsheet
+    event_ts = pd.read_excel(xlsx_path, engine='openpyxl')
+    onset, offset = validate_events(event_ts['TR_onset'], event_ts['TR_offset'], n_TRs, name)
+
+    if sha1 is None:
+        sha1 = file_hash(xlsx_path)
+    _write_cache(cache_file, version=CACHE_VERSION, mtime=mtime, sha1=sha1, TR_onset=onset, TR_offset=offset)
+
+    return {'name': name, 'TR_onset': onset, 'TR_offset': offset, 'cached': False}
+
+
+def load_event_tables(xlsx_paths, cache_dir=None, n_TRs=None):
+    """
+    Loads several event annotations (e.g. different segmentations of the same story) side by side.
+
+    Params:
+        xlsx_paths: (list of str) paths to event spreadsheets
+        cache_dir: (str, optional) shared cache directory
+        n_TRs: (int, optional) number of TRs in the story, used for validation
+
+    Returns:
+        tables: (dict) annotation name -> events dict from load_event_table, in the order given
+    """
+    tables = {}
+
+    for xlsx_path in xlsx_paths:
+        events = load_event_table(xlsx_path, cache_dir=cache_dir, n_TRs=n_TRs)
+        if events['name'] in tables:
+            raise ValueError(f"Duplicate event annotation name: {events['name']}")
+        tables[events['name']] = events
+
+    return tables
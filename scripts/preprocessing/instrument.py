@@ -0,0 +1,212 @@
+# Authors: Kruthi Gollapudi (kruthig@uchicago.edu), Jadyn Park (jadynpark@uchicago.edu)
+# Last Edited: October 19, 2026
+# Description: Lightweight instrumentation for the preprocessing stages. Each stage run records, per subject (or named
+# step such as the bootstrap): wall time, CPU time, peak RSS, samples processed, bytes read and written, and cache hits.
+# At the end of the run a JSON manifest is written to <processed dir>/manifests.
+# Stages also record per-subject QC counters (run.qc) from quantities they compute anyway; collect_qc merges the
+# counters of every stage's manifests into one cohort QC table (10_qc_table.py).
+# Set PARANOIA_PROFILE=<subject or step> to also save a cProfile and tracemalloc capture of that step.
+
+import cProfile
+import glob
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import pandas as pd
+from contextlib import contextmanager
+from job_queue import worker_filename
+from session_index import DEFAULT_STORY, STORY, story_path
+
+try:
+    import resource
+except ImportError: # not available on Windows
+    resource = None
+
+
+# ------------------ Define functions ------------------ #
+def peak_rss_mb():
+    """
+    Peak resident set size of this process so far (MB), or None where it can't be measured.
+    """
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return maxrss / 1e6 if sys.platform == 'darwin' else maxrss / 1e3
+
+
+class StageRun:
+    """
+    Collects instrumentation for one run of a stage.
+
+    Params:
+        stage: (str) name of the stage, e.g. '3_interpolate_blinks'
+        save_path: (str) the stage's output directory; the manifest goes to its sibling 'manifests' directory
+            (manifests/<story> for stories other than paranoia, whose save_path is <stage dir>/<story>)
+    """
+
+    def __init__(self, stage, save_path):
+        self.stage = stage
+        stage_dir = os.path.normpath(save_path)
+        if STORY != DEFAULT_STORY and os.path.basename(stage_dir) == STORY:
+            stage_dir = os.path.dirname(stage_dir)
+        self.manifest_path = story_path(os.path.join(os.path.dirname(stage_dir), 'manifests'))
+        self.profile_step = os.environ.get('PARANOIA_PROFILE')
+        self.started_ts = time.time()
+        self.started = time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started_ts))
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+        self.steps = []
+        self._current = None
+
+        # Counters for I/O outside of any step (e.g. a stage's final cohort-level output)
+        self._run_record = {'samples': 0, 'bytes_read': 0, 'bytes_written': 0, 'cache_hits': 0}
+
+    @contextmanager
+    def step(self, name):
+        """
+        Instruments one subject (or named step). Yields the step's record, to which the stage adds
+        'samples' and custom counters.
+        """
+        record = {'step': str(name), 'samples': 0, 'bytes_read': 0, 'bytes_written': 0, 'cache_hits': 0}
+        self._current = record
+
+        profiler = None
+        if self.profile_step is not None and str(name) == self.profile_step:
+            profiler = cProfile.Profile()
+            tracemalloc.start()
+            profiler.enable()
+
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        try:
+            yield record
+        finally:
+            record['wall_s'] = time.perf_counter() - start_wall
+            record['cpu_s'] = time.process_time() - start_cpu
+            record['peak_rss_mb'] = peak_rss_mb()
+            record['samples_per_s'] = record['samples'] / record['wall_s'] if record['wall_s'] > 0 else None
+
+            if profiler is not None:
+                profiler.disable()
+                self._save_profile(str(name), profiler, tracemalloc.take_snapshot())
+                tracemalloc.stop()
+
+            self.steps.append(record)
+            self._current = None
+
+    def read(self, path):
+        """
+        Counts the size of a file read by the current step. Returns path, so it can wrap the load call.
+        """
+        if os.path.exists(path):
+            self._record()['bytes_read'] += os.path.getsize(path)
+
+        return path
+
+    def wrote(self, path):
+        """
+        Counts the size of a file written by the current step.
+        """
+        if os.path.exists(path):
+            self._record()['bytes_written'] += os.path.getsize(path)
+
+        return path
+
+    def cache_hit(self, n=1):
+        """
+        Counts cache hits (e.g. cached event tables, already aggregated subjects) in the current step.
+        """
+        self._record()['cache_hits'] += n
+
+    def qc(self, sub, **counters):
+        """
+        Records QC counters (scalars, e.g. pct_zeros=1.2) of subject sub in the current step. They go into the
+        step's 'qc' entry of the manifest, from which collect_qc builds the cohort QC table.
+        """
+        record = self._record()
+        record['subject'] = str(sub)
+        record.setdefault('qc', {}).update(counters)
+
+    def _record(self):
+        return self._current if self._current is not None else self._run_record
+
+    def _save_profile(self, name, profiler, snapshot):
+        if not os.path.exists(self.manifest_path):
+            os.makedirs(self.manifest_path)
+        prefix = os.path.join(self.manifest_path, self.stage + '_' + name)
+
+        profiler.dump_stats(prefix + '.prof')
+        with open(prefix + '_tracemalloc.txt', 'w') as f:
+            for stat in snapshot.statistics('lineno')[:50]:
+                f.write(str(stat) + '\n')
+
+    def finish(self):
+        """
+        Writes the run manifest and returns its path.
+        """
+        totals = {key: self._run_record[key] + sum(s[key] for s in self.steps) for key in self._run_record}
+        totals['wall_s'] = time.perf_counter() - self.start_wall
+        totals['cpu_s'] = time.process_time() - self.start_cpu
+        totals['peak_rss_mb'] = peak_rss_mb()
+        totals['samples_per_s'] = totals['samples'] / totals['wall_s'] if totals['wall_s'] > 0 else None
+
+        manifest = {
+            'stage': self.stage,
+            'story': STORY,
+            'started': self.started,
+            'started_ts': self.started_ts,
+            'python': platform.python_version(),
+            'machine': platform.platform(),
+            'argv': sys.argv,
+            'totals': totals,
+            'steps': self.steps,
+        }
+
+        if not os.path.exists(self.manifest_path):
+            os.makedirs(self.manifest_path)
+        # Start time to the microsecond plus the pid, so runs started within the same second don't overwrite each other
+        stamp = time.strftime('%Y%m%d_%H%M%S', time.localtime(self.started_ts)) + '_%06d' % (self.started_ts % 1 * 1e6)
+        filename = worker_filename(os.path.join(self.manifest_path,
+                                                self.stage + '_' + stamp + '_' + str(os.getpid()) + '.json'))
+        with open(filename, 'w') as f:
+            json.dump(manifest, f, indent=1)
+
+        return filename
+
+
+def collect_qc(manifest_path):
+    """
+    Merges the QC counters of all manifests in manifest_path into one table. Where a subject was processed by
+    several runs of a stage (reruns, queue workers, single-session runs), the most recent run's counters are kept.
+
+    Returns:
+        qc_table: (pd.DataFrame) one row per subject, one column per '<stage>.<counter>', in pipeline order
+    """
+    manifests = []
+    for filename in glob.glob(os.path.join(manifest_path, '*.json')):
+        with open(filename) as f:
+            manifests.append(json.load(f))
+
+    rows = {}
+    for manifest in sorted(manifests, key=lambda m: m['started_ts']):
+        for record in manifest['steps']:
+            if 'qc' not in record:
+                continue
+            row = rows.setdefault(record['subject'], {})
+            for key, value in record['qc'].items():
+                row[manifest['stage'] + '.' + key] = value
+
+    qc_table = pd.DataFrame.from_dict(rows, orient='index')
+    qc_table.index.name = 'subject'
+
+    # Pipeline order: stage number (1, ..., 5, 5b, ..., 10), then the order the counters were recorded in
+    def stage_order(column):
+        number = column.split('_')[0]
+        return int(number.rstrip('abcdefghijklmnopqrstuvwxyz')), number
+
+    return qc_table[sorted(qc_table.columns, key=stage_order)].sort_index()
@@ -0,0 +1,396 @@
+# Authors: Kruthi Gollapudi (kruthig@uchicago.edu), Jadyn Park (jadynpark@uchicago.edu)
+# Last Edited: October 19, 2026
+# Description: One-to-average ISC and its phase-randomization bootstrap, shared by stage 6 and the benchmarks.
+# The bootstrap can be checkpointed to an .npz file (null values so far, RNG state and a fingerprint of the cohort's
+# data), so that an interrupted run resumes where it stopped, a finished run can be extended with more iterations,
+# and the stored null can be reused by later analyses of the same cohort.
+# Event-wise ISC (event_isc_test) tests every story event against one shared batch of surrogates.
+
+import os
+import zlib
+import numpy as np
+from numpy.fft import fft, ifft
+import pandas as pd
+from sklearn.utils import check_random_state
+from statsmodels.stats.multitest import multipletests
+
+# ------------------ Define functions ------------------ #
+def isc_loo(df, thisSub_idx):
+    """
+    One-to-average ISC
+
+    Parameters:
+        df (pd.DataFrame): dataframe of pupilSize by subject
+        thisSub_idx (int): index of this subject's data column
+    
+    Returns:
+        corr (np.float): one-to-average ISC for a given subject
+
+    """
+
+    i = thisSub_idx
+    thisSubj = df.iloc[:,i]
+    everyoneElse = df.drop(df.columns[[i]], axis=1)
+    
+    # Average everyone else's data
+    avg = everyoneElse.mean(axis=1)
+    
+    # Create a temporary df to store thisSubj and avg
+    df_temp = pd.DataFrame({'thisSubj': thisSubj, 'avg': avg})
+    
+    # Correlate this Subject's data with the average of everyone else's (pandas correlates in float64, also for float32 data)
+    corr = df_temp.corr(method='pearson').iloc[0,1]
+    
+    return corr
+
+def phase_randomize(data, random_state=None):
+    """Perform phase randomization on time-series signal (from nltools.stats)
+
+    This procedure preserves the power spectrum/autocorrelation,
+    but destroys any nonlinear behavior. Based on the algorithm
+    described in:
+
+    Theiler, J., Galdrikian, B., Longtin, A., Eubank, S., & Farmer, J. D. (1991).
+    Testing for nonlinearity in time series: the method of surrogate data
+    (No. LA-UR-91-3343; CONF-9108181-1). Los Alamos National Lab., NM (United States).
+
+    Lancaster, G., Iatsenko, D., Pidde, A., Ticcinelli, V., & Stefanovska, A. (2018).
+    Surrogate data for hypothesis testing of physical systems. Physics Reports, 748, 1-60.
+
+    1. Calculate the Fourier transform ftx of the original signal xn.
+    2. Generate a vector of random phases in the range[0, 2π]) with
+       length L/2,where L is the length of the time series.
+    3. As the Fourier transform is symmetrical, to create the new phase
+       randomized vector ftr , multiply the first half of ftx (i.e.the half
+       corresponding to the positive frequencies) by exp(iφr) to create the
+       first half of ftr.The remainder of ftr is then the horizontally flipped
+       complex conjugate of the first half.
+    4. Finally, the inverse Fourier transform of ftr gives the FT surrogate.
+
+    Args:
+
+        data: (np.array) data (can be 1d or 2d, time by features)
+        random_state: (int, None, or np.random.RandomState) Initial random seed (default: None)
+
+    Returns:
+
+        shifted_data: (np.array) phase randomized data
+    """
+    random_state = check_random_state(random_state)
+
+    data = np.array(data)
+    fft_data = fft(data, axis=0)
+
+    if data.shape[0] % 2 == 0:
+        pos_freq = np.arange(1, data.shape[0] // 2)
+        neg_freq = np.arange(data.shape[0] - 1, data.shape[0] // 2, -1)
+    else:
+        pos_freq = np.arange(1, (data.shape[0] - 1) // 2 + 1)
+        neg_freq = np.arange(data.shape[0] - 1, (data.shape[0] - 1) // 2, -1)
+
+    if len(data.shape) == 1:
+        phase_shifts = random_state.uniform(0, 2 * np.pi, size=(len(pos_freq)))
+        fft_data[pos_freq] *= np.exp(1j * phase_shifts)
+        fft_data[neg_freq] *= np.exp(-1j * phase_shifts)
+    else:
+        phase_shifts = random_state.uniform(
+            0, 2 * np.pi, size=(len(pos_freq), data.shape[1])
+        )
+        fft_data[pos_freq, :] *= np.exp(1j * phase_shifts)
+        fft_data[neg_freq, :] *= np.exp(-1j * phase_shifts)
+        
+    return np.real(ifft(fft_data, axis=0))
+
+
+def cohort_fingerprint(pupilSize_by_sub):
+    """
+    Checksum of the subjects and data a bootstrap null was computed from (float64, so it doesn't depend on the dtype)
+    """
+    values = np.ascontiguousarray(pupilSize_by_sub.to_numpy(dtype=np.float64))
+    columns = ','.join(str(c) for c in pupilSize_by_sub.columns)
+
+    return zlib.crc32(values.tobytes(), zlib.crc32(columns.encode()))
+
+
+def load_null(path):
+    """
+    Loads a bootstrap checkpoint.
+
+    Parameters:
+        path (str): checkpoint file (.npz) written by bootstrap_isc
+
+    Returns:
+        checkpoint (dict): 'null' (completed iterations, n x 1), 'fingerprint' of the cohort and the RNG state
+        ('rng_keys', 'rng_pos', 'rng_has_gauss', 'rng_cached_gaussian'), or None if there is no checkpoint yet
+    """
+    if not os.path.exists(path):
+        return None
+
+    saved = np.load(path, allow_pickle=False)
+
+    return {key: saved[key] for key in saved.files}
+
+
+def save_null(path, boot_ISC_mean, fingerprint, random_state):
+    """
+    Writes a bootstrap checkpoint. Written to a temporary file first so an interrupted save never leaves
+    a corrupt checkpoint behind.
+    """
+    _, keys, pos, has_gauss, cached_gaussian = random_state.get_state()
+    tmp_path = path + '.tmp.npz'
+    np.savez(tmp_path, null=boot_ISC_mean, fingerprint=np.int64(fingerprint), rng_keys=keys, rng_pos=pos,
+             rng_has_gauss=has_gauss, rng_cached_gaussian=cached_gaussian)
+    os.replace(tmp_path, path)
+
+
+def bootstrap_isc(pupilSize_by_sub, nIt, random_state=None, checkpoint=None, checkpoint_every=100):
+    """
+    Null distribution of the mean one-to-average ISC: in every iteration each subject's (NaN-interpolated)
+    time series is phase randomized and correlated with the average of everyone else's data.
+
+    With a checkpoint file, the null values and RNG state are saved every checkpoint_every iterations.
+    A later call with the same checkpoint continues from the last saved iteration (random_state is then
+    ignored), so resumed or extended runs give the same null as one uninterrupted run.
+
+    Parameters:
+        pupilSize_by_sub (pd.DataFrame): dataframe of pupilSize by subject
+        nIt (int): number of bootstrap iterations
+        random_state (int, None, or np.random.RandomState): Initial random seed (default: None)
+        checkpoint (str): checkpoint file (.npz), or None to not checkpoint (default: None)
+        checkpoint_every (int): iterations between checkpoints (default: 100)
+
+    Returns:
+        boot_ISC_mean (np.ndarray): nIt x 1 array of mean (Fisher-z averaged) bootstrapped ISCs
+
+    """
+    nSub = pupilSize_by_sub.shape[1]
+    boot_ISC_mean = np.full([nIt,1], np.nan)
+    start = 0
+
+    if checkpoint is not None:
+        fingerprint = cohort_fingerprint(pupilSize_by_sub)
+        saved = load_null(checkpoint)
+
+        if saved is not None:
+            if int(saved['fingerprint']) != fingerprint:
+                raise ValueError(checkpoint + " was computed from different subjects or data; "
+                                 "remove it to start a new bootstrap")
+
+            # Resume: reuse the completed iterations and continue the saved random sequence
+            start = min(len(saved['null']), nIt)
+            boot_ISC_mean[:start] = saved['null'][:start]
+            random_state = np.random.RandomState()
+            random_state.set_state(('MT19937', saved['rng_keys'], int(saved['rng_pos']),
+                                    int(saved['rng_has_gauss']), float(saved['rng_cached_gaussian'])))
+            print('Resuming bootstrap at iteration', start, 'of', nIt)
+
+            # Asked for no more iterations than are already saved
+            if start == nIt:
+                return boot_ISC_mean
+
+    random_state = check_random_state(random_state)
+
+    # Neither the interpolated data nor the leave-one-out averages depend on the iteration
+    subj_interp = []
+    avgs = []
+    for sub_idx in range(nSub):
+
+        # This subject's time series data
+        thisSubj = pupilSize_by_sub.iloc[:, sub_idx]
+
+        # Interpolate all NaNs for phase randomization
+        # This also pads edge cases (head/tail NaNs) with first/last occurring value
+        x = np.arange(0, len(thisSubj), 1) # x-coordinate of query points
+        nan_indices = np.isnan(thisSubj)
+        subj_interp.append(np.interp(x, x[~nan_indices], thisSubj[~nan_indices]))
+
+        # Average everyone else's data
+        everyoneElse = pupilSize_by_sub.drop(pupilSize_by_sub.columns[[sub_idx]], axis=1)
+        avgs.append(everyoneElse.mean(axis=1, skipna=True))
+
+    boot_ISC_loo = np.full(nSub, np.nan)
+
+    for iteration in range(start, nIt):
+
+        if iteration % 100 == 0:
+            print('Iteration =', iteration)
+
+        for sub_idx in range(nSub):
+
+            # Phase randomize this subject's (interpolated) data
+            thisSubj_rand = phase_randomize(subj_interp[sub_idx], random_state)
+
+            # Create a temporary df to store thisSubj_rand and avg
+            df_temp = pd.DataFrame({'thisSubj_rand': thisSubj_rand, 'avg': avgs[sub_idx]})
+
+            # Correlate this subject's phase randomized data with the average of everyone else's
+            boot_ISC_loo[sub_idx] = df_temp.corr(method='pearson').iloc[0,1]
+
+        boot_ISC_mean[iteration] = np.tanh(np.nanmean(np.arctanh(boot_ISC_loo)))
+
+        if checkpoint is not None and ((iteration + 1) % checkpoint_every == 0 or iteration + 1 == nIt):
+            save_null(checkpoint, boot_ISC_mean[:iteration + 1], fingerprint, random_state)
+
+    return boot_ISC_mean
+
+
+def loo_averages(pupilSize_by_sub):
+    """
+    Leave-one-out averages: column i is the mean of every subject except i (NaNs skipped, NaN where nobody else has data)
+
+    Parameters:
+        pupilSize_by_sub (pd.DataFrame): dataframe of pupilSize by subject
+
+    Returns:
+        avgs (np.ndarray): time x subjects array
+    """
+    data = pupilSize_by_sub.to_numpy(dtype=np.float64)
+    valid = ~np.isnan(data)
+    values = np.where(valid, data, 0)
+
+    total = values.sum(axis=1, keepdims=True) - values
+    count = valid.sum(axis=1, keepdims=True) - valid
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(count > 0, total / count, np.nan)
+
+
+def segment_corr(x, y, TR_onset, TR_offset):
+    """
+    Pearson correlation of x and y within every segment [TR_onset, TR_offset), column by column, leaving out
+    rows where either is NaN (like pd.DataFrame.corr). All segments are computed at once from cumulative sums.
+
+    Parameters:
+        x (np.ndarray): (..., time, subjects) array, e.g. a batch of surrogates
+        y (np.ndarray): time x subjects array
+        TR_onset, TR_offset (np.ndarray): segment bounds (TR indices, offset exclusive)
+
+    Returns:
+        corr (np.ndarray): (..., segments, subjects) array, NaN for segments with fewer than 2 valid rows or no variance
+    """
+    valid = ~(np.isnan(x) | np.isnan(y))
+
+    # Center each column first, so the sums of squares don't lose precision
+    x = np.where(valid, x - np.nanmean(np.where(valid, x, np.nan), axis=-2, keepdims=True), 0)
+    y = np.where(valid, y - np.nanmean(np.where(valid, y, np.nan), axis=-2, keepdims=True), 0)
+
+    def seg_sums(a):
+        c = np.cumsum(a, axis=-2)
+        c = np.concatenate((np.zeros_like(c[..., :1, :]), c), axis=-2)
+        return c[..., TR_offset, :] - c[..., TR_onset, :]
+
+    n = seg_sums(valid.astype(np.float64))
+    sx, sy = seg_sums(x), seg_sums(y)
+    sxy, sxx, syy = seg_sums(x * y), seg_sums(x * x), seg_sums(y * y)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cov = n * sxy - sx * sy
+        var = (n * sxx - sx ** 2) * (n * syy - sy ** 2)
+        corr = cov / np.sqrt(var)
+
+    return np.where((n >= 2) & (var > 0), np.clip(corr, -1, 1), np.nan)
+
+
+def event_isc_loo(pupilSize_by_sub, TR_onset, TR_offset):
+    """
+    One-to-average ISC of every subject within every event
+
+    Parameters:
+        pupilSize_by_sub (pd.DataFrame): dataframe of pupilSize by subject (one row per TR)
+        TR_onset, TR_offset (np.ndarray): event bounds (TR indices, offset exclusive)
+
+    Returns:
+        corr (np.ndarray): events x subjects array of one-to-average ISCs
+    """
+    data = pupilSize_by_sub.to_numpy(dtype=np.float64)
+
+    return segment_corr(data, loo_averages(pupilSize_by_sub), TR_onset, TR_offset)
+
+
+def fisher_mean(corr, axis=-1):
+    """
+    Fisher-z average of correlations (NaNs skipped)
+    """
+    with np.errstate(divide='ignore'):
+        return np.tanh(np.nanmean(np.arctanh(corr), axis=axis))
+
+
+def event_isc_test(pupilSize_by_sub, TR_onset, TR_offset, nIt, random_state=None, batch_size=100):
+    """
+    Event-wise ISC with significance from one shared set of phase-randomized surrogates: in every iteration each
+    subject's (NaN-interpolated) whole-story time series is phase randomized once and correlated with the average of
+    everyone else's data within every event, so all events are tested at the cost of a single bootstrap.
+
+    p-values are one-sided ((1 + null >= observed) / (nIt + 1)). The family-wise corrected p-value uses the maximum
+    over events of the null, after standardizing each event by its null mean and SD (events of different length
+    have nulls of different width); the FDR corrected p-value is Benjamini-Hochberg over the uncorrected p-values.
+
+    Parameters:
+        pupilSize_by_sub (pd.DataFrame): dataframe of pupilSize by subject (one row per TR)
+        TR_onset, TR_offset (np.ndarray): event bounds (TR indices, offset exclusive)
+        nIt (int): number of surrogate iterations
+        random_state (int, None, or np.random.RandomState): Initial random seed (default: None)
+        batch_size (int): surrogates generated at once (memory: batch_size x time x subjects)
+
+    Returns:
+        results (pd.DataFrame): per event 'TR_onset', 'TR_offset', 'isc' (Fisher-z mean over subjects),
+        'p', 'p_fwer' and 'p_fdr'
+        null (np.ndarray): nIt x events array of surrogate mean ISCs
+    """
+    random_state = check_random_state(random_state)
+    TR_onset = np.asarray(TR_onset)
+    TR_offset = np.asarray(TR_offset)
+
+    data = pupilSize_by_sub.to_numpy(dtype=np.float64)
+    avgs = loo_averages(pupilSize_by_sub)
+    nTR, nSub = data.shape
+
+    observed = fisher_mean(segment_corr(data, avgs, TR_onset, TR_offset))
+
+    # Interpolate all NaNs for phase randomization (edges padded with the first/last value), as in bootstrap_isc
+    x = np.arange(nTR)
+    interp = np.column_stack([np.interp(x, x[~np.isnan(col)], col[~np.isnan(col)]) for col in data.T])
+    fft_data = fft(interp, axis=0)
+
+    if nTR % 2 == 0:
+        pos_freq = np.arange(1, nTR // 2)
+        neg_freq = np.arange(nTR - 1, nTR // 2, -1)
+    else:
+        pos_freq = np.arange(1, (nTR - 1) // 2 + 1)
+        neg_freq = np.arange(nTR - 1, (nTR - 1) // 2, -1)
+
+    null = np.full((nIt, len(TR_onset)), np.nan)
+
+    for start in range(0, nIt, batch_size):
+        n = min(batch_size, nIt - start)
+        print('Iteration =', start)
+
+        # Phase randomize every subject, for n iterations at once
+        phase_shifts = random_state.uniform(0, 2 * np.pi, size=(n, len(pos_freq), nSub))
+        fft_rand = np.repeat(fft_data[None], n, axis=0)
+        fft_rand[:, pos_freq, :] *= np.exp(1j * phase_shifts)
+        fft_rand[:, neg_freq, :] *= np.exp(-1j * phase_shifts)
+        surrogates = np.real(ifft(fft_rand, axis=1))
+
+        null[start:start + n] = fisher_mean(segment_corr(surrogates, avgs, TR_onset, TR_offset))
+
+    p = (1 + np.sum(null >= observed, axis=0)) / (nIt + 1)
+
+    # Max statistic over the standardized events
+    null_mean = np.nanmean(null, axis=0)
+    null_sd = np.nanstd(null, axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        null_max = np.nanmax((null - null_mean) / null_sd, axis=1)
+        observed_std = (observed - null_mean) / null_sd
+    p_fwer = (1 + np.sum(null_max[:, None] >= observed_std, axis=0)) / (nIt + 1)
+
+    tested = ~np.isnan(observed)
+    p_fdr = np.full(len(observed), np.nan)
+    if tested.any():
+        p_fdr[tested] = multipletests(p[tested], method='fdr_bh')[1]
+    p[~tested] = np.nan
+    p_fwer[~tested] = np.nan
+
+    results = pd.DataFrame({'TR_onset': TR_onset, 'TR_offset': TR_offset, 'isc': observed,
+                            'p': p, 'p_fwer': p_fwer, 'p_fdr': p_fdr})
+
+    return results, null
@@ -0,0 +1,207 @@
+# Authors: Kruthi Gollapudi (kruthig@uchicago.edu), Jadyn Park (jadynpark@uchicago.edu)
+# Last Edited: October 19, 2026
+# Description: File-lock job queue on a shared directory, for sharding the per-subject stages over several machines
+# without a broker. Set PARANOIA_QUEUE=<shared dir> and start the same stage script on any number of nodes; each
+# (stage, subject) task is claimed by exactly one worker through a lease file created with O_EXCL.
+# Layout: <queue dir>/<stage>/<sub>.lease (claimed, JSON with host/pid/time) and <sub>.done (finished).
+# A worker refreshes its lease's mtime while it works; a lease that hasn't been refreshed for PARANOIA_LEASE_S
+# seconds (default 600) belongs to a dead worker and is taken over. Delete <queue dir>/<stage> to run a stage again.
+# Without PARANOIA_QUEUE the stages process their whole subject range as before.
+# PARANOIA_SUBJECTS=1030,1031 replaces a stage's subject range (e.g. to align one new session after it is recorded);
+# with PARANOIA_INDEX set, the range is the current story's sessions from the session index (see session_index.py).
+
+import json
+import os
+import socket
+import threading
+import time
+from session_index import INDEX, STORY, load_index, story_sessions
+
+QUEUE_DIR = os.environ.get('PARANOIA_QUEUE')
+LEASE_S = float(os.environ.get('PARANOIA_LEASE_S', 600))
+SUBJECTS = os.environ.get('PARANOIA_SUBJECTS')
+
+WORKER = socket.gethostname() + '-' + str(os.getpid())
+
+
+# ------------------ Define functions ------------------ #
+def _create(path, content=''):
+    """
+    Creates path only if it doesn't exist yet (atomic, also on NFS). Returns False if it already exists.
+    """
+    try:
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+
+    with os.fdopen(fd, 'w') as f:
+        f.write(content)
+
+    return True
+
+
+def _is_stale(path, lease_s):
+    try:
+        return time.time() - os.path.getmtime(path) > lease_s
+    except FileNotFoundError:
+        return False
+
+
+class Lease:
+    """
+    A claimed task. A daemon thread refreshes the lease file's mtime every lease_s / 3 seconds until the
+    task is completed or released, or the lease has been taken over by another worker.
+
+    Params:
+        path: (str) lease file
+        lease_s: (float) seconds after which an unrefreshed lease counts as stale
+    """
+
+    def __init__(self, path, lease_s):
+        self.path = path
+        self.lease_s = lease_s
+        self._stop = threading.Event()
+        self._heartbeat = threading.Thread(target=self._refresh, daemon=True)
+        self._heartbeat.start()
+
+    def _refresh(self):
+        while not self._stop.wait(self.lease_s / 3):
+            # Taken over after this worker stalled: stop, so the new owner's lease goes stale if that worker dies
+            if not self._owned():
+                return
+            try:
+                os.utime(self.path)
+            except FileNotFoundError:
+                return
+
+    def _owned(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f).get('worker') == WORKER
+        except (FileNotFoundError, ValueError):
+            return False
+
+    def complete(self):
+        """
+        Marks the task as done and drops the lease.
+        """
+        self._stop.set()
+        if not self._owned():
+            print("Warning: lease", self.path, "was taken over by another worker; its results may be overwritten")
+        _create(self.path[:-len('.lease')] + '.done', json.dumps({'worker': WORKER, 'finished': time.time()}))
+        self.release()
+
+    def release(self):
+        """
+        Drops the lease without marking the task as done (e.g. after an error), so another worker can claim it.
+        """
+        self._stop.set()
+        if self._owned():
+            os.remove(self.path)
+
+
+def claim(queue_dir, stage, sub, lease_s=LEASE_S):
+    """
+    Tries to claim the task (stage, sub).
+
+    Params:
+        queue_dir: (str) shared queue directory
+        stage: (str) stage name, e.g. '3_interpolate_blinks'
+        sub: (int or str) subject ID
+        lease_s: (float) seconds after which an unrefreshed lease counts as stale
+
+    Returns:
+        lease: (Lease) the claimed task, or None if it is done or claimed by a live worker
+    """
+    stage_dir = os.path.join(queue_dir, stage)
+    os.makedirs(stage_dir, exist_ok=True)
+    lease_path = os.path.join(stage_dir, str(sub) + '.lease')
+    content = json.dumps({'worker': WORKER, 'claimed': time.time()})
+
+    if os.path.exists(os.path.join(stage_dir, str(sub) + '.done')):
+        return None
+
+    if not _create(lease_path, content):
+        if not _is_stale(lease_path, lease_s):
+            return None
+
+        # Stale lease: only one worker at a time may remove it, and only if it is still stale once that worker
+        # holds the recovery lock (another worker may have just recovered and re-claimed the task)
+        recover_path = lease_path + '.recover'
+        if not _create(recover_path, WORKER):
+            if _is_stale(recover_path, lease_s): # the recovering worker died too
+                try:
+                    os.remove(recover_path)
+                except FileNotFoundError:
+                    pass
+            return None
+        try:
+            if not _is_stale(lease_path, lease_s):
+                return None
+            os.remove(lease_path)
+            print("Recovered stale lease", lease_path)
+        finally:
+            os.remove(recover_path)
+
+        if not _create(lease_path, content):
+            return None
+
+    return Lease(lease_path, lease_s)
+
+
+def subjects_override(subj_ids, subjects=SUBJECTS, index_path=INDEX):
+    """
+    The subjects (session keys) a stage should process: the comma-separated IDs of PARANOIA_SUBJECTS if it is set,
+    otherwise the current story's sessions if PARANOIA_INDEX is set, otherwise subj_ids.
+    """
+    if subjects is not None:
+        return [int(s) if s.strip().isdigit() else s.strip() for s in subjects.split(',') if s.strip()]
+    if index_path is not None:
+        return story_sessions(load_index(index_path), STORY)
+
+    return subj_ids
+
+
+def claimed(stage, subj_ids, queue_dir=QUEUE_DIR, lease_s=LEASE_S):
+    """
+    Iterates over the subjects this worker should process (subj_ids, or PARANOIA_SUBJECTS if it is set).
+    Without a queue directory these are all of the subjects.
+    With one, only subjects this worker claims are yielded; a subject is marked done when the loop moves on to
+    the next one (also after a `continue`), and released for other workers if the loop body raises.
+
+    Usage:
+        for sub in claimed('3_interpolate_blinks', subj_ids):
+            ...
+    """
+    subj_ids = subjects_override(subj_ids)
+
+    if queue_dir is None:
+        yield from subj_ids
+        return
+
+    for sub in subj_ids:
+        lease = claim(queue_dir, stage, sub, lease_s)
+        if lease is None:
+            continue
+
+        try:
+            yield sub
+        except BaseException: # including GeneratorExit, when the loop stops early
+            lease.release()
+            raise
+        lease.complete()
+
+
+def worker_filename(path):
+    """
+    Cohort-level outputs of a queued run only cover this worker's subjects: adds the worker to their file name
+    (e.g. pause_summary_node1-1234.csv), so workers don't overwrite each other's. Likewise, a run restricted by
+    PARANOIA_SUBJECTS adds the subjects (e.g. pause_summary_1030.csv). Unchanged for a full run.
+    """
+    root, ext = os.path.splitext(path)
+    if QUEUE_DIR is not None:
+        root += '_' + WORKER
+    if SUBJECTS is not None:
+        root += '_' + '-'.join(str(s) for s in subjects_override([], index_path=None))
+
+    return root + ext
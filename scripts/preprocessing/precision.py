@@ -0,0 +1,57 @@
+# Authors: Kruthi Gollapudi (kruthig@uchicago.edu), Jadyn Park (jadynpark@uchicago.edu)
+# Last Edited: October 19, 2026
+# Description: Floating-point precision of the pupil data path. Pupil area is an integer-valued sensor reading, so
+# the samples can be stored and processed as float32, halving memory and disk I/O. Set PARANOIA_DTYPE=float32 to
+# opt in (default float64); group statistics and correlations still accumulate in float64.
+# To check the deviation from the float64 results, run scripts/benchmarks/validate_precision.py
+
+import os
+import numpy as np
+
+DTYPE = np.dtype(os.environ.get('PARANOIA_DTYPE', 'float64'))
+
+if DTYPE not in (np.float32, np.float64):
+    raise ValueError("PARANOIA_DTYPE must be float32 or float64, not " + str(DTYPE))
+
+# dtype for sums, means and SDs over many samples or subjects
+ACCUM_DTYPE = np.float64
+
+
+# ------------------ Define functions ------------------ #
+def as_data(arr, dtype=None):
+    """
+    Converts pupil data (e.g. an array loaded with scipy.io.loadmat) to the working dtype.
+
+    Params:
+        arr: (array-like) pupil data
+        dtype: (np.dtype, optional) overrides DTYPE
+
+    Returns:
+        (np.ndarray) arr as dtype, without a copy if it already is
+    """
+    return np.asarray(arr, dtype=DTYPE if dtype is None else dtype)
+
+
+def max_deviation(result, reference):
+    """
+    Largest absolute and relative deviation of result from reference, ignoring positions that are NaN in both.
+
+    Returns:
+        max_abs, max_rel: (float) deviations; NaN in only one of the arrays counts as an infinite deviation
+    """
+    result = np.asarray(result, dtype=np.float64).ravel()
+    reference = np.asarray(reference, dtype=np.float64).ravel()
+    if result.shape != reference.shape:
+        raise ValueError(f"Shapes differ: {result.shape} vs {reference.shape}")
+
+    both_nan = np.isnan(result) & np.isnan(reference)
+    diff = np.abs(result - reference)[~both_nan]
+    diff[np.isnan(diff)] = np.inf
+    if len(diff) == 0:
+        return 0.0, 0.0
+
+    scale = np.abs(reference[~both_nan])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rel = np.where(diff == 0, 0, diff / scale)
+
+    return float(np.max(diff)), float(np.max(rel))
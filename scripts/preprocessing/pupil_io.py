@@ -0,0 +1,24 @@
+# Authors: Kruthi Gollapudi (kruthig@uchicago.edu), Jadyn Park (jadynpark@uchicago.edu)
+# Last Edited: October 19, 2026
+# Description: Loading of the EyeLink .mat files (converted from EDF) shared by stage 1 and the benchmarks
+
+import os
+import mat73 # to load .mat files in MATLAB v7.3
+
+# ------------------ Define functions ------------------ #
+def fetch_mat(mat_path, sub_id):
+    """
+    Grabs .mat file for a given subject and saves each struct as an array.
+    
+    Samples (1x1 Struct): contains time, posX, posY, pupilSize, etc.
+    Events (1x1 Struct): contains Messages (another Struct), Sblink, Eblink, etc.
+        Sblink: time of the start of the blink
+        Eblink: time of the start and end of the blink, and blink duration
+        Detailed description of the variables: http://sr-research.jp/support/EyeLink%201000%20User%20Manual%201.5.0.pdf
+    
+    """
+    mat = mat73.loadmat(os.path.join(mat_path, str(sub_id), str(sub_id) + "_ET.mat"))
+    samples = mat['Samples']
+    events = mat['Events']
+        
+    return samples, events
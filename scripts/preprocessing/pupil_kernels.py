@@ -0,0 +1,648 @@
+# Authors: Kruthi Gollapudi (kruthig@uchicago.edu), Jadyn Park (jadynpark@uchicago.edu)
+# Last Edited: October 19, 2026
+# Description: Sample-level pupil preprocessing kernels shared by stages 2-5, the online processor
+# (scripts/online_pupil.py) and the benchmarks: noise detection, blink interpolation, zero-run detection,
+# blink/pause masking, dilation-speed artifact detection, gaze-based foreshortening correction, block downsampling
+# and epoch noise
+# zero_runs, interpolate_zero_runs, calculate_noise and clean_by_TR have a compiled backend (pupil_kernels_numba.py).
+# Set PARANOIA_BACKEND=numpy|numba|auto (default auto: Numba when installed, otherwise NumPy)
+
+import os
+import warnings
+import numpy as np
+
+# ------------------ Define functions ------------------ #
+def calculate_noise(arr1, arr2, p, diff, lower, qc=None):
+    """
+    Determines if data in array is noisy based on percent of data allowed to be below lower limit and above upper limit.
+
+    Inputs:
+    - arr1 (numpy array) containing the pupil size data
+    - arr2 (numpy array) containing the pupil size difference data
+    - p (float) specifying threshold for determining if data is noisy
+    - upper (float) limit for non-noisy data
+    - lower (float) limit for non-noisy data
+    - qc (dict, optional) receives prop_noise, the proportion of noisy samples
+
+    Outputs:
+    - noisy (bool), True if noisy and False if not
+
+    """
+
+    full_length = len(arr1)
+    count = 0
+
+    for idx, item in enumerate(arr1):
+        if idx != 0:
+            if (item < lower):
+                count +=1
+            elif arr2[idx] > diff:
+                count +=1
+        else:
+            if (item < lower):
+                count +=1
+
+    # proportion of noise in subject
+    prop_noise = count/full_length
+    if qc is not None:
+        qc['prop_noise'] = prop_noise
+    
+    if prop_noise >= p:
+        noisy = True
+    else:
+        noisy = False
+    
+    return noisy
+
+
+def noise_proportions(pupilSize, differences, lower_lims, diff_threshs):
+    """
+    Proportion of noisy samples (as counted by calculate_noise) for every combination of lower limit and
+    difference threshold, in one pass over the subject's data. Each sample is binary-searched into the sorted
+    limits; a 2D histogram of those positions, cumulatively summed, gives the count of clean samples
+    (sample >= lower and difference <= threshold) at every grid point.
+
+    Params:
+        pupilSize: (np.ndarray) pupil size data
+        differences: (np.ndarray) difference to the previous sample, same length as pupilSize (the first one is ignored)
+        lower_lims: (array-like) lower limits to evaluate
+        diff_threshs: (array-like) difference thresholds to evaluate
+
+    Returns:
+        (np.ndarray) proportion of noise, shape (len(lower_lims), len(diff_threshs))
+    """
+    lower_lims = np.asarray(lower_lims, dtype=float)
+    diff_threshs = np.asarray(diff_threshs, dtype=float)
+    lower_order = np.argsort(lower_lims)
+    diff_order = np.argsort(diff_threshs)
+
+    # As in calculate_noise: comparisons with NaN are False, and the first sample is only checked against lower
+    differences = np.where(np.isnan(differences), -np.inf, np.asarray(differences, dtype=float))
+    differences[0] = -np.inf
+
+    # Sample is clean for sorted lower limits [0, i_lower) and sorted thresholds [i_diff, end)
+    i_lower = np.searchsorted(lower_lims[lower_order], pupilSize, side='right')
+    i_diff = np.searchsorted(diff_threshs[diff_order], differences, side='left')
+
+    n_lower, n_diff = len(lower_lims), len(diff_threshs)
+    hist = np.bincount(i_lower * (n_diff + 1) + i_diff, minlength=(n_lower + 1) * (n_diff + 1))
+    hist = hist.reshape(n_lower + 1, n_diff + 1)
+
+    # clean[j, k] = samples with i_lower > j and i_diff <= k
+    clean = np.cumsum(np.cumsum(hist[::-1], axis=0)[::-1], axis=1)[1:, :-1]
+
+    prop_noise = np.empty((n_lower, n_diff))
+    prop_noise[np.ix_(lower_order, diff_order)] = 1 - clean / len(pupilSize)
+
+    return prop_noise
+
+
+def interpolate_blinks(sblink_minus1, eblink_plus1, pupilSize):
+    """
+    This function performs linear interpolation to estimate pupil size during blinks
+    
+    Params:
+        sblink_minus1: index of the sample right before blink
+        eblink_plus1: index of the sample right after blink
+        pupilSize: pupil size during the entire time course, where blinks are zeros
+        
+    Returns:
+        np.ndarray: modified pupil size with interpolated values for blinks
+    
+    """
+    
+    # Two points must be present for interpolations; if the data begins or ends with a blink, you cannot interpolate
+    if ((eblink_plus1 < len(pupilSize)) and (sblink_minus1 >= 0)):
+        
+        # Interpolate over these samples
+        blink_data = pupilSize[sblink_minus1:eblink_plus1]
+
+        # Pupil size right before and after blink
+        toInterp = [blink_data[0], blink_data[-1]]
+
+        # Timepoint to interpolate over
+        toInterp_TP = [0, len(blink_data)-1] # x-coordinate of query points
+        
+        # Perform interpolation
+        afterInterpolate = np.interp(range(len(blink_data)), toInterp_TP, toInterp)
+        afterInterpolate = afterInterpolate[1:-1]
+        
+        # Put the interpolated data back in
+        pupilSize[sblink_minus1 + 1:eblink_plus1-1] = afterInterpolate
+        
+    return pupilSize
+
+
+def zero_runs(arr):
+    """
+    Takes in array and outputs new array where each row contains the first and 
+    last index of the consecutive zeros present in the original array.
+    
+    Params:
+        arr: (np.ndarray) containing values with consecutive zeros
+        
+    Returns:
+        ranges: (np.ndarray) containing indices of consecutive zeros
+    
+    """
+
+    # Create an array that is 1 where a is 0, and pad each end with an extra 0.
+    iszero = np.concatenate(([0], np.equal(arr, 0).view(np.int8), [0]))
+    absdiff = np.abs(np.diff(iszero))
+
+    # Runs start and end where absdiff is 1.
+    result = np.where(absdiff == 1)[0].reshape(-1, 2)
+    return result
+
+
+def merge_intervals(starts, ends):
+    """
+    Merges overlapping or touching [start, end) intervals, e.g. padded blinks that run into each other.
+
+    Params:
+        starts: (array-like) interval starts (sample indices)
+        ends: (array-like) interval ends (exclusive)
+
+    Returns:
+        merged: (np.ndarray) [start, end) of each merged interval, sorted by start
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    if len(starts) == 0:
+        return np.zeros((0, 2), dtype=np.int64)
+
+    order = np.argsort(starts, kind='stable')
+    starts, ends = starts[order], ends[order]
+
+    # A new interval begins wherever the start lies beyond every earlier end
+    reach = np.maximum.accumulate(ends)
+    new_group = np.concatenate(([True], starts[1:] > reach[:-1]))
+    group = np.cumsum(new_group) - 1
+
+    merged = np.empty((group[-1] + 1, 2), dtype=np.int64)
+    merged[:, 0] = starts[new_group]
+    merged[:, 1] = np.maximum.reduceat(ends, np.flatnonzero(new_group))
+
+    return merged
+
+
+def interval_mask(n, starts, ends, pre=0, post=0):
+    """
+    Sample mask of [start, end) intervals, e.g. EyeLink blinks (padded by pre samples before and post samples
+    after, Murphy et al. 2014) or story pauses, built in one vectorized pass: +1/-1 at every interval edge,
+    then a cumulative sum. Overlapping intervals merge by construction.
+
+    Params:
+        n: (int) number of samples
+        starts: (array-like) first sample of each interval
+        ends: (array-like) sample after the last one of each interval (exclusive)
+        pre, post: (int) padding in samples
+
+    Returns:
+        mask: (np.ndarray of bool) True for samples within a (padded) interval
+    """
+    starts = np.clip(np.asarray(starts, dtype=np.int64) - pre, 0, n)
+    ends = np.clip(np.asarray(ends, dtype=np.int64) + post, 0, n)
+
+    edges = np.bincount(starts, minlength=n + 1) - np.bincount(ends, minlength=n + 1)
+
+    return np.cumsum(edges[:n]) > 0
+
+
+def speed_artifact_mask(pupilSize, f_sample, n_mad=16, gap_pad=0):
+    """
+    Marks artifacts that aren't exact zeros (partial blinks, half-occluded pupils, spurious jumps) by their
+    dilation speed, following Kret & Sjak-Shie (2019): a sample's speed is the larger of its absolute change
+    from the previous and to the next valid (non-zero) sample, divided by the time between them, and samples
+    faster than median + n_mad * MAD are artifacts. The MAD is floored at the smallest non-zero speed: with
+    integer pupil data most steps are 0, which would otherwise make the MAD 0 and every change an artifact.
+    Every gap (zeros or artifacts) is then widened by gap_pad samples on both sides, since the samples at
+    the edge of a gap are often distorted as well. Vectorized over the whole array.
+
+    Params:
+        pupilSize: (np.ndarray) pupil size; zeros are missing samples
+        f_sample: (int) sampling rate (Hz)
+        n_mad: (float) threshold in median absolute deviations of the speed above its median
+        gap_pad: (int) samples to mark on each side of every gap
+
+    Returns:
+        mask: (np.ndarray of bool) True for artifacts and gap edges (not for the zeros themselves)
+    """
+    missing = pupilSize == 0
+    valid = np.flatnonzero(~missing)
+    if len(valid) == 0:
+        return np.zeros(len(pupilSize), dtype=bool)
+    speed = np.full(len(pupilSize), np.nan)
+
+    # Speed (units per second) to the previous and to the next valid sample, across any gap in between
+    step = np.abs(np.diff(pupilSize[valid].astype(np.float64))) * f_sample / np.diff(valid)
+    speed[valid] = np.fmax(np.concatenate(([np.nan], step)), np.concatenate((step, [np.nan])))
+
+    valid_speed = speed[valid]
+    valid_speed = valid_speed[~np.isnan(valid_speed)]
+    moving = valid_speed[valid_speed > 0]
+    if len(moving) == 0:
+        # Constant (or a single valid sample): no speed artifacts, only the gap edges
+        threshold = np.inf
+    else:
+        median = np.median(valid_speed)
+        mad = max(np.median(np.abs(valid_speed - median)), moving.min())
+        threshold = median + n_mad * mad
+
+    with np.errstate(invalid='ignore'):
+        invalid = missing | (speed > threshold)
+
+    # Runs of invalid samples, widened by gap_pad
+    edges = np.diff(np.concatenate(([0], invalid.astype(np.int8), [0])))
+    mask = interval_mask(len(pupilSize), np.flatnonzero(edges == 1), np.flatnonzero(edges == -1),
+                         pre=gap_pad, post=gap_pad)
+
+    return mask & ~missing
+
+
+def valid_gaze(posX, posY, max_abs=1e7):
+    """
+    True for samples with a gaze position (EyeLink writes missing gaze as a huge value, converters as NaN).
+    """
+    with np.errstate(invalid='ignore'):
+        return np.isfinite(posX) & np.isfinite(posY) & (np.abs(posX) < max_abs) & (np.abs(posY) < max_abs)
+
+
+def foreshortening_correction(pupilSize, posX, posY, degree=2):
+    """
+    Corrects the pupil foreshortening error (the pupil looks smaller when the eye rotates away from the camera)
+    by regressing pupil size on a polynomial of the gaze position (Gagl et al., 2011; Hayes & Petrov, 2016)
+    and removing the gaze-dependent part. The fit uses samples with both pupil and gaze; the mean pupil size
+    is kept, and samples without pupil or gaze are returned unchanged.
+
+    Params:
+        pupilSize: (np.ndarray) pupil size; zeros are missing samples
+        posX, posY: (np.ndarray) gaze position (pixels)
+        degree: (int) degree of the polynomial in posX and posY (2: x, y, x^2, xy, y^2)
+
+    Returns:
+        corrected: (np.ndarray) corrected pupil size, same dtype as pupilSize
+        coefs: (np.ndarray) regression coefficients (intercept first), on gaze relative to its mean
+    """
+    valid = (pupilSize != 0) & valid_gaze(posX, posY)
+    corrected = pupilSize.copy()
+    if valid.sum() < 10:
+        return corrected, np.full(1, np.nan)
+
+    # Design matrix of the gaze polynomial, centered so the intercept is the pupil size at the mean gaze
+    x = posX[valid].astype(np.float64) - np.mean(posX[valid], dtype=np.float64)
+    y = posY[valid].astype(np.float64) - np.mean(posY[valid], dtype=np.float64)
+    terms = [x ** (d - k) * y ** k for d in range(1, degree + 1) for k in range(d + 1)]
+    design = np.column_stack([np.ones(len(x))] + terms)
+
+    coefs = np.linalg.lstsq(design, pupilSize[valid].astype(np.float64), rcond=None)[0]
+    gaze_effect = design[:, 1:] @ coefs[1:]
+    corrected[valid] = pupilSize[valid] - (gaze_effect - gaze_effect.mean())
+
+    return corrected, coefs
+
+
+def fixation_deviation_mask(posX, posY, max_dev, center=None):
+    """
+    Marks samples where gaze is more than max_dev pixels from the fixation point (e.g. looking away from the
+    fixation cross), where the pupil size is least reliable. Samples without gaze aren't marked.
+
+    Params:
+        posX, posY: (np.ndarray) gaze position (pixels)
+        max_dev: (float) largest allowed distance from the fixation point (pixels)
+        center: (tuple, optional) fixation point (x, y); defaults to the median gaze position
+
+    Returns:
+        mask: (np.ndarray of bool) True for samples off fixation
+    """
+    valid = valid_gaze(posX, posY)
+    if not valid.any():
+        return np.zeros(len(posX), dtype=bool)
+    if center is None:
+        center = (np.median(posX[valid]), np.median(posY[valid]))
+
+    with np.errstate(invalid='ignore'):
+        return valid & (np.hypot(posX - center[0], posY - center[1]) > max_dev)
+
+
+def average_downsample(arr, downsample_factor):
+    '''
+    Perform downsampling of array by averaging across every n (downsampling_factor) elements
+
+    Inputs:
+        - arr: (np.ndarray) of samples to downsample
+        - downsample_factor: (float) for every element to average across
+
+    Outputs:
+        - averaged_array: (np.ndarray) of downsampled samples
+    '''
+    downsample_factor = int(downsample_factor)
+
+    # Calculate the number of elements to pad
+    pad_size = int((downsample_factor - len(arr) % downsample_factor) % downsample_factor)
+
+    # Pad the array with NaNs
+    padded_array = np.pad(arr, (0, pad_size), mode='constant', constant_values=np.nan)
+
+    # Reshape the array to group by every factor
+    reshaped_array = padded_array.reshape(-1, downsample_factor)
+
+    # Compute the mean, ignoring NaNs
+    averaged_array = np.nanmean(reshaped_array, axis=1)
+
+    return averaged_array
+
+
+def compute_epoch_noise(arr, mean, interval, prop):
+    '''
+    Determines if segment of data is considered noisy, which is when 40% or more of the samples
+    are +/- 1 SD from the epoch mean.
+
+    Inputs:
+        - arr: (np.ndarray) containing samples from duration of 1 sec
+        - mean: (float) mean of epoch set
+        - interval: (float/int) how many SDs away from mean we want to measure
+        - prop: (float) percent of data that is the noise limit 
+
+    Outputs:
+        - float/int/np.nan, the mean if not noisy, otherwise NaN
+    '''
+
+    sd = np.std(arr)
+
+    upper_lim = mean + sd * interval
+    lower_lim = mean - sd * interval
+
+    count = 0
+
+    for m in arr:
+        if (m > upper_lim) or m < lower_lim:
+            count +=1
+
+    if count / len(arr) > prop:
+        #print("this set is noisy")
+        result = 0
+    else:
+        result = mean
+    
+    return result
+
+
+def gap_counts(ranges, n, max_gap):
+    """
+    Counts the runs of zeros interpolate_zero_runs fills and leaves (longer than max_gap, or at the start or end of
+    the data, where there is nothing to interpolate from).
+
+    Params:
+        ranges: (np.ndarray) [start, end) of every run of zeros (zero_runs)
+        n: (int) length of the data
+        max_gap: (int) longest run (in samples) that is interpolated
+
+    Returns:
+        counts: (dict) gaps_filled, filled_samples, gaps_skipped, skipped_samples and longest_gap (samples)
+    """
+    lengths = ranges[:, 1] - ranges[:, 0]
+    filled = (lengths <= max_gap) & (ranges[:, 0] >= 1) & (ranges[:, 1] + 1 < n)
+
+    return {'gaps_filled': int(filled.sum()), 'filled_samples': int(lengths[filled].sum()),
+            'gaps_skipped': int((~filled).sum()), 'skipped_samples': int(lengths[~filled].sum()),
+            'longest_gap': int(lengths.max()) if len(lengths) else 0}
+
+
+def interpolate_zero_runs(pupilSize, max_gap, qc=None):
+    """
+    Linearly interpolates over every run of zeros (blinks/data loss) of at most max_gap samples,
+    as in stage 3. Longer runs are left as zeros.
+
+    Params:
+        pupilSize: (np.ndarray) pupil size during the entire time course, where blinks are zeros; modified in place
+        max_gap: (int) longest run (in samples) to interpolate over
+        qc: (dict, optional) receives the gap counts (see gap_counts)
+
+    Returns:
+        pupilSize: (np.ndarray) pupil size with interpolated blinks
+    """
+    # get array containing index values of ranges to interpolate over
+    ranges = zero_runs(pupilSize)
+
+    for val in ranges:
+
+        # get first consec. zeros
+        start, end = (val[0], val[-1])
+
+        if (end - start) <= max_gap:  # make sure that the range is less than or eq. to max_gap
+
+            i1, i2 = (start-1, end+1)
+            pupilSize = interpolate_blinks(i1, i2, pupilSize)
+
+    if qc is not None:
+        qc.update(gap_counts(ranges, len(pupilSize), max_gap))
+
+    return pupilSize
+
+
+def clean_by_TR(pupilSize, f_sample, interval, prop, qc=None):
+    """
+    Averages downsampled pupil data into 1 sec epochs (TRs), as in stage 5. Noisy epochs (see compute_epoch_noise)
+    are set to zero and then interpolated across the neighbouring epochs.
+
+    Params:
+        pupilSize: (np.ndarray) downsampled pupil size
+        f_sample: (int) sampling rate of pupilSize, i.e. samples per epoch
+        interval: (float/int) how many SDs away from the epoch mean a sample counts as noise
+        prop: (float) proportion of noise samples above which an epoch is noisy
+        qc: (dict, optional) receives TRs, TRs_rejected (noisy or without data, set to zero) and TRs_unfilled
+            (rejected TRs at the start or end of the story, left at zero)
+
+    Returns:
+        data_by_TR: (np.ndarray) pupil size per TR
+    """
+    n = len(pupilSize)
+    epoch_set = np.array([], dtype=pupilSize.dtype)
+    data_by_TR = np.array([], dtype=pupilSize.dtype)
+
+    for idx, val in enumerate(pupilSize):
+        epoch_set = np.append(epoch_set, val)
+
+        if (idx + 1) % f_sample == 0 or idx == n-1:
+
+            epoch_mean = np.average(epoch_set)
+            output = compute_epoch_noise(epoch_set, epoch_mean, interval, prop)
+
+            data_by_TR = np.append(data_by_TR, np.asarray(output, dtype=data_by_TR.dtype)) # noisy epochs are int 0
+            epoch_set = np.array([], dtype=pupilSize.dtype)
+
+    # start interpolation
+    # get array containing index values of ranges to interpolate over
+    ranges = zero_runs(data_by_TR)
+
+    for val in ranges:
+
+        # get first consec. zeros
+        start, end = (val[0], val[-1])
+        i1, i2 = (start-1, end+1)
+        data_by_TR = interpolate_blinks(i1, i2, data_by_TR)
+
+    if qc is not None:
+        counts = gap_counts(ranges, len(data_by_TR), len(data_by_TR))
+        qc.update({'TRs': len(data_by_TR), 'TRs_rejected': counts['filled_samples'] + counts['skipped_samples'],
+                   'TRs_unfilled': counts['skipped_samples']})
+
+    return data_by_TR
+
+
+def epoch_outlier_fractions(pupilSize, f_sample, intervals):
+    """
+    Vectorized first half of clean_by_TR for several SD intervals at once: the mean of every 1 sec epoch and
+    the fraction of its samples outside mean +/- interval * SD (as counted by compute_epoch_noise).
+
+    Params:
+        pupilSize: (np.ndarray) downsampled pupil size
+        f_sample: (int) sampling rate of pupilSize, i.e. samples per epoch (the last epoch may be shorter)
+        intervals: (array-like) SD intervals to evaluate
+
+    Returns:
+        epoch_means: (np.ndarray) mean of each epoch
+        fractions: (np.ndarray) outlier fraction of each epoch, shape (len(intervals), number of epochs)
+    """
+    n = len(pupilSize)
+    n_epochs = int(np.ceil(n / f_sample))
+
+    # Epochs as rows; the padding of the last epoch is masked out
+    epochs = np.zeros(n_epochs * f_sample, dtype=pupilSize.dtype)
+    epochs[:n] = pupilSize
+    epochs = epochs.reshape(n_epochs, f_sample)
+    valid = (np.arange(n_epochs * f_sample) < n).reshape(n_epochs, f_sample)
+    lengths = valid.sum(axis=1).astype(epochs.dtype)
+
+    epoch_means = epochs.sum(axis=1) / lengths
+    epoch_sds = np.sqrt(np.where(valid, (epochs - epoch_means[:, None]) ** 2, 0).sum(axis=1) / lengths)
+
+    # Limits per interval and epoch, computed as in compute_epoch_noise
+    intervals = np.asarray(intervals, dtype=float)
+    upper_lim = (epoch_means[None, :] + epoch_sds[None, :] * intervals[:, None])[:, :, None]
+    lower_lim = (epoch_means[None, :] - epoch_sds[None, :] * intervals[:, None])[:, :, None]
+    outliers = ((epochs[None] > upper_lim) | (epochs[None] < lower_lim)) & valid[None]
+
+    return epoch_means, outliers.sum(axis=2) / lengths
+
+
+def clean_by_TR_sweep(pupilSize, f_sample, intervals, props):
+    """
+    clean_by_TR for every combination of interval and prop, without rerunning it per combination: the
+    outlier fractions are computed once per interval and every prop is applied to them by broadcasting.
+
+    Params:
+        pupilSize: (np.ndarray) downsampled pupil size
+        f_sample: (int) sampling rate of pupilSize, i.e. samples per epoch
+        intervals: (array-like) SD intervals to evaluate
+        props: (array-like) noise proportions to evaluate
+
+    Returns:
+        data_by_TR: (np.ndarray) pupil size per TR, shape (len(intervals), len(props), number of TRs)
+        n_noisy: (np.ndarray) number of noisy TRs, shape (len(intervals), len(props))
+        n_unfilled: (np.ndarray) noisy TRs left at zero because they couldn't be interpolated (start or end of the story)
+    """
+    epoch_means, fractions = epoch_outlier_fractions(pupilSize, f_sample, intervals)
+
+    # Noisy epochs are set to zero, as in compute_epoch_noise
+    noisy = fractions[:, None, :] > np.asarray(props, dtype=float)[None, :, None]
+    data_by_TR = np.where(noisy, 0, epoch_means[None, None, :])
+
+    for i, j in np.ndindex(noisy.shape[:2]):
+        for start, end in zero_runs(data_by_TR[i, j]):
+            data_by_TR[i, j] = interpolate_blinks(start-1, end+1, data_by_TR[i, j])
+
+    n_noisy = noisy.sum(axis=2)
+    n_unfilled = (data_by_TR == 0).sum(axis=2)
+
+    return data_by_TR, n_noisy, n_unfilled
+
+
+def causal_fill(arr, last_valid, gap_len, max_gap):
+    """
+    Causal counterpart of interpolate_blinks for streaming data. Zeros (blinks/data loss) are filled with
+    the last valid sample instead of being interpolated, since the sample after the gap hasn't arrived yet.
+    Gaps longer than max_gap samples are set to NaN from that point on.
+
+    Params:
+        arr: (np.ndarray) newest chunk of raw pupil samples, where blinks are zeros
+        last_valid: (float) last non-zero sample before this chunk (NaN if none yet)
+        gap_len: (int) length of the gap still open at the end of the previous chunk
+        max_gap: (int) longest gap (in samples) that is filled
+
+    Returns:
+        filled: (np.ndarray) chunk with gaps filled
+        last_valid: (float) last non-zero sample, to pass with the next chunk
+        gap_len: (int) length of the gap open at the end of this chunk, to pass with the next chunk
+    """
+    filled = np.array(arr, dtype=float)
+
+    for start, end in zero_runs(filled):
+
+        # A gap at the start of the chunk continues the gap from the previous chunk
+        run_gap = gap_len if start == 0 else 0
+        hold = last_valid if start == 0 else filled[start-1]
+
+        position = run_gap + np.arange(1, end - start + 1)
+        filled[start:end] = np.where(position <= max_gap, hold, np.nan)
+
+        if end == len(filled):
+            gap_len = int(run_gap + (end - start))
+
+    valid = np.flatnonzero(np.asarray(arr) != 0)
+    if len(valid) > 0:
+        last_valid = float(arr[valid[-1]])
+        if valid[-1] == len(arr) - 1:
+            gap_len = 0
+
+    return filled, last_valid, gap_len
+
+
+# ------------------ Backend selection ------------------ #
+NUMPY_KERNELS = {'zero_runs': zero_runs, 'interpolate_zero_runs': interpolate_zero_runs,
+                 'calculate_noise': calculate_noise, 'clean_by_TR': clean_by_TR}
+
+
+def get_kernels(backend):
+    """
+    Returns the kernels of a backend ('numpy' or 'numba') by name, e.g. to compare the two.
+    """
+    if backend == 'numpy':
+        return dict(NUMPY_KERNELS)
+    if backend == 'numba':
+        import pupil_kernels_numba
+        if not pupil_kernels_numba.AVAILABLE:
+            raise ImportError("The numba backend needs numba (pip install numba)")
+        return {name: getattr(pupil_kernels_numba, name) for name in NUMPY_KERNELS}
+
+    raise ValueError("Unknown kernel backend: " + str(backend))
+
+
+def use_backend(backend):
+    """
+    Switches the module-level kernels to a backend ('numpy', 'numba' or 'auto'). If numba isn't installed,
+    the NumPy kernels are used. Only affects kernels imported after the switch.
+
+    Returns:
+        (str) the backend in use
+    """
+    global BACKEND
+
+    if backend == 'auto':
+        import pupil_kernels_numba
+        backend = 'numba' if pupil_kernels_numba.AVAILABLE else 'numpy'
+
+    try:
+        kernels = get_kernels(backend)
+    except ImportError as e:
+        warnings.warn(str(e) + "; using the numpy backend")
+        backend, kernels = 'numpy', get_kernels('numpy')
+
+    globals().update(kernels)
+    BACKEND = backend
+
+    return BACKEND
+
+
+BACKEND = use_backend(os.environ.get('PARANOIA_BACKEND', 'auto'))
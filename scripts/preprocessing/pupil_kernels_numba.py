@@ -0,0 +1,252 @@
+# Authors: Kruthi Gollapudi (kruthig@uchicago.edu), Jadyn Park (jadynpark@uchicago.edu)
+# Last Edited: October 19, 2026
+# Description: Numba-compiled versions of the sample-level kernels in pupil_kernels.py (zero_runs, the gap fill of
+# interpolate_zero_runs, calculate_noise and the epoch loop of clean_by_TR). They give results identical to the NumPy
+# versions, down to the summation order of np.mean/np.std, so either backend can be used for any stage.
+# Numba is optional: AVAILABLE is False when it isn't installed, and pupil_kernels then keeps the NumPy kernels.
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+AVAILABLE = numba is not None
+
+
+# ------------------ Define functions ------------------ #
+def _block_sum(a, lo, n):
+    # Leaf of NumPy's pairwise summation (n <= 128): eight interleaved partial sums, then the remainder
+    if n < 8:
+        res = a[lo] # = 0 + a[lo], without numba promoting float32 to float64
+        for i in range(lo + 1, lo + n):
+            res += a[i]
+        return res
+
+    r0, r1, r2, r3 = a[lo], a[lo + 1], a[lo + 2], a[lo + 3]
+    r4, r5, r6, r7 = a[lo + 4], a[lo + 5], a[lo + 6], a[lo + 7]
+    i = 8
+    while i < n - (n % 8):
+        r0 += a[lo + i]
+        r1 += a[lo + i + 1]
+        r2 += a[lo + i + 2]
+        r3 += a[lo + i + 3]
+        r4 += a[lo + i + 4]
+        r5 += a[lo + i + 5]
+        r6 += a[lo + i + 6]
+        r7 += a[lo + i + 7]
+        i += 8
+    res = ((r0 + r1) + (r2 + r3)) + ((r4 + r5) + (r6 + r7))
+    while i < n:
+        res += a[lo + i]
+        i += 1
+
+    return res
+
+
+def _pairwise_sum(a, lo, n):
+    """
+    Sum of a[lo:lo + n] in the same order as NumPy's pairwise summation (used by np.sum/np.mean), so that
+    float results match bit for bit. NumPy recurses on halves (multiples of 8) down to blocks of <= 128;
+    the recursion is unrolled into explicit stacks here, since numba can't cache recursive functions.
+    """
+    if n <= 128:
+        return _block_sum(a, lo, n)
+
+    task_lo = np.empty(128, dtype=np.int64)
+    task_n = np.empty(128, dtype=np.int64) # n < 0 marks "add the two sums on top of the value stack"
+    values = np.empty(128, dtype=a.dtype)
+    task_lo[0], task_n[0] = lo, n
+    n_tasks, n_values = 1, 0
+
+    while n_tasks > 0:
+        n_tasks -= 1
+        t_lo, t_n = task_lo[n_tasks], task_n[n_tasks]
+
+        if t_n < 0:
+            values[n_values - 2] = values[n_values - 2] + values[n_values - 1]
+            n_values -= 1
+        elif t_n <= 128:
+            values[n_values] = _block_sum(a, t_lo, t_n)
+            n_values += 1
+        else:
+            n2 = t_n // 2
+            n2 -= n2 % 8
+            task_lo[n_tasks], task_n[n_tasks] = 0, -1
+            task_lo[n_tasks + 1], task_n[n_tasks + 1] = t_lo + n2, t_n - n2
+            task_lo[n_tasks + 2], task_n[n_tasks + 2] = t_lo, n2
+            n_tasks += 3
+
+    return values[0]
+
+
+def _zero_runs(arr):
+    n = len(arr)
+    ranges = np.empty((n // 2 + 1, 2), dtype=np.int64)
+    n_runs = 0
+
+    i = 0
+    while i < n:
+        if arr[i] == 0:
+            start = i
+            while i < n and arr[i] == 0:
+                i += 1
+            ranges[n_runs, 0] = start
+            ranges[n_runs, 1] = i
+            n_runs += 1
+        else:
+            i += 1
+
+    return ranges[:n_runs].copy()
+
+
+def _fill_zero_runs(pupilSize, max_gap, counts):
+    # Same arithmetic as np.interp in interpolate_blinks, including its NaN fallback
+    # counts: gaps filled, samples filled, gaps skipped, samples skipped, longest gap (see gap_counts)
+    n = len(pupilSize)
+
+    i = 0
+    while i < n:
+        if pupilSize[i] != 0:
+            i += 1
+            continue
+
+        start = i
+        while i < n and pupilSize[i] == 0:
+            i += 1
+        end = i
+        counts[4] = max(counts[4], end - start)
+
+        if (end - start) <= max_gap and start - 1 >= 0 and end + 1 < n:
+            counts[0] += 1
+            counts[1] += end - start
+            left = np.float64(pupilSize[start - 1])
+            right = np.float64(pupilSize[end])
+            length = np.float64(end - start + 1)
+            slope = (right - left) / length
+            for k in range(1, end - start + 1):
+                value = slope * k + left
+                if np.isnan(value):
+                    value = slope * (k - length) + right
+                    if np.isnan(value) and left == right:
+                        value = left
+                pupilSize[start - 1 + k] = value
+        else:
+            counts[2] += 1
+            counts[3] += end - start
+
+    return pupilSize
+
+
+def _count_noise(arr1, arr2, diff, lower):
+    count = 0
+    for idx in range(len(arr1)):
+        if arr1[idx] < lower:
+            count += 1
+        elif idx != 0 and arr2[idx] > diff:
+            count += 1
+
+    return count
+
+
+def _epoch_means(pupilSize, f_sample, interval, prop):
+    # Epoch loop of clean_by_TR; means and SDs are rounded to the data's dtype at the same points as np.average/np.std
+    n = len(pupilSize)
+    n_epochs = (n + f_sample - 1) // f_sample
+    data_by_TR = np.zeros(n_epochs, dtype=pupilSize.dtype)
+    scratch = np.empty(f_sample, dtype=pupilSize.dtype)
+    rounded = np.empty(1, dtype=pupilSize.dtype)
+
+    for epoch in range(n_epochs):
+        lo = epoch * f_sample
+        length = min(f_sample, n - lo)
+
+        rounded[0] = _pairwise_sum(pupilSize, lo, length) / length
+        mean = rounded[0]
+
+        for i in range(length):
+            scratch[i] = pupilSize[lo + i] - mean
+            scratch[i] = scratch[i] * scratch[i]
+        rounded[0] = _pairwise_sum(scratch, 0, length) / length
+        rounded[0] = np.sqrt(rounded[0])
+        sd = rounded[0]
+
+        upper_lim = mean + sd * interval
+        lower_lim = mean - sd * interval
+
+        count = 0
+        for i in range(length):
+            m = pupilSize[lo + i]
+            if (m > upper_lim) or m < lower_lim:
+                count += 1
+
+        if not count / length > prop:
+            data_by_TR[epoch] = mean
+
+    return data_by_TR
+
+
+if AVAILABLE:
+    _block_sum = numba.njit(cache=True)(_block_sum)
+    _pairwise_sum = numba.njit(cache=True)(_pairwise_sum)
+    _zero_runs = numba.njit(cache=True)(_zero_runs)
+    _fill_zero_runs = numba.njit(cache=True)(_fill_zero_runs)
+    _count_noise = numba.njit(cache=True)(_count_noise)
+    _epoch_means = numba.njit(cache=True)(_epoch_means)
+
+
+def _weak_scalar(value, dtype):
+    """
+    Python scalars don't change the dtype of NumPy arithmetic (NEP 50); cast them so the compiled code does the same.
+    """
+    return dtype.type(value) if type(value) in (int, float) else value
+
+
+def zero_runs(arr):
+    """
+    Compiled zero_runs: [start, end) index of every run of consecutive zeros.
+    """
+    return _zero_runs(np.asarray(arr))
+
+
+def _counts_dict(counts):
+    return {'gaps_filled': int(counts[0]), 'filled_samples': int(counts[1]), 'gaps_skipped': int(counts[2]),
+            'skipped_samples': int(counts[3]), 'longest_gap': int(counts[4])}
+
+
+def interpolate_zero_runs(pupilSize, max_gap, qc=None):
+    """
+    Compiled interpolate_zero_runs: linear interpolation over runs of at most max_gap zeros, in place.
+    """
+    counts = np.zeros(5, dtype=np.int64)
+    pupilSize = _fill_zero_runs(pupilSize, max_gap, counts)
+    if qc is not None:
+        qc.update(_counts_dict(counts))
+
+    return pupilSize
+
+
+def calculate_noise(arr1, arr2, p, diff, lower, qc=None):
+    """
+    Compiled calculate_noise: True if the proportion of noisy samples is at least p.
+    """
+    count = _count_noise(arr1, arr2, _weak_scalar(diff, arr2.dtype), _weak_scalar(lower, arr1.dtype))
+    if qc is not None:
+        qc['prop_noise'] = count / len(arr1)
+
+    return count / len(arr1) >= p
+
+
+def clean_by_TR(pupilSize, f_sample, interval, prop, qc=None):
+    """
+    Compiled clean_by_TR: per-TR averages, with noisy epochs interpolated across the neighbouring epochs.
+    """
+    data_by_TR = _epoch_means(pupilSize, int(f_sample), _weak_scalar(interval, pupilSize.dtype), float(prop))
+
+    counts = np.zeros(5, dtype=np.int64)
+    data_by_TR = _fill_zero_runs(data_by_TR, len(data_by_TR), counts)
+    if qc is not None:
+        qc.update({'TRs': len(data_by_TR), 'TRs_rejected': int(counts[1] + counts[3]), 'TRs_unfilled': int(counts[3])})
+
+    return data_by_TR
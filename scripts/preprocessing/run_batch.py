@@ -0,0 +1,84 @@
+# Authors: Kruthi Gollapudi (kruthig@uchicago.edu), Jadyn Park (jadynpark@uchicago.edu)
+# Last Edited: October 19, 2026
+# Description: Runs the preprocessing stages for every story of a session index (see session_index.py) in one batch.
+# The stages run story by story, each with PARANOIA_STORY and PARANOIA_INDEX set, so every story's sessions are
+# processed into its own directories and the cohort stages (ISC, event averages, cluster tests) are computed per story
+# against that story's event file. With --queue, the per-subject stages keep done markers in <queue>/<story>
+# (see job_queue.py): sessions already processed by an earlier batch are skipped, so adding sessions to the index
+# and rerunning only processes the new ones. --force clears a story's markers and processes everything again.
+# Usage: python run_batch.py <index csv> [--stages 1_align_pupil 3_interpolate_blinks ...] [--queue DIR] [--force]
+
+import argparse
+import glob
+import os
+import shutil
+import subprocess
+import sys
+from session_index import load_index
+
+_thisDir = os.path.dirname(os.path.abspath(__file__))
+
+# Stage scripts in pipeline order (1, 2, ..., 5, 5b, 6, ...)
+STAGES = sorted([os.path.splitext(os.path.basename(f))[0] for f in glob.glob(os.path.join(_thisDir, '[0-9]*_*.py'))],
+                key=lambda name: (int(name.split('_')[0].rstrip('abcdefghijklmnopqrstuvwxyz')), name))
+
+
+# ------------------ Define functions ------------------ #
+def run_story(story, index_path, stages, queue_dir=None, force=False):
+    """
+    Runs the stages for one story of the index, in order. Stops at the first stage that fails.
+
+    Params:
+        story: (str) story name in the index
+        index_path: (str) session index csv
+        stages: (list of str) stage script names (without .py)
+        queue_dir: (str) queue directory for done markers, or None to process all sessions
+        force: (bool) clear the story's done markers first
+
+    Returns:
+        failed: (str) the stage that failed, or None
+    """
+    env = dict(os.environ, PARANOIA_STORY=story, PARANOIA_INDEX=os.path.abspath(index_path))
+    env.pop('PARANOIA_SUBJECTS', None) # the index decides the sessions
+
+    if queue_dir is not None:
+        story_queue = os.path.join(os.path.abspath(queue_dir), story)
+        if force and os.path.exists(story_queue):
+            shutil.rmtree(story_queue)
+        env['PARANOIA_QUEUE'] = story_queue
+    else:
+        env.pop('PARANOIA_QUEUE', None)
+
+    for stage in stages:
+        print('---', story, ':', stage, flush=True)
+        result = subprocess.run([sys.executable, stage + '.py'], cwd=_thisDir, env=env)
+        if result.returncode != 0:
+            return stage
+
+    return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the preprocessing stages for every story of a session index')
+    parser.add_argument('index', help='session index csv')
+    parser.add_argument('--stages', nargs='+', default=STAGES, help='stages to run, in order')
+    parser.add_argument('--queue', help='queue directory; sessions finished in an earlier run are skipped')
+    parser.add_argument('--force', action='store_true', help='clear the done markers and process all sessions')
+    args = parser.parse_args()
+
+    unknown = [s for s in args.stages if s not in STAGES]
+    if unknown:
+        parser.error('unknown stages: ' + ', '.join(unknown))
+
+    index = load_index(args.index)
+
+    failures = {}
+    for story, sessions in index.groupby('story', sort=False):
+        print('===', story, ':', len(sessions), 'session(s)', flush=True)
+        failed = run_story(story, args.index, args.stages, args.queue, args.force)
+        if failed is not None:
+            failures[story] = failed
+
+    for story, stage in failures.items():
+        print('FAILED:', story, 'at', stage)
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,177 @@
+# Authors: Kruthi Gollapudi (kruthig@uchicago.edu), Jadyn Park (jadynpark@uchicago.edu)
+# Last Edited: October 19, 2026
+# Description: Incremental across-subject aggregation of event-by-event pupil data.
+# Keeps per-event running sum, sum of squares and count, plus Poisson bootstrap replicate sums, so that
+# subjects can be added or removed without recomputing from every subject's file.
+
+import numpy as np
+import os
+import zlib
+
+# ------------------ Define functions ------------------ #
+def new_state(n_boot=5000, seed=0):
+    """
+    Creates an empty aggregation state.
+
+    Params:
+        n_boot: (int) number of bootstrap replicates used for the confidence interval
+        seed: (int) seed for the per-subject bootstrap weights
+
+    Returns:
+        state: (dict) empty aggregation state
+    """
+    return {
+        'subjects': [],
+        'mtimes': [],
+        'data': np.zeros((0, 0)),
+        'sum': np.zeros(0),
+        'sumsq': np.zeros(0),
+        'count': np.zeros(0),
+        'boot_sum': np.zeros((n_boot, 0)),
+        'boot_count': np.zeros((n_boot, 0)),
+        'n_boot': int(n_boot),
+        'seed': int(seed),
+    }
+
+
+def load_state(path, n_boot=5000, seed=0):
+    """
+    Loads the aggregation state from path, or returns a new state if there is none yet. A saved state built
+    with a different n_boot or seed is discarded (its bootstrap sums don't match), so every subject is re-added.
+    """
+    if not os.path.exists(path):
+        return new_state(n_boot, seed)
+
+    saved = np.load(path, allow_pickle=False)
+    state = {key: saved[key] for key in saved.files}
+    state['subjects'] = [str(s) for s in state['subjects']]
+    state['mtimes'] = [float(t) for t in state['mtimes']]
+    state['n_boot'] = int(state['n_boot'])
+    state['seed'] = int(state['seed'])
+
+    if (state['n_boot'], state['seed']) != (int(n_boot), int(seed)):
+        print("Aggregation state", path, "was built with n_boot =", state['n_boot'], "and seed =", state['seed'],
+              "; rebuilding with n_boot =", n_boot, "and seed =", seed)
+        return new_state(n_boot, seed)
+
+    return state
+
+
+def save_state(state, path):
+    """
+    Writes the aggregation state to path (.npz). Written to a temporary file first so an
+    interrupted save never leaves a corrupt state behind.
+    """
+    tmp_path = path + '.tmp.npz'
+    np.savez(tmp_path, **{key: np.asarray(val) for key, val in state.items()})
+    os.replace(tmp_path, path)
+
+
+def bootstrap_weights(subid, n_boot, seed):
+    """
+    Poisson(1) resampling weights of one subject for every bootstrap replicate.
+
+    The weights are derived from the subject ID, so the same subject always gets the same weights
+    and its contribution can be subtracted again when it is removed.
+    """
+    rng = np.random.default_rng([seed, zlib.crc32(subid.encode())])
+
+    return rng.poisson(1.0, n_boot).astype(float)
+
+
+def _grow(state, n_events):
+    """
+    Pads every per-event array with empty events up to n_events.
+    """
+    pad = n_events - len(state['sum'])
+    if pad <= 0:
+        return
+
+    for key in ('sum', 'sumsq', 'count'):
+        state[key] = np.concatenate((state[key], np.zeros(pad)))
+    for key in ('boot_sum', 'boot_count'):
+        state[key] = np.concatenate((state[key], np.zeros((state['n_boot'], pad))), axis=1)
+    state['data'] = np.concatenate((state['data'], np.full((len(state['subjects']), pad), np.nan)), axis=1)
+
+
+def _accumulate(state, subid, values, sign):
+    """
+    Adds (sign=1) or subtracts (sign=-1) one subject's event vector from the running sums.
+    """
+    finite = np.isfinite(values)
+    values = np.where(finite, values, 0).astype(np.float64) # float64 sums even for float32 data
+    w = bootstrap_weights(subid, state['n_boot'], state['seed'])
+
+    state['sum'] += sign * values
+    state['sumsq'] += sign * values ** 2
+    state['count'] += sign * finite
+    state['boot_sum'] += sign * w[:, None] * values
+    state['boot_count'] += sign * w[:, None] * finite
+
+
+def add_subject(state, subid, values, mtime=np.nan):
+    """
+    Adds a subject's event-by-event pupil data to the state in O(events).
+
+    Event vectors may differ in length between subjects; missing events (or NaNs) don't count.
+
+    Params:
+        state: (dict) aggregation state
+        subid: (str) subject ID, e.g. 'sub-1002'
+        values: (np.ndarray) average pupil size per event
+        mtime: (float) modification time of the subject's file, used to detect re-runs
+    """
+    if subid in state['subjects']:
+        remove_subject(state, subid)
+
+    values = np.asarray(values, dtype=float).flatten()
+    _grow(state, len(values))
+
+    n_events = len(state['sum'])
+    values = np.concatenate((values, np.full(n_events - len(values), np.nan)))
+
+    _accumulate(state, subid, values, 1)
+    state['subjects'].append(subid)
+    state['mtimes'].append(float(mtime))
+    state['data'] = np.vstack((state['data'], values[None, :]))
+
+
+def remove_subject(state, subid):
+    """
+    Removes a subject (e.g. excluded after QC) from the state in O(events).
+    """
+    idx = state['subjects'].index(subid)
+
+    _accumulate(state, subid, state['data'][idx], -1)
+    del state['subjects'][idx]
+    del state['mtimes'][idx]
+    state['data'] = np.delete(state['data'], idx, axis=0)
+
+
+def summarize(state, alpha=0.05):
+    """
+    Computes the across-subject mean, SEM and bootstrap confidence interval per event.
+
+    Params:
+        state: (dict) aggregation state
+        alpha: (float) the CI covers the central 1 - alpha of the bootstrap distribution
+
+    Returns:
+        summary: (dict) 'mean', 'sem', 'ci_lower', 'ci_upper' and 'count', one value per event
+    """
+    count = state['count']
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = state['sum'] / count
+        var = (state['sumsq'] - count * mean ** 2) / (count - 1)
+        sem = np.sqrt(np.clip(var, 0, None) / count)
+        boot_mean = state['boot_sum'] / state['boot_count']
+
+    sem[count < 2] = np.nan
+    ci_lower, ci_upper = np.full(len(count), np.nan), np.full(len(count), np.nan)
+    has_boot = np.isfinite(boot_mean).any(axis=0)
+    if has_boot.any():
+        ci_lower[has_boot], ci_upper[has_boot] = np.nanpercentile(
+            boot_mean[:, has_boot], [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=0)
+
+    return {'mean': mean, 'sem': sem, 'ci_lower': ci_lower, 'ci_upper': ci_upper, 'count': count}
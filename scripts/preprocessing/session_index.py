@@ -0,0 +1,99 @@
+# Authors: Kruthi Gollapudi (kruthig@uchicago.edu), Jadyn Park (jadynpark@uchicago.edu)
+# Last Edited: October 19, 2026
+# Description: Session index for running several stories (and repeated sessions) through the same pipeline.
+# The index (data/sessions.csv) has one row per subject x story x session with the story's event file and expected
+# length. A session's files are keyed '<subject>' for session 1 and '<subject>_s<session>' for later sessions.
+# The stages process one story at a time, selected with PARANOIA_STORY (default paranoia); other stories read and
+# write the same directories with a <story> subdirectory, so the paranoia layout is unchanged.
+# With PARANOIA_INDEX=<index csv> the stages take their sessions from the index instead of their subject range;
+# run_batch.py sets both to run every story of an index in one batch.
+
+import os
+import pandas as pd
+
+DEFAULT_STORY = 'paranoia'
+STORY = os.environ.get('PARANOIA_STORY', DEFAULT_STORY)
+INDEX = os.environ.get('PARANOIA_INDEX')
+
+DEFAULT_INDEX = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../data/sessions.csv'))
+INDEX_COLUMNS = ['subject', 'story', 'session', 'events_file', 'length_s']
+
+
+# ------------------ Define functions ------------------ #
+def session_key(subject, session=1):
+    """
+    File name key of a session: '1002' for a subject's first session, '1002_s2' for the second, ...
+    """
+    return str(subject) if int(session) == 1 else str(subject) + '_s' + str(int(session))
+
+
+def load_index(path=DEFAULT_INDEX):
+    """
+    Reads and checks the session index.
+
+    Params:
+        path: (str) index csv with columns subject, story, session, events_file (relative to the index's directory
+            or absolute) and length_s (expected story length in seconds)
+
+    Returns:
+        index: (pd.DataFrame) one row per session, with 'key' (session_key) and absolute 'events_file'
+    """
+    index = pd.read_csv(path, dtype={'subject': str, 'story': str})
+
+    missing = [col for col in INDEX_COLUMNS if col not in index.columns]
+    if missing:
+        raise ValueError(f"{path}: missing columns {missing}")
+
+    index['session'] = index['session'].fillna(1).astype(int)
+    duplicated = index.duplicated(['subject', 'story', 'session'])
+    if duplicated.any():
+        raise ValueError(f"{path}: duplicate subject/story/session in rows {list(index.index[duplicated])}")
+
+    # Every session of a story must agree on the story's event file and length
+    for col in ['events_file', 'length_s']:
+        inconsistent = index.groupby('story')[col].nunique() > 1
+        if inconsistent.any():
+            raise ValueError(f"{path}: stories with more than one {col}: {list(inconsistent.index[inconsistent])}")
+
+    index_dir = os.path.dirname(os.path.abspath(path))
+    index['events_file'] = [os.path.normpath(os.path.join(index_dir, f)) for f in index['events_file']]
+    index['key'] = [session_key(sub, ses) for sub, ses in zip(index['subject'], index['session'])]
+
+    return index
+
+
+def story_info(index, story=STORY):
+    """
+    Event file and expected length (s) of a story.
+    """
+    rows = index[index['story'] == story]
+    if len(rows) == 0:
+        raise ValueError("Story not in the session index: " + story)
+
+    return rows['events_file'].iloc[0], float(rows['length_s'].iloc[0])
+
+
+def story_sessions(index, story=STORY):
+    """
+    Session keys of a story, with subject IDs as int where they are numeric (like the stages' subject ranges).
+    """
+    keys = index.loc[index['story'] == story, 'key']
+
+    return [int(k) if k.isdigit() else k for k in keys]
+
+
+def story_path(path, story=STORY):
+    """
+    Directory of a stage's inputs or outputs for a story: path itself for paranoia, path/<story> otherwise.
+    """
+    return path if story == DEFAULT_STORY else os.path.join(path, story)
+
+
+def events_file(default, story=STORY, index_path=INDEX):
+    """
+    Event file of the current story: from the session index if PARANOIA_INDEX is set, otherwise default.
+    """
+    if index_path is None:
+        return default
+
+    return story_info(load_index(index_path), story)[0]
@@ -0,0 +1,66 @@
+# Authors: Kruthi Gollapudi (kruthig@uchicago.edu), Jadyn Park (jadynpark@uchicago.edu)
+# Last Edited: October 19, 2026
+# Description: Reads the task's <sub>_paranoia_timestamps.csv files (one column per event, in seconds on the task clock;
+# storyPause/storyRestart on consecutive rows) into one table indexed by subject and row, and converts story pauses
+# into windows relative to the STORY_START message sent to the eye tracker.
+
+import glob
+import os
+import numpy as np
+import pandas as pd
+
+
+# ------------------ Define functions ------------------ #
+def load_timestamps(ts_path, pattern='*_paranoia_timestamps.csv'):
+    """
+    Reads every timestamps csv in ts_path into one table.
+
+    Params:
+        ts_path: (str) directory with the timestamps csv files
+        pattern: (str) file name pattern, '*' followed by a fixed suffix; the subject ID (or session key, e.g.
+            '1002_s2') is the part of the file name before the suffix
+
+    Returns:
+        timestamps: (pd.DataFrame) indexed by (subject, row), one column per event
+    """
+    frames = []
+    for filename in sorted(glob.glob(os.path.join(ts_path, pattern))):
+        df = pd.read_csv(filename)
+        key = os.path.basename(filename)[:-(len(pattern) - 1)]
+        df.index = pd.MultiIndex.from_product([[int(key) if key.isdigit() else key], range(len(df))],
+                                              names=['subject', 'row'])
+        frames.append(df)
+
+    if not frames:
+        return pd.DataFrame(index=pd.MultiIndex.from_arrays([[], []], names=['subject', 'row']))
+
+    return pd.concat(frames).sort_index()
+
+
+def pause_windows(timestamps, sub):
+    """
+    Story pauses of a subject, in seconds after the STORY_START message (startETStory).
+    A pause without a restart (e.g. the session was aborted) lasts until the end of the story (inf).
+
+    Params:
+        timestamps: (pd.DataFrame) table from load_timestamps
+        sub: (int or str) subject ID or session key
+
+    Returns:
+        pauses: (np.ndarray) pause start of each pause
+        restarts: (np.ndarray) restart of each pause
+    """
+    if sub not in timestamps.index.get_level_values('subject') or 'storyPause' not in timestamps.columns:
+        return np.zeros(0), np.zeros(0)
+
+    session = timestamps.loc[sub]
+    story_start = session['startETStory'].dropna().iloc[0]
+    paused = session['storyPause'].notna()
+
+    pauses = session.loc[paused, 'storyPause'].to_numpy() - story_start
+    if 'storyRestart' in session.columns:
+        restarts = session.loc[paused, 'storyRestart'].to_numpy() - story_start
+    else:
+        restarts = np.full(len(pauses), np.nan)
+
+    return pauses, np.where(np.isnan(restarts), np.inf, restarts)
@@ -0,0 +1,184 @@
+# Authors: Kruthi Gollapudi (kruthig@uchicago.edu), Jadyn Park (jadynpark@uchicago.edu)
+# Last Edited: October 19, 2026
+# Description: Power spectra (Welch or multitaper) and inter-subject coherence of the subjects x time cohort matrix.
+# All subjects, segments and tapers are transformed in one batched rfft call. Segments containing NaNs (gaps that
+# stage 5 couldn't fill, or time points past the end of a shorter session) are left out per subject, and the
+# cross-spectra of a pair of subjects only use segments that are complete in both.
+
+import numpy as np
+from numpy.fft import rfft, rfftfreq
+from scipy.signal import windows
+
+
+# ------------------ Define functions ------------------ #
+def segment(data, nperseg, noverlap):
+    """
+    Cuts every subject's time series into overlapping segments.
+
+    Params:
+        data: (np.ndarray) subjects x time array (NaN for missing samples)
+        nperseg: (int) samples per segment
+        noverlap: (int) samples shared by consecutive segments
+
+    Returns:
+        segments: (np.ndarray) subjects x segments x nperseg array, each segment with its mean removed
+        valid: (np.ndarray) subjects x segments bool array, False for segments containing NaNs
+    """
+    data = np.asarray(data, dtype=np.float64)
+    if data.shape[1] < nperseg:
+        raise ValueError(f"Time series ({data.shape[1]} samples) are shorter than nperseg ({nperseg})")
+
+    step = nperseg - noverlap
+    starts = np.arange(0, data.shape[1] - nperseg + 1, step)
+    segments = data[:, starts[:, None] + np.arange(nperseg)]
+
+    valid = ~np.isnan(segments).any(axis=2)
+    segments = np.where(valid[:, :, None], segments, 0)
+    segments = segments - segments.mean(axis=2, keepdims=True)
+
+    return segments, valid
+
+
+def tapered_fft(data, fs, method='welch', nperseg=256, noverlap=None, NW=4):
+    """
+    Fourier coefficients of every (tapered) segment of every subject, from one batched rfft.
+
+    Params:
+        data: (np.ndarray) subjects x time array
+        fs: (float) sampling rate (Hz)
+        method: (str) 'welch' (Hann window, overlapping segments) or 'multitaper' (DPSS tapers)
+        nperseg: (int) samples per segment; for 'multitaper', None uses the whole time series as one segment
+        noverlap: (int) overlap of consecutive segments (default: nperseg // 2 for Welch, none for multitaper)
+        NW: (float) time-halfbandwidth product of the DPSS tapers (2 * NW - 1 tapers are used)
+
+    Returns:
+        freqs: (np.ndarray) frequencies (Hz)
+        coefs: (np.ndarray) subjects x estimates x freqs complex array, scaled so that |coefs|^2 is a one-sided
+            power spectral density; estimates are segments (Welch) or segments x tapers (multitaper)
+        valid: (np.ndarray) subjects x estimates bool array, False for estimates from segments with NaNs
+    """
+    data = np.asarray(data, dtype=np.float64)
+    if nperseg is None:
+        nperseg = data.shape[1]
+    if noverlap is None:
+        noverlap = nperseg // 2 if method == 'welch' else 0
+
+    segments, valid = segment(data, nperseg, noverlap)
+
+    if method == 'welch':
+        tapers = windows.hann(nperseg, sym=False)[None, :]
+    elif method == 'multitaper':
+        tapers = windows.dpss(nperseg, NW, Kmax=int(2 * NW) - 1)
+    else:
+        raise ValueError("method must be 'welch' or 'multitaper', not " + str(method))
+
+    # subjects x segments x tapers x time -> one rfft over the last axis
+    coefs = rfft(segments[:, :, None, :] * tapers[None, None, :, :], axis=-1)
+    coefs *= np.sqrt(1 / (fs * (tapers ** 2).sum(axis=1)))[None, None, :, None]
+
+    # One-sided spectrum: double every frequency except 0 and Nyquist
+    one_sided = np.full(coefs.shape[-1], np.sqrt(2))
+    one_sided[0] = 1
+    if nperseg % 2 == 0:
+        one_sided[-1] = 1
+    coefs *= one_sided
+
+    n_sub = data.shape[0]
+    coefs = coefs.reshape(n_sub, -1, coefs.shape[-1])
+    valid = np.repeat(valid, tapers.shape[0], axis=1)
+
+    return rfftfreq(nperseg, 1 / fs), coefs, valid
+
+
+def power_spectra(coefs, valid):
+    """
+    Power spectral density of every subject, averaged over its complete segments (NaN if there are none).
+
+    Returns:
+        psd: (np.ndarray) subjects x freqs array
+    """
+    n = valid.sum(axis=1)
+    power = np.einsum('se,sef->sf', valid, np.abs(coefs) ** 2)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return power / n[:, None]
+
+
+def coherence(coefs, valid):
+    """
+    Magnitude-squared coherence of every pair of subjects, and of every subject with the average of everyone else.
+    Pairs use the segments that are complete in both subjects.
+
+    Returns:
+        pairwise: (np.ndarray) subjects x subjects x freqs array (NaN on the diagonal and for pairs without
+            common segments)
+        loo: (np.ndarray) subjects x freqs array of coherence with the leave-one-out average
+    """
+    n_sub = coefs.shape[0]
+    v = valid.astype(np.float64)
+    power = np.abs(coefs) ** 2
+
+    # Cross- and auto-spectra over jointly complete segments (sums; the common count cancels out)
+    cross = np.einsum('ie,je,ief,jef->ijf', v, v, coefs, coefs.conj())
+    auto_i = np.einsum('ie,je,ief->ijf', v, v, power)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pairwise = np.abs(cross) ** 2 / (auto_i * auto_i.transpose(1, 0, 2))
+    pairwise[np.arange(n_sub), np.arange(n_sub)] = np.nan
+
+    # Leave-one-out average: Fourier coefficients are linear, so average the other subjects' coefficients
+    # over segments where they are complete
+    v_sum = v.sum(axis=0)
+    c_sum = np.einsum('ie,ief->ef', v, coefs)
+    loo = np.full((n_sub, coefs.shape[-1]), np.nan)
+    for i in range(n_sub):
+        n_others = v_sum - v[i]
+        use = (valid[i]) & (n_others > 0)
+        if not use.any():
+            continue
+        others = (c_sum[use] - v[i, use, None] * coefs[i, use]) / n_others[use, None]
+        s_xy = np.sum(coefs[i, use] * others.conj(), axis=0)
+        s_xx = np.sum(np.abs(coefs[i, use]) ** 2, axis=0)
+        s_yy = np.sum(np.abs(others) ** 2, axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            loo[i] = np.abs(s_xy) ** 2 / (s_xx * s_yy)
+
+    return pairwise, loo
+
+
+def band_summary(freqs, psd, pairwise, loo, bands):
+    """
+    Group power and inter-subject coherence per frequency band.
+
+    Params:
+        freqs: (np.ndarray) frequencies (Hz)
+        psd: (np.ndarray) subjects x freqs power spectra
+        pairwise, loo: (np.ndarray) coherence from coherence()
+        bands: (dict) band name -> (low, high) in Hz, low inclusive and high exclusive
+
+    Returns:
+        rows: (list of dict) per band: mean and SEM over subjects of the band power (integrated PSD) and the
+            relative power (fraction of the total), mean pairwise coherence and mean leave-one-out coherence
+        subj_power: (dict) band name -> band power of every subject
+    """
+    df = freqs[1] - freqs[0]
+    total = np.nansum(psd[:, freqs > 0], axis=1) * df
+    n_sub = psd.shape[0]
+    pairs = np.triu_indices(n_sub, k=1)
+
+    rows = []
+    subj_power = {}
+    for name, (low, high) in bands.items():
+        in_band = (freqs >= low) & (freqs < high)
+        power = psd[:, in_band].sum(axis=1) * df
+        relative = power / total
+        n = np.sum(~np.isnan(power))
+        subj_power[name] = power
+
+        rows.append({'band': name, 'low_hz': low, 'high_hz': high, 'n_freqs': int(in_band.sum()),
+                     'power_mean': np.nanmean(power), 'power_sem': np.nanstd(power, ddof=1) / np.sqrt(n),
+                     'relative_power_mean': np.nanmean(relative),
+                     'relative_power_sem': np.nanstd(relative, ddof=1) / np.sqrt(n),
+                     'coherence_pairwise': np.nanmean(pairwise[pairs[0], pairs[1]][:, in_band]),
+                     'coherence_loo': np.nanmean(loo[:, in_band])})
+
+    return rows, subj_power
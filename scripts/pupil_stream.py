@@ -0,0 +1,73 @@
+# Authors: Kruthi Gollapudi (kruthig@uchicago.edu), Jadyn Park (jadynpark@uchicago.edu)
+# Last Edited: October 19, 2026
+# Description: Publishes the eyetracker's pupil samples and the task's event markers over LSL so that
+# arousal can be monitored live (see online_pupil.py).
+
+from pylsl import StreamInfo, StreamOutlet, local_clock
+from psychopy import core
+from psychopy.iohub.constants import EventConstants
+from stream_names import STREAM_NAME, MARKER_STREAM_NAME
+
+CHANNELS = ['pupilSize', 'gazeX', 'gazeY']
+
+
+class PupilStreamPublisher:
+    """
+    Forwards iohub eye samples to an LSL outlet, and task messages to an LSL marker outlet.
+
+    pump() has to be called regularly from the task's main thread: the iohub client connection is not
+    shared across threads, and iohub buffers the samples between calls. Sample times are converted from
+    the iohub clock to the LSL clock, so they stay exact regardless of how often pump() is called.
+
+    Params:
+        tracker: iohub eyetracker device
+        sampling_rate: (int) nominal sampling rate of the tracker (Hz)
+        source_id: (str) unique ID of the stream, so receivers can reconnect after an interruption
+    """
+
+    def __init__(self, tracker, sampling_rate=500, source_id='paranoia_et'):
+        self.tracker = tracker
+
+        info = StreamInfo(STREAM_NAME, 'Pupil', len(CHANNELS), sampling_rate, 'float32', source_id)
+        channels = info.desc().append_child('channels')
+        for label in CHANNELS:
+            channels.append_child('channel').append_child_value('label', label)
+        self.outlet = StreamOutlet(info)
+
+        marker_info = StreamInfo(MARKER_STREAM_NAME, 'Markers', 1, 0, 'string', source_id + '_markers')
+        self.marker_outlet = StreamOutlet(marker_info)
+
+        # Offset between the LSL clock and the iohub/psychopy clock
+        self.clock_offset = local_clock() - core.getTime()
+        self.n_samples = 0
+
+    def pump(self):
+        """
+        Pushes all eye samples received by iohub since the last call. Returns the number of samples sent.
+        """
+        samples = self.tracker.getEvents(event_type_id=EventConstants.MONOCULAR_EYE_SAMPLE)
+        if not samples:
+            return 0
+
+        chunk = [[s.pupil_measure1, s.gaze_x, s.gaze_y] for s in samples]
+        timestamps = [s.time + self.clock_offset for s in samples]
+        self.outlet.push_chunk(chunk, timestamps)
+        self.n_samples += len(chunk)
+
+        return len(chunk)
+
+    def discard(self):
+        """
+        Clears the eye samples iohub has buffered since the last call without sending them (e.g. the samples
+        recorded during the instructions). Returns the number of samples dropped.
+        """
+        return len(self.tracker.getEvents(event_type_id=EventConstants.MONOCULAR_EYE_SAMPLE) or [])
+
+    def push_marker(self, marker, time=None):
+        """
+        Sends a task event (e.g. "STORY_START") on the marker stream, stamped with time (psychopy clock,
+        e.g. a scheduled audio onset) or with the current time.
+        """
+        if time is None:
+            time = core.getTime()
+        self.marker_outlet.push_sample([marker], time + self.clock_offset)
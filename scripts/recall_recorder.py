@@ -0,0 +1,102 @@
+# Authors: Kruthi Gollapudi (kruthig@uchicago.edu), Jadyn Park (jadynpark@uchicago.edu)
+# Last Edited: October 19, 2026
+# Description: Records the free-recall audio straight to a WAV file from a background thread.
+# Audio is pulled from a bounded psychtoolbox capture buffer in short chunks and appended to the WAV file,
+# so nothing is lost if the task crashes and recall length isn't limited by memory. Every chunk's capture time
+# is written to a sidecar CSV, relative to the REC_START message, to line speech up with the pupil data.
+
+import csv
+import threading
+import wave
+import numpy as np
+from psychtoolbox import audio
+
+
+class RecallRecorder:
+    """
+    Background recorder writing microphone input to wav_path, with chunk timings in wav_path[:-4] + '_chunks.csv'.
+
+    Params:
+        wav_path: (str) path of the WAV file to write
+        device_index: (int) psychtoolbox index of the recording device
+        sample_rate: (int) sampling rate (Hz)
+        channels: (int) number of channels
+        chunk_secs: (float) how often the capture buffer is emptied to disk
+        buffer_secs: (float) size of the capture buffer; the writer has this long to catch up before samples are lost
+    """
+
+    def __init__(self, wav_path, device_index, sample_rate=48000, channels=1, chunk_secs=0.1, buffer_secs=10.0):
+        self.wav_path = wav_path
+        self.chunk_secs = chunk_secs
+        self.sample_rate = sample_rate
+        self.channels = channels
+
+        self._stream = audio.Stream(device_id=device_index, mode=2, latency_class=1, freq=sample_rate, channels=channels)
+        self._stream.get_audio_data(buffer_secs) # allocate the capture buffer
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.n_chunks = 0
+        self.n_samples = 0
+        self.n_overflows = 0
+        self.rec_start = None
+
+    def start(self, rec_start):
+        """
+        Starts recording.
+
+        Params:
+            rec_start: (float) ptb time at which REC_START was sent to the tracker
+
+        Returns:
+            (float) estimated ptb time of the first recorded sample
+        """
+        self.rec_start = rec_start
+
+        self._wav = wave.open(self.wav_path, 'wb')
+        self._wav.setnchannels(self.channels)
+        self._wav.setsampwidth(2)
+        self._wav.setframerate(self.sample_rate)
+
+        self._chunk_file = open(self.wav_path[:-4] + '_chunks.csv', 'w', newline='')
+        self._chunks = csv.writer(self._chunk_file)
+        self._chunks.writerow(['chunk', 'first_sample', 'n_samples', 'capture_time', 'time_from_rec_start', 'overflow'])
+
+        start_time = self._stream.start(0, 0, 1)
+        self._thread = threading.Thread(target=self._run, name='RecallRecorder', daemon=True)
+        self._thread.start()
+
+        return start_time
+
+    def _write_chunk(self):
+        data, _, overflow, capture_time = self._stream.get_audio_data()
+        if data is None or len(data) == 0:
+            return
+
+        samples = np.clip(np.asarray(data) * 32767, -32768, 32767).astype('<i2')
+        self._wav.writeframes(samples.tobytes()) # also updates the WAV header, so partial files stay readable
+        self._chunks.writerow([self.n_chunks, self.n_samples, len(samples), capture_time, capture_time - self.rec_start, int(overflow)])
+        self._chunk_file.flush()
+
+        self.n_chunks += 1
+        self.n_samples += len(samples)
+        self.n_overflows += int(overflow > 0)
+
+    def _run(self):
+        while not self._stop.wait(self.chunk_secs):
+            self._write_chunk()
+
+    def stop(self):
+        """
+        Stops recording, writes the remaining audio and closes the files. Returns the recording length (s).
+        """
+        self._stop.set()
+        self._thread.join()
+        self._stream.stop()
+        self._write_chunk()
+        self._stream.close()
+
+        self._wav.close()
+        self._chunk_file.close()
+
+        return self.n_samples / self.sample_rate
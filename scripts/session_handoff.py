@@ -0,0 +1,177 @@
+# Authors: Kruthi Gollapudi (kruthig@uchicago.edu), Jadyn Park (jadynpark@uchicago.edu)
+# Last Edited: October 19, 2026
+# Description: Hands a finished session's eye tracking data off to a background process, so the experimenter can
+# start the next participant right away. The task only renames et_data.EDF to a session-specific name (instant, and
+# frees the name for the next session); the background process then
+#   1. copies the EDF to data/pupil/1_edf/<key>/ and verifies it with a SHA-256 checksum (<file>.EDF.sha256),
+#   2. copies the session's timestamps to data/timestamps/<key>_<story>_timestamps.csv,
+#   3. converts the EDF to data/pupil/2_mat/<key>/<key>_ET.mat with Edf2Mat (MATLAB), as stage 1 expects,
+#   4. runs stage 1 (1_align_pupil.py) for this session only.
+# <key> is the session key ('<sub>', or '<sub>_s<session>' for repeated sessions); stories other than paranoia go to
+# <story> subdirectories of 1_edf and 2_mat (see preprocessing/session_index.py).
+# Progress is written to data/pupil/1_edf/<key>/<key>_handoff.json and the output to <key>_handoff.log.
+# To rerun the steps for a session by hand:
+#   python session_handoff.py <pending EDF> <participant> <session file base> [<story> <session>]
+
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+_thisDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(_thisDir, 'preprocessing'))
+from session_index import DEFAULT_STORY, session_key, story_path
+
+DATA_PATH = os.path.normpath(os.path.join(_thisDir, '..', 'data'))
+EDF_PATH = os.path.join(DATA_PATH, 'pupil', '1_edf')
+MAT_PATH = os.path.join(DATA_PATH, 'pupil', '2_mat')
+TS_PATH = os.path.join(DATA_PATH, 'timestamps')
+PREPROCESSING_PATH = os.path.join(_thisDir, 'preprocessing')
+
+# EDF -> .mat conversion (Edf2Mat toolbox, https://github.com/uzh/edf-converter, on the MATLAB path)
+CONVERT_CMD = ['matlab', '-batch',
+               "edf = Edf2Mat('{edf}'); Samples = edf.Samples; Events = edf.Events; "
+               "save('{mat}', 'Samples', 'Events', '-v7.3');"]
+
+
+# ------------------ Define functions ------------------ #
+def start_handoff(edf_file, participant, session_file, story=DEFAULT_STORY, session=1):
+    """
+    Moves the tracker's EDF out of the way and starts the background process. Returns immediately.
+
+    Params:
+        edf_file: (str) EDF written by the tracker (et_data.EDF)
+        participant: (str) participant ID
+        session_file: (str) base path of the session's files (data/<key>_<story>_<date>)
+        story: (str) story of the session
+        session: (int) session number of the participant for this story
+
+    Returns:
+        (subprocess.Popen) the background process, or None if there is no EDF
+    """
+    if not os.path.exists(edf_file):
+        print("WARNING: no EDF file found at", edf_file)
+        return None
+
+    # Same directory, so the rename is instant
+    pending = os.path.join(os.path.dirname(os.path.abspath(edf_file)), os.path.basename(session_file) + '.EDF')
+    os.replace(edf_file, pending)
+
+    key = session_key(participant, session)
+    out_dir = os.path.join(story_path(EDF_PATH, story), key)
+    os.makedirs(out_dir, exist_ok=True)
+    log = open(os.path.join(out_dir, key + '_handoff.log'), 'a')
+
+    # Detached, so it keeps running after the task quits
+    if os.name == 'nt':
+        detach = {'creationflags': subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP}
+    else:
+        detach = {'start_new_session': True}
+
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__), pending, str(participant), session_file,
+                             story, str(session)],
+                            stdout=log, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL, cwd=_thisDir, **detach)
+
+
+def sha256(path):
+    """
+    Computes the SHA-256 hash of a file's contents.
+    """
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+
+    return h.hexdigest()
+
+
+def copy_verified(src, dst):
+    """
+    Copies src to dst, hashing while copying, and checks the copy against that hash.
+
+    Returns:
+        digest: (str) SHA-256 of the file
+    """
+    h = hashlib.sha256()
+    tmp = dst + '.part'
+    with open(src, 'rb') as fin, open(tmp, 'wb') as fout:
+        for block in iter(lambda: fin.read(1 << 20), b''):
+            h.update(block)
+            fout.write(block)
+        fout.flush()
+        os.fsync(fout.fileno())
+
+    digest = h.hexdigest()
+    if sha256(tmp) != digest:
+        os.remove(tmp)
+        raise IOError("Checksum mismatch copying " + src)
+    os.replace(tmp, dst)
+
+    with open(dst + '.sha256', 'w') as f:
+        f.write(digest + '  ' + os.path.basename(dst) + '\n')
+
+    return digest
+
+
+def run_handoff(pending, participant, session_file, story=DEFAULT_STORY, session=1):
+    """
+    Retrieves, checksums and converts the EDF of a session and aligns it with stage 1 (see the description above).
+    Steps that fail are recorded in the status file; later steps that depend on them are skipped.
+    """
+    key = session_key(participant, session)
+    out_dir = os.path.join(story_path(EDF_PATH, story), key)
+    os.makedirs(out_dir, exist_ok=True)
+    status_file = os.path.join(out_dir, key + '_handoff.json')
+    status = {'participant': participant, 'story': story, 'session': int(session),
+              'session_file': os.path.basename(session_file), 'started': time.time()}
+
+    def update(**kwargs):
+        status.update(kwargs)
+        with open(status_file, 'w') as f:
+            json.dump(status, f, indent=1)
+        print(time.strftime('%H:%M:%S'), kwargs, flush=True)
+
+    # 1. Retrieve and checksum the EDF
+    edf = os.path.join(out_dir, os.path.basename(pending))
+    try:
+        update(sha256=copy_verified(pending, edf), edf=edf)
+        os.remove(pending)
+    except OSError as e:
+        update(error='retrieve: ' + str(e))
+        return status
+
+    # 2. Timestamps, where stage 1 reads them
+    ts_file = session_file + '_timestamps.csv'
+    if os.path.exists(ts_file):
+        os.makedirs(TS_PATH, exist_ok=True)
+        shutil.copy2(ts_file, os.path.join(TS_PATH, key + '_' + story + '_timestamps.csv'))
+        update(timestamps=True)
+    else:
+        update(timestamps=False)
+
+    # 3. Convert to the .mat stage 1 reads
+    mat_dir = os.path.join(story_path(MAT_PATH, story), key)
+    mat = os.path.join(mat_dir, key + '_ET.mat')
+    if shutil.which(CONVERT_CMD[0]) is None:
+        update(converted=False, error='convert: ' + CONVERT_CMD[0] + ' not found')
+        return status
+    os.makedirs(mat_dir, exist_ok=True)
+    result = subprocess.run([arg.format(edf=edf, mat=mat) for arg in CONVERT_CMD])
+    if result.returncode != 0 or not os.path.exists(mat):
+        update(converted=False, error='convert: exit code ' + str(result.returncode))
+        return status
+    update(converted=True, mat=mat)
+
+    # 4. Stage 1 for this session only
+    result = subprocess.run([sys.executable, '1_align_pupil.py'], cwd=PREPROCESSING_PATH,
+                            env=dict(os.environ, PARANOIA_SUBJECTS=key, PARANOIA_STORY=story))
+    update(aligned=result.returncode == 0, finished=time.time())
+
+    return status
+
+
+if __name__ == '__main__':
+    run_handoff(*sys.argv[1:6])
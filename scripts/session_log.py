@@ -0,0 +1,103 @@
+# Authors: Kruthi Gollapudi (kruthig@uchicago.edu), Jadyn Park (jadynpark@uchicago.edu)
+# Last Edited: October 19, 2026
+# Description: Append-only session event log for the task script. Events are timestamped on the presentation
+# thread and written to disk (one flushed, fsync'ed line per event) by a background thread, so the playback loop
+# never waits on disk I/O. At the end of the session the log is consolidated into the wide _timestamps.csv layout.
+# A log left behind by a crashed session can be consolidated with: python session_log.py <file>_events.log
+
+import csv
+import os
+import queue
+import sys
+import threading
+import pandas as pd
+
+
+class SessionEventLog:
+    """
+    Background writer for session events.
+
+    Each event is a (column, row, value) cell of the wide timestamps table, e.g. ('storyPause', 2, 812.4)
+    for the third pause. Lines are only ever appended, so a crash loses at most the event being written.
+
+    Params:
+        log_path: (str) path of the event log
+        participant: (str) participant ID, logged as the 'id' cell
+    """
+
+    def __init__(self, log_path, participant):
+        self.log_path = log_path
+        self._queue = queue.Queue()
+        self._file = open(log_path, 'a', newline='')
+        self._writer = csv.writer(self._file)
+        self._thread = threading.Thread(target=self._run, name='SessionEventLog', daemon=True)
+        self._thread.start()
+
+        self.log('id', participant)
+
+    def log(self, column, value, row=0):
+        """
+        Queues an event for writing; returns immediately.
+        """
+        self._queue.put((column, row, value))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            self._writer.writerow(item)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        """
+        Writes the remaining events and closes the log.
+        """
+        self._queue.put(None)
+        self._thread.join()
+        self._file.close()
+
+
+def consolidate_log(log_path, csv_path):
+    """
+    Rebuilds the wide timestamps table (one column per event, pauses/restarts on consecutive rows)
+    from an event log and saves it to csv_path. A last line that doesn't end in a newline was cut off by a
+    crash mid-write (its value may be truncated, e.g. 12 for 12.75) and is ignored.
+
+    Params:
+        log_path: (str) path of the event log
+        csv_path: (str) path of the _timestamps.csv to write
+
+    Returns:
+        dfTimeStamps: (pd.DataFrame) the consolidated table
+    """
+    dfTimeStamps = pd.DataFrame()
+
+    with open(log_path, newline='') as f:
+        content = f.read()
+
+    # Every complete record ends in a newline; drop whatever follows the last one
+    complete = content[:content.rfind('\n') + 1]
+    if len(complete) < len(content):
+        print("Ignoring incomplete last line of", log_path, ":", repr(content[len(complete):]))
+
+    for line in csv.reader(complete.splitlines()):
+        if len(line) != 3:
+            continue
+        column, row, value = line
+        if column != 'id':
+            try:
+                value = float(value)
+            except ValueError:
+                continue
+        dfTimeStamps.loc[int(row), column] = value
+
+    dfTimeStamps.to_csv(csv_path, index=False)
+
+    return dfTimeStamps
+
+
+if __name__ == '__main__':
+    log_path = sys.argv[1]
+    consolidate_log(log_path, log_path.replace('_events.log', '_timestamps.csv'))
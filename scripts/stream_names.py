@@ -0,0 +1,7 @@
+# Authors: Kruthi Gollapudi (kruthig@uchicago.edu), Jadyn Park (jadynpark@uchicago.edu)
+# Last Edited: October 19, 2026
+# Description: Names of the LSL streams shared by the publisher in the task (pupil_stream.py) and the online monitor
+# (online_pupil.py). Kept free of PsychoPy imports so the monitor only needs pylsl.
+
+STREAM_NAME = 'paranoia_pupil'
+MARKER_STREAM_NAME = 'paranoia_markers'